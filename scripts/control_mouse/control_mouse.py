@@ -18,19 +18,24 @@ def control_mouse(config: MouseConfig, model_path: str):
     eeg.on()
 
     # Start controlling the virtual mouse
-    while True:
+    try:
+        while True:
 
-        # Monitor the movement to indicate standstill
-        vm.monitor(r=25, counter_limit=5, interval=0.4)
+            # Monitor the movement to indicate standstill
+            vm.monitor(r=25, counter_limit=5, interval=0.4)
 
-        # Predict the label imagined by the user
-        label = vm.predict(buffer_time=4)
+            # Predict the label imagined by the user
+            label = vm.predict(buffer_time=4)
 
-        # Convert the label to action according to current config
-        action = config.get_action(label=label)
+            # Convert the label to action according to current config
+            action = config.get_action(label=label)
 
-        # Execute the action
-        vm.execute(action=action)
+            # Execute the action
+            vm.execute(action=action)
+
+    finally:
+        # The latency percentiles of the session
+        vm.print_latency()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,22 @@
+import glob
+import os
+from bci4als.recording import convert_pickle
+
+
+def convert_recordings(recordings_path: str):
+    """
+    Convert all the sessions saved as `trials.pickle` to the columnar recording format.
+    :param recordings_path: path to the recordings folder (recordings/<subject>/<session>)
+    :return:
+    """
+
+    for session_directory in sorted(glob.glob(os.path.join(recordings_path, '*', '*'))):
+
+        if convert_pickle(session_directory):
+
+            print(f'Converted {session_directory}')
+
+
+if __name__ == '__main__':
+
+    convert_recordings(recordings_path='../recordings')
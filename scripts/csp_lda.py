@@ -1,19 +1,15 @@
 import os
-import pickle
-from typing import List
 
 import matplotlib.pyplot as plt
 import mne
 import numpy as np
-import pandas as pd
+from bci4als.evaluation import cross_validate
+from bci4als.recording import TrialsRecording
 from mne.channels import make_standard_montage
 from mne.decoding import CSP
 from numpy import ndarray
-from pandas import DataFrame
-from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
-from sklearn.metrics import plot_confusion_matrix
-from sklearn.model_selection import ShuffleSplit, cross_val_score
-from sklearn.pipeline import Pipeline
+from sklearn.metrics import ConfusionMatrixDisplay
+from sklearn.model_selection import ShuffleSplit
 
 
 ###############################################################################
@@ -24,19 +20,18 @@ from sklearn.pipeline import Pipeline
 recordings_path = '../recordings'
 subject = 'adi'
 session_id = '6'
-labels_path = os.path.join(recordings_path, subject, session_id, 'labels.csv')
-trials_path = os.path.join(recordings_path, subject, session_id, 'trials.pickle')
+session_path = os.path.join(recordings_path, subject, session_id)
 
-# load data
-trials: List[DataFrame] = pickle.load(open(trials_path, 'rb'))
-labels = pd.read_csv(labels_path, header=None).to_numpy().squeeze()
+# load data (sessions recorded as trials.pickle can be converted with scripts/convert_recordings.py)
+recording = TrialsRecording(session_path)
+labels = recording.labels
 
 # convert data to mne.Epochs
-ch_names = list(trials[0].columns)
+ch_names = recording.ch_names
 ch_types = ['eeg'] * len(ch_names)
 sfreq = 120
 
-epochs_array: ndarray = np.stack([df[:480].to_numpy().T for df in trials])
+epochs_array: ndarray = recording.epochs(n_samples=480)
 
 info = mne.create_info(ch_names, sfreq, ch_types)
 epochs = mne.EpochsArray(epochs_array, info)
@@ -51,25 +46,17 @@ epochs.filter(7., 30., fir_design='firwin', skip_by_annotation='edge')
 # apply notch filter at 25
 # epochs.filter(24.5, 25.5, fir_design='firwin', skip_by_annotation='edge')
 
-epochs_train = epochs.copy().crop(tmin=0.5, tmax=1.5)
-
 ###############################################################################
 # Fit data with CSP and linear discriminant analysis
 
 epochs_data = epochs.get_data()
-epochs_data_train = epochs_train.get_data()
 
 
 # plot epochs
 epochs.plot_psd()
 
-# Assemble a classifier
-lda = LinearDiscriminantAnalysis()
+# Fit CSP on the full data
 csp = CSP(n_components=6, reg=None, log=True, norm_trace=False)
-
-# Use scikit-learn Pipeline with cross_val_score function
-clf = Pipeline([('CSP', csp), ('LDA', lda)])
-
 csp.fit_transform(epochs_data, labels)
 
 # plot CSP patterns estimated on full data for visualization
@@ -77,50 +64,25 @@ csp.plot_patterns(epochs.info, ch_type='eeg', units='Patterns (AU)', size=1.5)
 
 ###############################################################################
 # Look at performance over time
-# Define a monte-carlo cross-validation generator (reduce variance):
+# Define a monte-carlo cross-validation generator (reduce variance), the folds are scored in parallel
+# and each fold scores all the sliding windows of the running classifier at once
 
 cv = ShuffleSplit(4, test_size=0.2, random_state=42)
-scores = cross_val_score(clf, epochs_data_train, labels, cv=cv, n_jobs=1)
-print(f"Cross val score on training data: {scores}")
-
-cv_split = cv.split(epochs_data_train)
-w_length = int(sfreq * 0.5)  # running classifier: window length
-w_step = int(sfreq * 0.1)  # running classifier: window step size
-w_start = np.arange(0, epochs_data.shape[2] - w_length, w_step)
-
-scores_windows = []
-
-for idx, (train_idx, test_idx) in enumerate(cv_split):
-    y_train, y_test = labels[train_idx], labels[test_idx]
-
-    X_train = csp.fit_transform(epochs_data_train[train_idx], y_train)
-    X_test = csp.transform(epochs_data_train[test_idx])
-
-    # fit classifier
-    lda.fit(X_train, y_train)
-
-    # running classifier: test classifier on sliding window
-    score_this_window = []
-    for n in w_start:
-        X_test = csp.transform(epochs_data[test_idx][:, :, n:(n + w_length)])
-        score_this_window.append(lda.score(X_test, y_test))
-    scores_windows.append(score_this_window)
-
-    # print confusion matrix
-    try:
-        label_names = ['right', 'left', 'idle', 'tongue', 'legs']
-        y_pred = lda.predict(X_test)
-        plot_confusion_matrix(lda, X_test, y_test, normalize='true', display_labels=label_names)
-        plt.title(f"fold number {idx}")
-        plt.show()
-    except ValueError as e:
-        pass
+result = cross_validate(epochs_data, labels, sfreq, train_window=(0.5, 1.5), w_length=0.5, w_step=0.1,
+                        cv=cv, n_jobs=-1, tmin=epochs.tmin)
+print(f"Cross val score on training data: {result.scores}")
+
+# print confusion matrix
+label_names = ['right', 'left', 'idle', 'tongue', 'legs']
+for idx, confusion in enumerate(result.confusion):
+    normalized = confusion / np.maximum(confusion.sum(axis=1, keepdims=True), 1)
+    ConfusionMatrixDisplay(normalized, display_labels=[label_names[c] for c in result.classes]).plot()
+    plt.title(f"fold number {idx}")
+    plt.show()
 
 # Plot scores over time
-w_times = (w_start + w_length / 2.) / sfreq + epochs.tmin
-
 plt.figure()
-plt.plot(w_times, np.mean(scores_windows, 0), label='Score')
+plt.plot(result.window_times, np.mean(result.window_scores, 0), label='Score')
 plt.axvline(0, linestyle='--', color='k', label='Onset')
 plt.axhline(0.2, linestyle='-', color='k', label='Chance')
 plt.xlabel('time (s)')
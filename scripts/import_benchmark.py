@@ -0,0 +1,50 @@
+import statistics
+import subprocess
+import sys
+from typing import Dict
+
+# Import statements and their time budget in seconds (median of fresh interpreters)
+BUDGETS: Dict[str, float] = {
+    'import bci4als': 0.05,
+    'from bci4als import EEG': 1.0,
+    'from bci4als import MLModel': 1.0,
+}
+
+
+def import_time(statement: str, repeat: int = 5) -> float:
+    """
+    Measure the time of an import statement in a fresh python interpreter.
+    :param statement: the import statement
+    :param repeat: number of interpreters to run
+    :return: the median time in seconds
+    """
+    code = f'import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)'
+    times = [float(subprocess.run([sys.executable, '-c', code], check=True, capture_output=True,
+                                  text=True).stdout) for _ in range(repeat)]
+
+    return statistics.median(times)
+
+
+def import_benchmark(repeat: int = 5) -> bool:
+    """
+    Check the import time of the package against the budgets.
+    Use `python -X importtime -c "<statement>"` to find which module is slow.
+    :param repeat: number of interpreters to run for each statement
+    :return: whether all the statements are within their budget
+    """
+    ok = True
+
+    for statement, budget in BUDGETS.items():
+
+        seconds = import_time(statement, repeat)
+        status = 'OK' if seconds <= budget else 'OVER BUDGET'
+        ok &= seconds <= budget
+
+        print(f'{statement:<30} {seconds * 1000:8.1f} ms (budget {budget * 1000:.0f} ms) {status}')
+
+    return ok
+
+
+if __name__ == '__main__':
+
+    sys.exit(0 if import_benchmark() else 1)
@@ -24,6 +24,9 @@ def offline_experiment():
     # Dump the MLModel
     pickle.dump(model, open(os.path.join(session_directory, 'model.pickle'), 'wb'))
 
+    # Compact inference-only model (the trials are referenced by the session folder)
+    model.export(os.path.join(session_directory, 'model.npz'), eeg, training_sessions=[session_directory])
+
 
 if __name__ == '__main__':
 
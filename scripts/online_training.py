@@ -1,27 +1,30 @@
-import pickle
-
-from bci4als.ml_model import MLModel
+from bci4als.ml_model import load_model
 from bci4als.experiments.online import OnlineExperiment
 from bci4als.eeg import EEG
 
 
 def run_experiment(model_path: str):
 
-    model = pickle.load(open(model_path, 'rb'))
+    # model.pickle (of an offline session, or of a co-learning session - written when the session ends),
+    # or the session folder itself. The compact model.npz starts faster, but it is inference-only: it can
+    # not be updated, so use it only with co_learning=False
+    model = load_model(model_path)
+    co_learning = not model_path.endswith('.npz')
 
     SYNTHETIC_BOARD = -1
     CYTON_DAISY = 2
     eeg = EEG(board_id=SYNTHETIC_BOARD)
 
     exp = OnlineExperiment(eeg=eeg, model=model, num_trials=10, buffer_time=4, threshold=3, skip_after=8,
-                           co_learning=True, debug=False)
+                           co_learning=co_learning, debug=False)
 
     exp.run(use_eeg=True, full_screen=True)
 
 
 if __name__ == '__main__':
 
-    model_path = r'../recordings/avi/23/model.pickle'
+    # Continue from the model of the last co-learning session
+    model_path = r'../recordings/avi/23'
     # model_path = None  # use if synthetic
     run_experiment(model_path=model_path)
 
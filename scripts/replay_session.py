@@ -0,0 +1,28 @@
+import os
+import pickle
+
+from bci4als.eeg import EEG
+from bci4als.experiments.replay import ReplayExperiment
+
+
+def replay_session(model_path: str, recording_directory: str, session_directory: str):
+
+    model = pickle.load(open(model_path, 'rb'))
+
+    CYTON_DAISY = 2
+    eeg = EEG(board_id=CYTON_DAISY, serial_port='')
+
+    exp = ReplayExperiment(eeg=eeg, model=model, recording_directory=recording_directory,
+                           session_directory=session_directory, buffer_time=4, threshold=3, skip_after=8,
+                           co_learning=False, speed=None)
+
+    exp.run()
+
+
+if __name__ == '__main__':
+
+    # Replay the trials of one session with the model of another (results.json is saved in the replay folder)
+    model_path = r'../recordings/avi/20/model.pickle'
+    recording_directory = r'../recordings/avi/22'
+    replay_session(model_path=model_path, recording_directory=recording_directory,
+                   session_directory=os.path.join(recording_directory, 'replay'))
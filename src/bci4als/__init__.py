@@ -1,11 +1,33 @@
 """Top-level package for BCI-4-ALS."""
-import importlib_metadata
+import importlib
+
+from bci4als._version import __version__
 
 __author__ = """Evyatar Luvaton, Noam Siegel"""
 __email__ = 'noamsi@post.bgu.ac.il'
-__version__ = importlib_metadata.version('bci4als')
 
-from bci4als.experiments.offline import OfflineExperiment
-from bci4als.experiments.online import OnlineExperiment
-from .eeg import EEG
-from .ml_model import MLModel
+# The public classes are imported on first access (PEP 562), so `import bci4als` does not load psychopy,
+# mne, sklearn etc. unless they are needed
+_lazy_imports = {
+    'OfflineExperiment': 'bci4als.experiments.offline',
+    'OnlineExperiment': 'bci4als.experiments.online',
+    'EEG': 'bci4als.eeg',
+    'MLModel': 'bci4als.ml_model',
+}
+
+__all__ = ['__version__']
+__all__ += list(_lazy_imports)
+
+
+def __getattr__(name: str):
+
+    if name in _lazy_imports:
+        value = getattr(importlib.import_module(_lazy_imports[name]), name)
+        globals()[name] = value  # cache it, the next accesses do not go through `__getattr__`
+        return value
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
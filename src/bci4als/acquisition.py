@@ -0,0 +1,259 @@
+import threading
+import time
+import traceback
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+import numpy as np
+from bci4als.eeg import EEG
+from bci4als.recording import RawRecorder
+from brainflow import BoardShim
+from nptyping import NDArray
+
+# Health & throughput counters of a board. `rate` is the samples per second since the start, `stalled` is
+# whether the board sent no samples in the last `stall_timeout` seconds, `n_overflows` is how many times the
+# recorder queue was full and `backlog` the samples waiting to be handed to the recorder
+BoardStats = namedtuple('BoardStats', ['name', 'n_polls', 'n_samples', 'n_markers', 'n_errors', 'rate',
+                                       'max_poll_time', 'stalled', 'recorded', 'n_overflows', 'backlog'])
+
+
+class _Station:
+    """
+    The acquisition state of a single board.
+    """
+
+    def __init__(self, name: str, eeg: EEG):
+
+        self.name: str = name
+        self.eeg: EEG = eeg
+        self.recorder: Optional[RawRecorder] = None
+        self.lock = threading.Lock()
+
+        # Chunks which did not fit in the recorder queue, in order
+        self.backlog: List[NDArray] = []
+
+        # Counters
+        self.n_polls: int = 0
+        self.n_samples: int = 0
+        self.n_markers: int = 0
+        self.n_errors: int = 0
+        self.max_poll_time: float = 0.
+        self.n_overflows: int = 0
+        self.last_data: float = time.monotonic()
+
+
+class AcquisitionManager:
+    """
+    Acquire several boards (e.g. a station per subject) at the same time from one process.
+
+    A single scheduler thread polls all the boards every `interval` seconds. Each poll drains the board, moves
+    its channels into the ring buffer of the board's `EEG` (and its streaming filter bank, if it was
+    initialized) and hands the raw chunk, with the marker row, to the board's recorder. Each recorder writes
+    in its own thread, and the scheduler never waits for it: when the queue of a recorder is full (a slow
+    disk), the chunks are kept in a backlog of the board and handed over in order at the next polls, so a slow
+    recorder does not delay the other boards and no samples are lost. The markers are
+    inserted into the stream of each board with `insert_marker`, so every board keeps its own marker stream.
+    The scheduler keeps health & throughput counters of each board (see `stats`).
+
+    For testing, use several synthetic boards with different ports:
+        AcquisitionManager({f'station{i}': EEG(BoardIds.SYNTHETIC_BOARD.value, 6677 + i, '') for i in range(3)})
+
+    Attributes
+    ----------
+    interval : float
+        time in seconds between the polls of all the boards
+    buffer_time : float
+        the length in seconds of the ring buffer of each board
+    stall_timeout : float
+        time in seconds without samples after which a board is reported as stalled
+    """
+
+    def __init__(self, eegs: Dict[str, EEG], interval: float = 0.05, buffer_time: float = 10.,
+                 stall_timeout: float = 1.):
+
+        self.interval: float = interval
+        self.buffer_time: float = buffer_time
+        self.stall_timeout: float = stall_timeout
+
+        self._stations: Dict[str, _Station] = {name: _Station(name, eeg) for name, eeg in eegs.items()}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_time: float = 0.
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._stations)
+
+    def __getitem__(self, name: str) -> EEG:
+        return self._stations[name].eeg
+
+    def start(self, session_directories: Optional[Dict[str, str]] = None):
+        """
+        Turn on the boards and start polling them.
+        :param session_directories: the folder to record the raw stream of each board into (boards which are
+                                    not in the dict are not recorded)
+        :return:
+        """
+        session_directories = session_directories if session_directories is not None else {}
+        started = []
+
+        try:
+            for name, station in self._stations.items():
+
+                station.eeg.on()
+                started.append(station)
+                station.eeg.init_ring_buffer(self.buffer_time)
+
+                if name in session_directories:
+                    station.recorder = RawRecorder(None, session_directories[name], station.eeg.marker_row,
+                                                   n_rows=BoardShim.get_num_rows(station.eeg.board_id))
+                    station.recorder.start()
+
+                station.last_data = time.monotonic()
+
+        except Exception:
+            # Turn off the boards which were already turned on
+            for station in started:
+                self._close(station)
+            raise
+
+        self._start_time = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._schedule, name='acquisition-manager', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Dict[str, RawRecorder]:
+        """
+        Stop polling (after a last poll of all the boards), stop the recorders and turn off the boards.
+        :return: the recorder of each recorded board (with the statistics & markers of the recording)
+        """
+        if self._thread is None:
+            raise RuntimeError('The acquisition was not started, use `start` first')
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+        recorders = {}
+        for name, station in self._stations.items():
+
+            if station.recorder is not None:
+                recorders[name] = station.recorder
+
+            self._close(station)
+
+        return recorders
+
+    def insert_marker(self, name: str, status: str, label: int, index: int):
+        """
+        Insert an encoded marker into the stream of a board.
+        :param name: the name of the board
+        :param status: 'start' or 'stop'
+        :param label: the label of the trial
+        :param index: the index of the trial
+        :return:
+        """
+        self._stations[name].eeg.insert_marker(status, label, index)
+
+    def get_window(self, name: str, seconds: float, filtered: bool = False) -> NDArray:
+        """
+        Get the last `seconds` of a board channels from its ring buffer.
+        :param name: the name of the board
+        :param seconds: the length of the window in seconds
+        :param filtered: get the window from the filtered ring buffer
+        :return: ndarray with the shape (n_channels, n_samples), or (n_bands, n_channels, n_samples) if filtered
+        """
+        station = self._stations[name]
+
+        with station.lock:
+            return station.eeg.get_window(seconds, filtered)
+
+    def stats(self) -> Dict[str, BoardStats]:
+        """
+        The health & throughput counters of each board.
+        :return: dict of the board name to its `BoardStats`
+        """
+        now = time.monotonic()
+        elapsed = max(now - self._start_time, 1e-9)
+
+        return {name: BoardStats(name, s.n_polls, s.n_samples, s.n_markers, s.n_errors, s.n_samples / elapsed,
+                                 s.max_poll_time, now - s.last_data > self.stall_timeout, s.recorder is not None,
+                                 s.n_overflows, sum(chunk.shape[1] for chunk in s.backlog))
+                for name, s in self._stations.items()}
+
+    def print_stats(self):
+        """Print the counters of each board"""
+        for s in self.stats().values():
+            print(f'{s.name}: {s.n_samples} samples ({s.rate:.1f} Hz), {s.n_markers} markers, '
+                  f'{s.n_errors} errors, max poll {s.max_poll_time * 1000:.1f} ms, '
+                  f'{s.n_overflows} recorder overflows{", STALLED" if s.stalled else ""}')
+
+    @staticmethod
+    def _close(station: _Station):
+
+        # Hand the backlog to the recorder (waiting for it) and write the last chunks
+        if station.recorder is not None:
+            for chunk in station.backlog:
+                station.recorder.push(chunk)
+            station.backlog = []
+            station.recorder.stop()
+            station.recorder = None
+
+        station.eeg.off()
+
+    def _schedule(self):
+
+        next_poll = time.monotonic()
+
+        while True:
+
+            stopping = self._stop.is_set()
+
+            for station in self._stations.values():
+                self._poll(station)
+
+            # The last poll drains the samples since the previous one
+            if stopping:
+                return
+
+            next_poll += self.interval
+            self._stop.wait(max(0., next_poll - time.monotonic()))
+
+    def _poll(self, station: _Station):
+
+        start = time.perf_counter()
+
+        try:
+            data = station.eeg.get_board_data()
+
+            if data.shape[1] > 0:
+
+                with station.lock:
+                    station.eeg.update_ring_buffer(data[station.eeg.get_board_channels()])
+
+                if station.recorder is not None:
+                    self._record(station, data)
+
+                station.n_samples += data.shape[1]
+                station.n_markers += int(np.count_nonzero(data[station.eeg.marker_row]))
+                station.last_data = time.monotonic()
+
+        except Exception:
+            # A failing board must not stop the acquisition of the others
+            station.n_errors += 1
+            traceback.print_exc()
+
+        station.n_polls += 1
+        station.max_poll_time = max(station.max_poll_time, time.perf_counter() - start)
+
+    @staticmethod
+    def _record(station: _Station, data: NDArray):
+
+        # Keep the order of the chunks: the new chunk waits behind the backlog
+        station.backlog.append(data)
+
+        while station.backlog:
+            if not station.recorder.push(station.backlog[0], block=False):
+                station.n_overflows += 1
+                return
+            station.backlog.pop(0)
@@ -0,0 +1,247 @@
+import os
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+from bci4als.results import RESULTS_FILE, RESULTS_LOG, read_results, read_results_log
+from nptyping import NDArray
+
+# pandas, joblib & matplotlib are imported only by the functions which use them
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Columns of the decisions table (`time` is the unix time of the decision, NaN for sessions without a results log)
+COLUMNS = ['subject', 'session', 'trial', 'decision', 'target', 'prediction', 'time']
+
+
+def find_sessions(recordings_directory: str) -> List[str]:
+    """
+    Find the online sessions (folders with results) under the recordings folder.
+    :param recordings_directory: the recordings folder, with a folder per subject and a folder per session
+    :return: the folders of the sessions, in order
+    """
+    sessions = []
+
+    for root, dirs, files in os.walk(recordings_directory):
+        if RESULTS_FILE in files or RESULTS_LOG in files:
+            sessions.append(root)
+
+    # Sort the numbered sessions by their number
+    return sorted(sessions, key=lambda s: [(0, int(p), '') if p.isdigit() else (1, 0, p) for p in s.split(os.sep)])
+
+
+def _session_decisions(session_directory: str, recordings_directory: str) -> Dict[str, NDArray]:
+    """
+    The decisions of a session as columns (see `COLUMNS`).
+    """
+    results = read_results(session_directory)
+    n_decisions = [len(trial) for trial in results]
+    pairs = np.array([pair for trial in results for pair in trial], dtype=np.int64).reshape(-1, 2)
+
+    # The decisions time is only in the results log of newer sessions
+    times = np.full(len(pairs), np.nan)
+    if os.path.isfile(os.path.join(session_directory, RESULTS_LOG)):
+        records = read_results_log(session_directory)
+        times[:len(records)] = [record['time'] for record in records]
+
+    # The subject & session are the folders under the recordings folder
+    subject, _, session = os.path.relpath(session_directory, recordings_directory).partition(os.sep)
+
+    return {'subject': np.full(len(pairs), subject),
+            'session': np.full(len(pairs), session or subject),
+            'trial': np.repeat(np.arange(len(results)), n_decisions),
+            'decision': np.concatenate([np.arange(n) for n in n_decisions]) if n_decisions else np.array([], int),
+            'target': pairs[:, 0],
+            'prediction': pairs[:, 1],
+            'time': times}
+
+
+def load_decisions(recordings_directory: str, n_jobs: int = -1) -> 'pd.DataFrame':
+    """
+    Load the decisions of all the online sessions under the recordings folder into a single table.
+    The sessions are read in parallel.
+    :param recordings_directory: the recordings folder
+    :param n_jobs: number of threads (-1 for all the cores)
+    :return: DataFrame with the `COLUMNS`, a row per decision
+    """
+    import pandas as pd
+    from joblib import Parallel, delayed
+
+    sessions = find_sessions(recordings_directory)
+    columns = Parallel(n_jobs=n_jobs, prefer='threads')(
+        delayed(_session_decisions)(session, recordings_directory) for session in sessions)
+
+    if not columns:
+        return pd.DataFrame(columns=COLUMNS)
+
+    return pd.DataFrame({c: np.concatenate([session[c] for session in columns]) for c in COLUMNS})
+
+
+def information_transfer_rate(accuracy: NDArray, n_classes: int, seconds: NDArray) -> NDArray:
+    """
+    Wolpaw information transfer rate.
+    :param accuracy: the accuracy (of each group)
+    :param n_classes: number of classes
+    :param seconds: time in seconds of a decision (of each group)
+    :return: the bits per minute (of each group)
+    """
+    p = np.clip(np.asarray(accuracy, dtype=np.float64), 1e-12, 1 - 1e-12)
+    bits = np.log2(n_classes) + p * np.log2(p) + (1 - p) * np.log2((1 - p) / (n_classes - 1))
+
+    # No information below chance level
+    bits = np.where(p > 1 / n_classes, bits, 0.)
+
+    return bits * 60 / np.asarray(seconds, dtype=np.float64)
+
+
+def trial_summary(decisions: 'pd.DataFrame', threshold: int = 3, buffer_time: float = 4.) -> 'pd.DataFrame':
+    """
+    Summary of each trial: its target, number of decisions, accuracy, whether the target was reached (the
+    model was correct `threshold` times) and the time to reach it.
+    :param decisions: the decisions table (see `load_decisions`)
+    :param threshold: the threshold of the online experiment
+    :param buffer_time: the buffer time of the online experiment, for sessions without decisions time
+    :return: DataFrame with a row per trial
+    """
+    decisions = decisions.assign(correct=(decisions['target'] == decisions['prediction']).astype(np.int64))
+    trials = decisions.groupby(['subject', 'session', 'trial'], sort=False).agg(
+        target=('target', 'first'), n_decisions=('correct', 'size'), n_correct=('correct', 'sum'),
+        first_time=('time', 'min'), last_time=('time', 'max'))
+
+    trials['accuracy'] = trials['n_correct'] / trials['n_decisions']
+    trials['reached'] = trials['n_correct'] >= threshold
+
+    # The time from the trial start (a buffer before the first decision) to the last decision
+    duration = (trials['last_time'] - trials['first_time'] + buffer_time).fillna(trials['n_decisions'] * buffer_time)
+    trials['time_to_target'] = duration.where(trials['reached'])
+
+    return trials.drop(columns=['first_time', 'last_time']).reset_index()
+
+
+def session_summary(decisions: 'pd.DataFrame', n_classes: int = 5, threshold: int = 3,
+                    buffer_time: float = 4.) -> 'pd.DataFrame':
+    """
+    Summary of each session: accuracy over the decisions, mean & variance of the trials accuracy, rate of
+    reached targets, mean time to target and the information transfer rate of the decisions.
+    :param decisions: the decisions table (see `load_decisions`)
+    :param n_classes: number of classes of the experiment
+    :param threshold: the threshold of the online experiment
+    :param buffer_time: the buffer time of the online experiment
+    :return: DataFrame with a row per session
+    """
+    trials = trial_summary(decisions, threshold, buffer_time)
+    sessions = trials.groupby(['subject', 'session'], sort=False).agg(
+        n_trials=('trial', 'size'), n_decisions=('n_decisions', 'sum'), n_correct=('n_correct', 'sum'),
+        trial_accuracy=('accuracy', 'mean'), trial_accuracy_var=('accuracy', 'var'),
+        reached=('reached', 'mean'), time_to_target=('time_to_target', 'mean'))
+
+    # Population variance, as in the per-session reports
+    sessions['trial_accuracy_var'] = (sessions['trial_accuracy_var'] * (sessions['n_trials'] - 1)
+                                      / sessions['n_trials']).fillna(0.)
+    sessions['accuracy'] = sessions['n_correct'] / sessions['n_decisions']
+    sessions['itr'] = information_transfer_rate(sessions['accuracy'].to_numpy(), n_classes, buffer_time)
+
+    return sessions.reset_index()
+
+
+def confusion_matrices(decisions: 'pd.DataFrame', n_classes: int = 5) -> Dict[Tuple[str, str], NDArray]:
+    """
+    The confusion matrix of each session, computed for all the sessions with one bincount.
+    :param decisions: the decisions table (see `load_decisions`)
+    :param n_classes: number of classes of the experiment
+    :return: dict of (subject, session) to the matrix (n_classes, n_classes) of target (rows) & prediction
+    """
+    codes, keys = _group_codes(decisions, ['subject', 'session'])
+    index = (codes * n_classes + decisions['target'].to_numpy()) * n_classes + decisions['prediction'].to_numpy()
+    counts = np.bincount(index, minlength=len(keys) * n_classes ** 2).reshape(len(keys), n_classes, n_classes)
+
+    return dict(zip(keys, counts))
+
+
+def _group_codes(decisions: 'pd.DataFrame', columns: List[str]) -> Tuple[NDArray, List[Tuple]]:
+    """
+    The group index of each row and the keys of the groups.
+    """
+    codes = decisions.groupby(columns, sort=False).ngroup().to_numpy()
+    keys = decisions[columns].drop_duplicates().itertuples(index=False, name=None)
+
+    return codes, list(keys)
+
+
+def save_report(decisions: 'pd.DataFrame', output_directory: str, n_classes: int = 5, threshold: int = 3,
+                buffer_time: float = 4.) -> 'pd.DataFrame':
+    """
+    Write the report of the sessions without a display: the sessions summary (csv), a figure of the trials
+    accuracy and the confusion matrix of each session, and a figure of the accuracy of all the sessions.
+    :param decisions: the decisions table (see `load_decisions`)
+    :param output_directory: the folder of the report
+    :param n_classes: number of classes of the experiment
+    :param threshold: the threshold of the online experiment
+    :param buffer_time: the buffer time of the online experiment
+    :return: the sessions summary
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    os.makedirs(output_directory, exist_ok=True)
+
+    trials = trial_summary(decisions, threshold, buffer_time)
+    sessions = session_summary(decisions, n_classes, threshold, buffer_time)
+    matrices = confusion_matrices(decisions, n_classes)
+    sessions.to_csv(os.path.join(output_directory, 'sessions.csv'), index=False)
+
+    for (subject, session), session_trials in trials.groupby(['subject', 'session'], sort=False):
+
+        fig, (ax_accuracy, ax_confusion) = plt.subplots(1, 2, figsize=(12, 4.5))
+
+        accuracy = session_trials['accuracy'].to_numpy()
+        ax_accuracy.plot(accuracy, label='accuracy')
+        ax_accuracy.axhline(accuracy.mean(), color='black', linestyle='-', label='mean accuracy')
+        ax_accuracy.axhline(1 / n_classes, color='black', linestyle='--', label='chance')
+        ax_accuracy.set(xlabel='Trial Number', ylabel='Accuracy', ylim=(-0.05, 1.05),
+                        title=f'Accuracies for {subject} session {session}')
+        ax_accuracy.legend()
+
+        ax_confusion.imshow(matrices[(subject, session)], cmap='Blues')
+        ax_confusion.set(xlabel='Prediction', ylabel='Target', title='Confusion matrix')
+
+        fig.tight_layout()
+        fig.savefig(os.path.join(output_directory, f'{subject}_{session}.png'))
+        plt.close(fig)
+
+    fig, ax = plt.subplots(figsize=(max(6, len(sessions) * 0.5), 4.5))
+    ax.errorbar(np.arange(1, len(sessions) + 1), sessions['trial_accuracy'], yerr=sessions['trial_accuracy_var'],
+                label='accuracy')
+    ax.axhline(1 / n_classes, color='black', linestyle='--', label='chance')
+    ax.set_xticks(np.arange(1, len(sessions) + 1))
+    ax.set_xticklabels([f'{s.subject}/{s.session}' for s in sessions.itertuples()], rotation=45)
+    ax.set(xlabel='Session', ylabel='Accuracy', ylim=(-0.05, 1.05), title='Mean Accuracy by Session')
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(os.path.join(output_directory, 'sessions.png'))
+    plt.close(fig)
+
+    return sessions
+
+
+def report(recordings_directory: str, output_directory: Optional[str] = None, n_classes: int = 5,
+           threshold: int = 3, buffer_time: float = 4., n_jobs: int = -1) -> 'pd.DataFrame':
+    """
+    Scan all the online sessions under the recordings folder and write their report.
+    :param recordings_directory: the recordings folder
+    :param output_directory: the folder of the report (default: `report` in the recordings folder)
+    :param n_classes: number of classes of the experiment
+    :param threshold: the threshold of the online experiment
+    :param buffer_time: the buffer time of the online experiment
+    :param n_jobs: number of threads for reading the sessions
+    :return: the sessions summary
+    """
+    if output_directory is None:
+        output_directory = os.path.join(recordings_directory, 'report')
+
+    decisions = load_decisions(recordings_directory, n_jobs)
+    sessions = save_report(decisions, output_directory, n_classes, threshold, buffer_time)
+
+    print(f'Report of {len(sessions)} sessions ({len(decisions)} decisions) saved to {output_directory}')
+
+    return sessions
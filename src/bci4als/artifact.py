@@ -0,0 +1,239 @@
+import json
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from bci4als.dataset import load_session
+from bci4als.filtering import band_pass
+from bci4als.incremental import IncrementalCSPLDA
+from bci4als.models import CSPLDA, FilterBankCSP
+from bci4als.timing import StageTimer
+from nptyping import NDArray
+
+# Version of the compact model format
+ARTIFACT_VERSION = 1
+
+
+class InferenceModel:
+    """
+    Inference-only CSP model loaded from a compact model file (see `export_model`).
+
+    The file holds only the fitted parameters: the CSP filters of each band, the LDA coefficients, the channels
+    and the filter parameters, so it is small and loads in milliseconds. The training trials are not
+    embedded, only the paths of their sessions. The model has the prediction interface of `MLModel`.
+
+    Attributes
+    ----------
+    sfreq : float
+        the sampling rate the model was trained on
+    ch_names : list
+        the channels of the model
+    bands : list
+        the (low, high) band-pass of each band
+    pad : str
+        the padding of the band-pass filter
+    filters : list
+        the CSP filters of each band, shape (n_components, n_channels)
+    coef : NDArray
+        the LDA coefficients, shape (n_classes, n_features)
+    intercept : NDArray
+        the LDA intercepts, shape (n_classes,)
+    classes : NDArray
+        the labels of the classes
+    training_sessions : list
+        the folders of the sessions the model was trained on
+    """
+
+    def __init__(self, sfreq: float, ch_names: List[str], bands: List[Tuple[float, float]], pad: str,
+                 filters: List[NDArray], coef: NDArray, intercept: NDArray, classes: NDArray,
+                 training_sessions: Optional[List[str]] = None):
+
+        self.sfreq: float = sfreq
+        self.ch_names: List[str] = ch_names
+        self.bands: List[Tuple[float, float]] = bands
+        self.pad: str = pad
+        self.filters: List[NDArray] = filters
+        self.coef: NDArray = coef
+        self.intercept: NDArray = intercept
+        self.classes: NDArray = classes
+        self.training_sessions: List[str] = training_sessions if training_sessions is not None else []
+        self.timer: StageTimer = StageTimer()
+
+    def features(self, windows: NDArray, filtered: bool = False) -> NDArray:
+        """
+        The log-variance CSP features of each band.
+        :param windows: ndarray with the shape (n_windows, n_channels, n_samples)
+        :param filtered: whether the data was already band-passed (only for a single band)
+        :return: features with the shape (n_windows, n_features)
+        """
+        windows = np.asarray(windows, dtype=np.float64)
+
+        if filtered and len(self.bands) > 1:
+            raise ValueError('A filter-bank model expects raw data, disable the streaming filter')
+
+        features = []
+        for (l_freq, h_freq), filters in zip(self.bands, self.filters):
+            with self.timer.stage('filter'):
+                data = windows if filtered else band_pass(windows, self.sfreq, l_freq, h_freq, self.pad)
+            features.append(np.log(np.mean(np.einsum('ki,nit->nkt', filters, data) ** 2, axis=-1)))
+
+        return np.concatenate(features, axis=1)
+
+    def decision_function(self, windows: NDArray, filtered: bool = False) -> NDArray:
+        return self.features(windows, filtered) @ self.coef.T + self.intercept
+
+    def predict_proba(self, windows: NDArray, eeg=None, filtered: bool = False) -> NDArray:
+        """
+        :param windows: ndarray with the shape (n_windows, n_channels, n_samples)
+        :param eeg: not used, for compatibility with `MLModel`
+        :param filtered: whether the data was already band-passed
+        :return: the classes probabilities with the shape (n_windows, n_classes)
+        """
+        decision = self.decision_function(windows, filtered)
+        proba = np.exp(decision - decision.max(axis=1, keepdims=True))
+
+        return proba / proba.sum(axis=1, keepdims=True)
+
+    def predict_batch(self, windows: NDArray, eeg=None, filtered: bool = False) -> NDArray:
+        """
+        :param windows: ndarray with the shape (n_windows, n_channels, n_samples)
+        :param eeg: not used, for compatibility with `MLModel`
+        :param filtered: whether the data was already band-passed
+        :return: the predicted labels with the shape (n_windows,)
+        """
+        features = self.features(windows, filtered)
+
+        with self.timer.stage('predict'):
+            return self.classes[np.argmax(features @ self.coef.T + self.intercept, axis=1)]
+
+    def online_predict(self, data: NDArray, eeg=None, filtered: bool = False):
+        """
+        Predict the label of the given buffer.
+        :param data: ndarray with the shape (n_channels, n_samples)
+        :param eeg: not used, for compatibility with `MLModel`
+        :param filtered: whether the data was already band-passed
+        :return: the predicted label
+        """
+        return self.predict_batch(np.asarray(data)[np.newaxis], eeg, filtered)[0]
+
+    def online_predict_proba(self, data: NDArray, eeg=None, filtered: bool = False) -> Tuple[int, NDArray]:
+        """
+        Predict the label of the given buffer and the classes probabilities.
+        :param data: ndarray with the shape (n_channels, n_samples)
+        :param eeg: not used, for compatibility with `MLModel`
+        :param filtered: whether the data was already band-passed
+        :return: the predicted label and the probabilities with the shape (n_classes,)
+        """
+        features = self.features(np.asarray(data)[np.newaxis], filtered)
+
+        with self.timer.stage('predict'):
+            decision = (features @ self.coef.T + self.intercept)[0]
+            proba = np.exp(decision - decision.max())
+
+        return self.classes[np.argmax(decision)], proba / proba.sum()
+
+    def partial_fit(self, eeg, X: NDArray, y: int):
+        raise NotImplementedError('An inference-only model can not be updated, disable co-learning')
+
+    def load_trials(self) -> Tuple[List[NDArray], List[int]]:
+        """
+        Load the training trials from the referenced sessions, e.g. for re-training an `MLModel`.
+        :return: the trials (ndarrays with the shape (n_channels, n_samples)) and their labels
+        """
+        trials, labels = [], []
+
+        for session_directory in self.training_sessions:
+            session = load_session(session_directory)
+            ch_idx = [session.ch_names.index(ch) for ch in self.ch_names]
+            trials += [t[ch_idx] for t in session.trials]
+            labels += [int(label) for label in session.labels]
+
+        return trials, labels
+
+
+def _lda_parameters(lda) -> Tuple[NDArray, NDArray]:
+    """
+    The LDA coefficients in the multi-class form (one row per class). A binary sklearn LDA has a single row,
+    which is split into two rows with the same softmax probabilities.
+    """
+    coef, intercept = np.atleast_2d(lda.coef_), np.atleast_1d(lda.intercept_)
+
+    if len(coef) == 1:
+        coef, intercept = np.concatenate([-coef, coef]) / 2, np.concatenate([-intercept, intercept]) / 2
+
+    return coef, intercept
+
+
+def export_model(model, path: str, sfreq: float, ch_names: Sequence[str],
+                 training_sessions: Optional[Sequence[str]] = None):
+    """
+    Save the fitted CSP model of an `MLModel` in the compact format (a numpy .npz file without pickles).
+    :param model: the MLModel, trained with the csp_lda or fbcsp model (or co-learned)
+    :param path: path of the .npz file
+    :param sfreq: the sampling rate of the data
+    :param ch_names: the channels of the data
+    :param training_sessions: the folders of the sessions the model was trained on
+    :return:
+    """
+    clf = model.clf
+
+    if isinstance(clf, IncrementalCSPLDA):
+        # Co-learned model, predicted with the MLModel band-pass
+        bands, pad = [(8., 30.)], 'reflect_limited'
+        filters, coef, intercept, classes = [clf.filters_], clf.coef_, clf.intercept_, clf.classes_
+
+    elif isinstance(clf, CSPLDA):
+        bands, pad = [clf.band], 'reflect_limited'
+        estimator = clf.classifier
+        filters, coef, intercept, classes = [estimator.filters_], estimator.coef_, estimator.intercept_, \
+            estimator.classes_
+
+    elif isinstance(clf, FilterBankCSP):
+        bands, pad = clf.bands, 'reflect_limited'
+        filters = [csp.filters_ for csp in clf.csp]
+        coef, intercept = _lda_parameters(clf.classifier)
+        classes = clf.classifier.classes_
+
+    elif hasattr(clf, 'named_steps') and 'CSP' in clf.named_steps:
+        # mne CSP & sklearn LDA pipeline, predicted with the MLModel band-pass
+        bands, pad = [(8., 30.)], 'reflect_limited'
+        csp = clf.named_steps['CSP']
+        filters = [csp.filters_[:csp.n_components]]
+        coef, intercept = _lda_parameters(clf.named_steps['LDA'])
+        classes = clf.named_steps['LDA'].classes_
+
+    else:
+        raise ValueError(f'The model {type(clf).__name__} can not be saved in the compact format')
+
+    # The spatial filter is linear, so it is folded into the CSP filters of the board channels
+    spatial_filter = getattr(model, 'spatial_filter', None)
+    if spatial_filter is not None:
+        filters = [np.asarray(f) @ spatial_filter.matrix for f in filters]
+
+    metadata = {'version': ARTIFACT_VERSION, 'sfreq': sfreq, 'channels': list(ch_names),
+                'bands': [list(band) for band in bands], 'pad': pad,
+                'training_sessions': list(training_sessions) if training_sessions is not None else []}
+
+    arrays = {f'filters_{i}': np.asarray(f) for i, f in enumerate(filters)}
+    with open(path, 'wb') as file:
+        np.savez(file, coef=np.asarray(coef), intercept=np.asarray(intercept), classes=np.asarray(classes),
+                 metadata=np.array(json.dumps(metadata)), **arrays)
+
+
+def load_inference_model(path: str) -> InferenceModel:
+    """
+    Load a model saved by `export_model`.
+    :param path: path of the .npz file
+    :return: the inference-only model
+    """
+    with np.load(path, allow_pickle=False) as file:
+
+        metadata = json.loads(str(file['metadata']))
+        if metadata['version'] > ARTIFACT_VERSION:
+            raise ValueError(f'The model file version {metadata["version"]} is newer than the supported '
+                             f'version {ARTIFACT_VERSION}, please upgrade bci4als')
+
+        bands = [tuple(band) for band in metadata['bands']]
+        filters = [file[f'filters_{i}'] for i in range(len(bands))]
+
+        return InferenceModel(metadata['sfreq'], metadata['channels'], bands, metadata['pad'], filters,
+                              file['coef'], file['intercept'], file['classes'], metadata['training_sessions'])
@@ -0,0 +1,275 @@
+import json
+import os
+import pickle
+import sqlite3
+from collections import namedtuple
+from typing import Dict, List, Optional, Sequence
+
+from bci4als.metadata import read_metadata
+from bci4als.recording import INDEX_FILE
+from bci4als.results import RESULTS_FILE, RESULTS_LOG, read_results
+
+# The catalog database, in the recordings folder
+CATALOG_FILE = 'catalog.sqlite'
+CATALOG_VERSION = 3
+
+# A session of the catalog. `path` is the session folder, `channels` the channels names, `n_samples` the
+# (min, max) samples of its trials (None when the trials are not saved) and `artifacts` the files of the folder
+SessionEntry = namedtuple('SessionEntry', ['subject', 'session', 'path', 'experiment_type', 'datetime', 'sfreq',
+                                           'channels', 'n_trials', 'n_samples', 'artifacts'])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    subject TEXT NOT NULL,
+    session INTEGER NOT NULL,
+    experiment_type TEXT,
+    datetime TEXT,
+    sfreq REAL,
+    channels TEXT NOT NULL,
+    n_channels INTEGER NOT NULL,
+    n_trials INTEGER,
+    min_samples INTEGER,
+    max_samples INTEGER,
+    artifacts TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    PRIMARY KEY (subject, session)
+);
+CREATE TABLE IF NOT EXISTS subjects (
+    subject TEXT PRIMARY KEY
+);
+"""
+
+
+class RecordingCatalog:
+    """
+    Persistent index (SQLite) of the sessions in the recordings folder (recordings/<subject>/<session>).
+
+    For each session the catalog keeps its experiment type, date, channels, number of trials, trials lengths
+    and the files in its folder, so the sessions can be queried without listing the folders and reading their
+    metadata, e.g. `catalog.sessions('avi', experiment_type='Online', n_channels=13)`.
+
+    The experiments update the catalog when they write a session (see `update_session`). Sessions which were
+    copied into the recordings folder or changed by other tools (e.g. `convert_pickle`) are indexed lazily: a
+    query lists the subject folders and re-reads only the sessions in which the modification time of the folder
+    or of one of its files has changed.
+
+    Attributes
+    ----------
+    recordings_directory : str
+        the recordings folder
+    path : str
+        path of the catalog database
+    """
+
+    def __init__(self, recordings_directory: str):
+
+        self.recordings_directory: str = recordings_directory
+        self.path: str = os.path.join(recordings_directory, CATALOG_FILE)
+
+        self._connection = sqlite3.connect(self.path)
+
+        # Rebuild the catalog of an older version, it is only an index of the recordings folder
+        if self._connection.execute('PRAGMA user_version').fetchone()[0] != CATALOG_VERSION:
+            with self._connection:
+                self._connection.executescript('DROP TABLE IF EXISTS sessions; DROP TABLE IF EXISTS subjects;')
+                self._connection.executescript(_SCHEMA)
+                self._connection.execute(f'PRAGMA user_version = {CATALOG_VERSION}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def update_session(self, session_directory: str) -> SessionEntry:
+        """
+        Index a session (after it was written or changed).
+        :param session_directory: the session folder, recordings/<subject>/<session>
+        :return: the entry of the session
+        """
+        subject, session = self._split(session_directory)
+        info = describe_session(session_directory)
+
+        with self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (subject, session, info['experiment_type'], info['datetime'], info['sfreq'],
+                 json.dumps(info['channels']), len(info['channels']), info['n_trials'], info['n_samples'][0],
+                 info['n_samples'][1], json.dumps(info['artifacts']), info['mtime']))
+
+        return self._entry(subject, session, info['experiment_type'], info['datetime'], info['sfreq'],
+                           info['channels'], info['n_trials'], info['n_samples'], info['artifacts'])
+
+    def refresh(self, subjects: Optional[Sequence[str]] = None, force: bool = False) -> int:
+        """
+        Index the new & changed sessions and remove the deleted ones.
+        :param subjects: the subjects to refresh (default all the subjects folders)
+        :param force: re-index all the sessions, also the unchanged ones
+        :return: number of indexed sessions
+        """
+        if subjects is None:
+            subjects = [s for s in sorted(os.listdir(self.recordings_directory))
+                        if os.path.isdir(os.path.join(self.recordings_directory, s))]
+
+        n_updated = 0
+        for subject in subjects:
+            n_updated += self._refresh_subject(subject, force)
+
+        # Subjects which were deleted
+        known = [row[0] for row in self._connection.execute('SELECT subject FROM subjects')]
+        with self._connection:
+            for subject in known:
+                if not os.path.isdir(os.path.join(self.recordings_directory, subject)):
+                    self._connection.execute('DELETE FROM sessions WHERE subject = ?', (subject,))
+                    self._connection.execute('DELETE FROM subjects WHERE subject = ?', (subject,))
+
+        return n_updated
+
+    def sessions(self, subject: Optional[str] = None, experiment_type: Optional[str] = None,
+                 n_channels: Optional[int] = None, channels: Optional[Sequence[str]] = None,
+                 min_trials: Optional[int] = None, sfreq: Optional[float] = None) -> List[SessionEntry]:
+        """
+        Query the sessions of the catalog. The changed sessions of the subjects are indexed first.
+        :param subject: the subject name
+        :param experiment_type: 'Offline' or 'Online'
+        :param n_channels: number of channels
+        :param channels: channels which the sessions must have
+        :param min_trials: minimal number of trials
+        :param sfreq: the sampling rate (known only for sessions with metadata.json)
+        :return: the entries of the matching sessions, ordered by subject & session
+        """
+        self.refresh([subject] if subject is not None else None)
+
+        conditions, values = [], []
+        for column, operator, value in [('subject', '=', subject), ('experiment_type', '=', experiment_type),
+                                        ('n_channels', '=', n_channels), ('n_trials', '>=', min_trials),
+                                        ('sfreq', '=', sfreq)]:
+            if value is not None:
+                conditions.append(f'{column} {operator} ?')
+                values.append(value)
+
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        rows = self._connection.execute(
+            'SELECT subject, session, experiment_type, datetime, sfreq, channels, n_trials, min_samples, '
+            f'max_samples, artifacts FROM sessions {where} ORDER BY subject, session', values)
+
+        entries = [self._entry(row[0], row[1], row[2], row[3], row[4], json.loads(row[5]), row[6],
+                               (row[7], row[8]), json.loads(row[9])) for row in rows]
+
+        if channels is not None:
+            entries = [e for e in entries if all(ch in e.channels for ch in channels)]
+
+        return entries
+
+    def next_session(self, subject: str) -> int:
+        """
+        The number of the next session of a subject.
+        :param subject: the subject name
+        :return: the largest session number plus one (1 for a new subject)
+        """
+        self._refresh_subject(subject)
+        last = self._connection.execute('SELECT MAX(session) FROM sessions WHERE subject = ?',
+                                        (subject,)).fetchone()[0]
+
+        return 1 if last is None else last + 1
+
+    def _refresh_subject(self, subject: str, force: bool = False) -> int:
+
+        subject_directory = os.path.join(self.recordings_directory, subject)
+        if not os.path.isdir(subject_directory):
+            return 0
+
+        indexed = dict(self._connection.execute('SELECT session, mtime FROM sessions WHERE subject = ?',
+                                                (subject,)).fetchall())
+        present = set()
+        n_updated = 0
+
+        for name in os.listdir(subject_directory):
+
+            session_directory = os.path.join(subject_directory, name)
+            if not name.isdigit() or not os.path.isdir(session_directory):
+                continue
+
+            present.add(int(name))
+            # Files added to or rewritten in a session folder do not change the subject folder, so each
+            # session is checked
+            if force or indexed.get(int(name)) != _session_mtime(session_directory):
+                self.update_session(session_directory)
+                n_updated += 1
+
+        with self._connection:
+            for session in set(indexed) - present:
+                self._connection.execute('DELETE FROM sessions WHERE subject = ? AND session = ?',
+                                         (subject, session))
+            self._connection.execute('INSERT OR REPLACE INTO subjects VALUES (?)', (subject,))
+
+        return n_updated
+
+    def _split(self, session_directory: str):
+
+        path = os.path.relpath(os.path.abspath(session_directory), os.path.abspath(self.recordings_directory))
+        parts = path.split(os.sep)
+
+        if len(parts) != 2 or not parts[1].isdigit():
+            raise ValueError(f'{session_directory} is not a session folder of {self.recordings_directory}')
+
+        return parts[0], int(parts[1])
+
+    def _entry(self, subject, session, experiment_type, datetime, sfreq, channels, n_trials, n_samples, artifacts):
+
+        path = os.path.join(self.recordings_directory, subject, str(session))
+        return SessionEntry(subject, session, path, experiment_type, datetime, sfreq, channels, n_trials,
+                            tuple(n_samples) if n_samples[0] is not None else None, artifacts)
+
+
+def _session_mtime(session_directory: str) -> int:
+    """The last modification time of the session folder & its files"""
+    with os.scandir(session_directory) as entries:
+        return max([os.stat(session_directory).st_mtime_ns] + [e.stat().st_mtime_ns for e in entries])
+
+
+def describe_session(session_directory: str) -> Dict:
+    """
+    Collect the catalog fields of a session from its files.
+    The trials are counted from the first available source:
+        1. The columnar trials index (trials_index.json)
+        2. trials.pickle (offline sessions before the columnar format)
+        3. The online results (a trial per target)
+    :param session_directory: the session folder
+    :return: dict with the experiment type, datetime, sampling rate, channels, n_trials, n_samples (min, max),
+             artifacts and the modification time of the session
+    """
+    metadata = read_metadata(session_directory)
+    n_trials, n_samples = None, (None, None)
+
+    if os.path.isfile(os.path.join(session_directory, INDEX_FILE)):
+
+        with open(os.path.join(session_directory, INDEX_FILE)) as file:
+            offsets = json.load(file)['offsets']
+        lengths = [end - start for start, end in zip(offsets[:-1], offsets[1:])]
+        n_trials = len(lengths)
+        n_samples = (min(lengths), max(lengths)) if lengths else (None, None)
+
+    elif os.path.isfile(os.path.join(session_directory, 'trials.pickle')):
+
+        with open(os.path.join(session_directory, 'trials.pickle'), 'rb') as file:
+            lengths = [len(trial) for trial in pickle.load(file)]
+        n_trials = len(lengths)
+        n_samples = (min(lengths), max(lengths)) if lengths else (None, None)
+
+    elif os.path.isfile(os.path.join(session_directory, RESULTS_FILE)) or \
+            os.path.isfile(os.path.join(session_directory, RESULTS_LOG)):
+
+        n_trials = len(read_results(session_directory))
+
+    return {'experiment_type': metadata.experiment_type if metadata is not None else None,
+            'datetime': metadata.datetime if metadata is not None else None,
+            'sfreq': metadata.sfreq if metadata is not None else None,
+            'channels': metadata.channels if metadata is not None else [],
+            'n_trials': n_trials,
+            'n_samples': n_samples,
+            'artifacts': sorted(os.listdir(session_directory)),
+            'mtime': _session_mtime(session_directory)}
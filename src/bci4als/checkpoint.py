@@ -0,0 +1,207 @@
+import json
+import os
+import pickle
+import threading
+import time
+from typing import List, Tuple
+
+import numpy as np
+from bci4als.incremental import IncrementalCSPLDA
+from nptyping import NDArray
+
+# Files of the co-learning checkpoint in the session folder
+CHECKPOINT_FILE = 'checkpoint.pickle'
+MODEL_FILE = 'model.pickle'
+TRIAL_LOG_FILE = 'colearning_trials.dat'
+TRIAL_LOG_INDEX = 'colearning_trials.jsonl'
+CHECKPOINT_VERSION = 1
+
+
+class ModelCheckpointer:
+    """
+    Save the model of a co-learning session in the background.
+
+    Instead of pickling the whole `MLModel` (with all its trials) after each update, the session is saved as:
+        1. A checkpoint with only the fitted classifier, replaced atomically (write to a temporary file and
+           rename), so a crash never leaves a broken checkpoint.
+        2. An append-only log of the co-learning trials, so each trial is written exactly once.
+    The whole model is pickled only once, when the session is closed (`model.pickle`, loadable with
+    `load_model` to start the next session from it). After a crash, use `restore_model`.
+
+    The checkpoints are debounced: a writer thread writes at most one checkpoint every `min_interval` seconds,
+    and only the latest submitted model (the older ones are dropped). The trials are all written in order.
+
+    Attributes
+    ----------
+    session_directory : str
+        the folder of the checkpoint files
+    min_interval : float
+        minimal time in seconds between two checkpoint writes
+    n_submitted : int
+        number of checkpoints submitted by `save`
+    n_written : int
+        number of checkpoints actually written
+    """
+
+    def __init__(self, session_directory: str, min_interval: float = 1.):
+
+        self.session_directory: str = session_directory
+        self.min_interval: float = min_interval
+        self.n_submitted: int = 0
+        self.n_written: int = 0
+
+        # Pending work, guarded by the condition
+        self._condition = threading.Condition()
+        self._state = None
+        self._trials: List[Tuple[NDArray, int]] = []
+        self._closed: bool = False
+        self._next_write: float = 0.
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def save(self, model):
+        """
+        Submit a checkpoint of the model's classifier (replacing any checkpoint which was not written yet).
+        `MLModel.partial_fit` never changes a classifier in-place, it replaces it with an updated copy, so the
+        classifier is kept by reference and serialized by the writer thread (only when it is written).
+        :param model: the MLModel
+        :return:
+        """
+        state = {'version': CHECKPOINT_VERSION, 'clf': model.clf, 'n_trials': len(model.trials)}
+
+        with self._condition:
+            self._state = state
+            self.n_submitted += 1
+            self._condition.notify()
+
+    def log_trial(self, trial: NDArray, label: int):
+        """
+        Append a co-learning trial to the trials log.
+        :param trial: ndarray with the shape (n_channels, n_samples), must not be modified afterwards
+        :param label: the label of the trial
+        :return:
+        """
+        with self._condition:
+            self._trials.append((trial, int(label)))
+            self._condition.notify()
+
+    def close(self, model=None):
+        """
+        Write the pending trials and the latest checkpoint and stop the writer thread.
+        :param model: the MLModel of the session, to save as a whole in `model.pickle` (not saved if None)
+        :return:
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+        self._thread.join()
+
+        if model is not None:
+            _write_atomic(os.path.join(self.session_directory, MODEL_FILE), pickle.dumps(model))
+
+    def _ready(self) -> bool:
+        return self._closed or len(self._trials) > 0 or \
+            (self._state is not None and time.monotonic() >= self._next_write)
+
+    def _run(self):
+
+        while True:
+
+            with self._condition:
+
+                while not self._ready():
+                    timeout = None if self._state is None else self._next_write - time.monotonic()
+                    self._condition.wait(timeout)
+
+                trials, self._trials = self._trials, []
+                state = None
+                if self._state is not None and (self._closed or time.monotonic() >= self._next_write):
+                    state, self._state = self._state, None
+                closed = self._closed
+
+            self._append_trials(trials)
+
+            if state is not None:
+                self._write_state(state)
+                self._next_write = time.monotonic() + self.min_interval
+
+            if closed:
+                break
+
+    def _append_trials(self, trials: List[Tuple[NDArray, int]]):
+
+        if len(trials) == 0:
+            return
+
+        # Write the data before the index, so the index never points to missing data
+        data_path = os.path.join(self.session_directory, TRIAL_LOG_FILE)
+        offset = os.path.getsize(data_path) if os.path.isfile(data_path) else 0
+        lines = []
+
+        with open(data_path, 'ab') as file:
+            for trial, label in trials:
+                trial = np.ascontiguousarray(trial, dtype=np.float64)
+                trial.tofile(file)
+                lines.append(json.dumps({'offset': offset, 'shape': list(trial.shape), 'label': label}) + '\n')
+                offset += trial.nbytes
+
+        with open(os.path.join(self.session_directory, TRIAL_LOG_INDEX), 'a') as file:
+            file.writelines(lines)
+
+    def _write_state(self, state: dict):
+
+        _write_atomic(os.path.join(self.session_directory, CHECKPOINT_FILE), pickle.dumps(state))
+        self.n_written += 1
+
+
+def _write_atomic(path: str, content: bytes):
+    """Write a file through a temporary file, so it is never partial"""
+    with open(path + '.tmp', 'wb') as file:
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def read_trial_log(session_directory: str) -> Tuple[List[NDArray], List[int]]:
+    """
+    Read the co-learning trials log of a session.
+    :param session_directory: the session folder
+    :return: the trials (ndarrays with the shape (n_channels, n_samples)) and their labels
+    """
+    index_path = os.path.join(session_directory, TRIAL_LOG_INDEX)
+    if not os.path.isfile(index_path):
+        return [], []
+
+    with open(index_path) as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+
+    data = np.memmap(os.path.join(session_directory, TRIAL_LOG_FILE), dtype=np.float64, mode='r')
+    trials = [np.array(data[e['offset'] // 8:e['offset'] // 8 + int(np.prod(e['shape']))]).reshape(e['shape'])
+              for e in entries]
+
+    return trials, [e['label'] for e in entries]
+
+
+def restore_model(model, session_directory: str):
+    """
+    Restore a co-learning session into the model it started from.
+    The logged trials are appended to the model trials and the classifier is taken from the checkpoint.
+    :param model: the MLModel the session started from
+    :param session_directory: the folder of the co-learning session
+    :return: the model
+    """
+    trials, labels = read_trial_log(session_directory)
+    model.trials += trials
+    model.labels += labels
+
+    with open(os.path.join(session_directory, CHECKPOINT_FILE), 'rb') as file:
+        state = pickle.load(file)
+
+    model.clf = state['clf']
+    if isinstance(model.clf, IncrementalCSPLDA):
+        model.estimator = model.clf
+
+    return model
@@ -0,0 +1,127 @@
+import os
+import pickle
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+from bci4als.metadata import read_metadata
+from bci4als.recording import INDEX_FILE, TrialsRecording
+
+# Stacked trials of several sessions
+Dataset = namedtuple('Dataset', ['X', 'y', 'sessions', 'ch_names', 'sfreq'])
+
+# Trials of a single session, as loaded by a worker (`sfreq` is None for sessions without metadata.json)
+Session = namedtuple('Session', ['name', 'trials', 'labels', 'ch_names', 'sfreq'])
+
+
+def load_session(session_directory: str, include_models: bool = False) -> Optional[Session]:
+    """
+    Load the trials of a single session.
+    The trials are taken from the first available source:
+        1. The columnar trials format (trials.npy)
+        2. trials.pickle & labels.csv
+        3. model.pickle of an MLModel, only if `include_models` (trials & labels are kept in the model,
+           channels from the metadata)
+    Pay attention, the model of an online session keeps all the trials it was trained on, including the
+    trials of earlier sessions, so the same trials are loaded again from each session which was chained.
+    :param session_directory: the session folder
+    :param include_models: take the trials from model.pickle of sessions without saved trials
+    :return: the session, or None if the session has no trials
+    """
+    name = os.path.join(*os.path.normpath(session_directory).split(os.sep)[-2:])
+    trials_path = os.path.join(session_directory, 'trials.pickle')
+    labels_path = os.path.join(session_directory, 'labels.csv')
+    model_path = os.path.join(session_directory, 'model.pickle')
+    metadata = read_metadata(session_directory)
+    sfreq = metadata.sfreq if metadata is not None else None
+
+    if os.path.isfile(os.path.join(session_directory, INDEX_FILE)):
+
+        recording = TrialsRecording(session_directory, mmap_mode=None)
+        return Session(name, recording.trials(), recording.labels.tolist(), recording.ch_names, sfreq)
+
+    if os.path.isfile(trials_path) and os.path.isfile(labels_path):
+
+        import pandas as pd
+
+        trials: List[pd.DataFrame] = pickle.load(open(trials_path, 'rb'))
+        labels = pd.read_csv(labels_path, header=None)[0].tolist()
+        return Session(name, [t.to_numpy().T for t in trials], labels, list(trials[0].columns), sfreq)
+
+    if include_models and os.path.isfile(model_path):
+
+        model = pickle.load(open(model_path, 'rb'))
+        ch_names = metadata.channels if metadata is not None else []
+
+        # Old sessions pickled only the sklearn pipeline
+        if hasattr(model, 'trials') and len(ch_names) > 0:
+            return Session(name, [np.asarray(t) for t in model.trials], list(model.labels), ch_names, sfreq)
+
+    return None
+
+
+def load_sessions(recordings_path: str, subjects: Union[str, Sequence[str]],
+                  sessions: Optional[Sequence[Union[int, str]]] = None, channels: Optional[List[str]] = None,
+                  n_samples: Optional[int] = None, n_jobs: Optional[int] = None,
+                  include_models: bool = False) -> Dataset:
+    """
+    Load the trials of several sessions (and subjects) into one stacked epochs array.
+
+    The sessions are loaded in a process pool. The trials are aligned to a common channels set (the channels
+    shared by all the sessions, in the order of the first session) and cropped to a common length.
+    By default the trials of model.pickle files are not loaded: they include the trials of earlier sessions,
+    so the same trials would appear several times (and leak between the folds of a cross-validation).
+
+    :param recordings_path: path to the recordings folder (recordings/<subject>/<session>)
+    :param subjects: subject name or list of subjects names
+    :param sessions: the sessions to load (default all the sessions of the subjects)
+    :param channels: the channels to select (default the channels shared by all the sessions)
+    :param n_samples: samples in each epoch (default the length of the shortest trial)
+    :param n_jobs: number of worker processes (default the number of CPUs)
+    :param include_models: also load the trials from model.pickle of sessions without saved trials
+    :return: Dataset with X (n_trials, n_channels, n_samples), y (n_trials,), the session of each trial, the
+             channels names and the sampling rate (None if the sessions have no metadata.json). Train with
+             `MLModel(trials=list(dataset.X), labels=dataset.y.tolist())`
+    """
+    subjects = [subjects] if isinstance(subjects, str) else list(subjects)
+
+    # Collect the sessions folders
+    directories = []
+    for subject in subjects:
+        subject_directory = os.path.join(recordings_path, subject)
+        names = sessions if sessions is not None else sorted(os.listdir(subject_directory))
+        directories += [os.path.join(subject_directory, str(s)) for s in names
+                        if os.path.isdir(os.path.join(subject_directory, str(s)))]
+
+    # Load & decode the sessions in parallel
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        sessions = executor.map(load_session, directories, [include_models] * len(directories))
+        loaded = [s for s in sessions if s is not None and len(s.trials) > 0]
+
+    if len(loaded) == 0:
+        raise ValueError(f'No trials were found for {subjects} in {recordings_path}')
+
+    # The sessions must have the same sampling rate (when it is known)
+    rates = {s.sfreq for s in loaded if s.sfreq is not None}
+    if len(rates) > 1:
+        raise ValueError(f'The sessions have different sampling rates {sorted(rates)}')
+
+    # Common channels & length
+    if channels is None:
+        channels = [ch for ch in loaded[0].ch_names if all(ch in s.ch_names for s in loaded)]
+    if n_samples is None:
+        n_samples = min(t.shape[1] for s in loaded for t in s.trials)
+
+    X, y, session_names = [], [], []
+    for session in loaded:
+        ch_idx = [session.ch_names.index(ch) for ch in channels]
+        for trial, label in zip(session.trials, session.labels):
+            if trial.shape[1] < n_samples:
+                raise ValueError(f'A trial in {session.name} is shorter than {n_samples} samples')
+            X.append(trial[ch_idx, :n_samples])
+            y.append(int(label))
+            session_names.append(session.name)
+
+    return Dataset(np.stack(X).astype(np.float64), np.asarray(y), np.asarray(session_names), channels,
+                   rates.pop() if rates else None)
@@ -1,12 +1,17 @@
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, TYPE_CHECKING
 
-import mne
 import numpy as np
-import pandas as pd
-import serial.tools.list_ports
+from bci4als.features import FEATURES, FeatureExtractor
+from bci4als.filtering import band_pass
+from bci4als.recording import RawRecorder
+from bci4als.spatial import MOTOR_LAPLACIAN, SpatialFilter
 from brainflow import BrainFlowInputParams, BoardShim, BoardIds
-from mne_features.feature_extraction import extract_features
 from nptyping import NDArray
+from scipy.signal import butter, sosfilt, sosfilt_zi
+
+# mne, pandas & mne_features are heavy, they are imported only by the methods which use them
+if TYPE_CHECKING:
+    import mne
 
 
 class EEG:
@@ -45,35 +50,64 @@ class EEG:
         self.marker_row = self.board.get_marker_channel(self.board_id)
         self.eeg_names = self.get_board_names()
 
-    def extract_trials(self, data: NDArray) -> [List[Tuple], List[int]]:
+        # Streaming filter stage (see `init_filter_bank`)
+        self.filter_bank: Optional[FilterBank] = None
+
+        # Sliding window buffers (see `init_ring_buffer`)
+        self.ring_buffer: Optional[RingBuffer] = None
+        self.filtered_ring_buffer: Optional[RingBuffer] = None
+
+        # Background recorder of the raw stream (see `start_recording`)
+        self.recorder: Optional[RawRecorder] = None
+
+        # Spatial filters of the board channels by kind (see `get_spatial_filter`)
+        self._spatial_filters: Dict[str, SpatialFilter] = {}
+
+        # mne objects & board rows of channels lists, built once (see `get_info` & `get_channel_indices`)
+        self._montage: Optional['mne.channels.DigMontage'] = None
+        self._infos: Dict[Tuple[str, ...], 'mne.Info'] = {}
+        self._channel_indices: Dict[Tuple[str, ...], NDArray] = {}
+
+    def extract_trials(self, data: NDArray) -> [NDArray, List[int]]:
         """
         The method get ndarray and extract the labels and durations from the data.
         :param data: the data from the board.
-        :return:
+        :return: ndarray with the shape (n_trials, 2) of the start & stop indices, and the labels of the trials
         """
 
-        # Init params
-        durations, labels = [], []
-
         # Get marker indices
-        markers_idx = np.where(data[self.marker_row, :] != 0)[0]
+        markers_idx = np.flatnonzero(data[self.marker_row, :])
 
-        # For each marker
-        for idx in markers_idx:
+        return self.pair_markers(markers_idx, data[self.marker_row, markers_idx], data.shape[1])
 
-            # Decode the marker
-            status, label, _ = self.decode_marker(data[self.marker_row, idx])
+    def pair_markers(self, markers_idx: NDArray, markers_value: NDArray, n_samples: int) -> [NDArray, List[int]]:
+        """
+        Extract the trials from the markers.
+        Each start marker is paired with the first stop marker after it (and before the next start).
+        :param markers_idx: sample index of each marker
+        :param markers_value: value of each marker
+        :param n_samples: total number of samples in the data
+        :return: ndarray with the shape (n_trials, 2) of the start & stop indices, and the labels of the trials
+        """
+        markers_idx = np.asarray(markers_idx, dtype=np.int64)
 
-            if status == 'start':
+        # Decode all the markers at once
+        status, labels, _ = self.decode_marker(np.asarray(markers_value))
+        starts = markers_idx[status == 'start']
+        stops = markers_idx[status == 'stop']
 
-                labels.append(label)
-                durations.append((idx,))
+        # Pair each start with the first following stop
+        pairs = np.searchsorted(stops, starts)
+        next_starts = np.append(starts[1:], n_samples)
+        valid = pairs < len(stops)
+        valid[valid] = stops[pairs[valid]] < next_starts[valid]
 
-            elif status == 'stop':
+        if not valid.all():
+            raise ValueError(f'Missing stop marker for the trials starting at samples {starts[~valid].tolist()}')
 
-                durations[-1] += (idx,)
+        durations = np.stack([starts, stops[pairs]], axis=1)
 
-        return durations, labels
+        return durations, labels[status == 'start'].tolist()
 
     def on(self):
         """Turn EEG On"""
@@ -113,72 +147,159 @@ class EEG:
         column_names.update({timestamp_channel: "timestamp",
                              marker_channel: "marker"})
 
-        df = pd.DataFrame(board_data.T)
-        df.rename(columns=column_names)
+        import pandas as pd
 
-        # drop unused channels
-        df = df[column_names]
+        df = pd.DataFrame(board_data.T)[list(column_names)].rename(columns=column_names)
 
-        # decode int markers
-        df['marker'] = df['marker'].apply(self.decode_marker)
-        df[['marker_status', 'marker_label', 'marker_index']] = pd.DataFrame(df['marker'].tolist(), index=df.index)
+        # decode int markers (rows without marker get an empty status)
+        status, label, index = self.decode_marker(df['marker'].to_numpy())
+        df['marker_status'], df['marker_label'], df['marker_index'] = status, label, index
         return df
 
-    def _board_to_mne(self, board_data: NDArray, ch_names: List[str]) -> mne.io.RawArray:
+    def _board_to_mne(self, board_data: NDArray, ch_names: List[str]) -> 'mne.io.RawArray':
         """
         Convert the ndarray board data to mne object
         :param board_data: raw ndarray from board
         :return:
         """
+        import mne
+
         eeg_data = board_data / 1000000  # BrainFlow returns uV, convert to V for MNE
 
-        # Creating MNE objects from BrainFlow data arrays
-        ch_types = ['eeg'] * len(board_data)
-        info = mne.create_info(ch_names=ch_names, sfreq=self.sfreq, ch_types=ch_types)
-        raw = mne.io.RawArray(eeg_data, info, verbose=False)
+        # Creating MNE objects from BrainFlow data arrays (the raw object copies the cached info)
+        raw = mne.io.RawArray(eeg_data, self.get_info(ch_names), verbose=False)
 
         return raw
 
-    def get_raw_data(self, ch_names: List[str]) -> mne.io.RawArray:
+    def get_montage(self) -> 'mne.channels.DigMontage':
+        """The standard 10-20 montage, built once"""
+        if self._montage is None:
+            from mne.channels import make_standard_montage
+            self._montage = make_standard_montage('standard_1020')
+
+        return self._montage
+
+    def get_info(self, ch_names: Optional[List[str]] = None) -> 'mne.Info':
         """
-        The method returns dataframe with all the raw data, and empties the buffer
+        The mne info of the given channels with the standard 10-20 montage, built once per channels list.
+        Don't modify the returned info, copy it first.
+        :param ch_names: list[str] of channels (None for the board channels)
+        :return: the mne info
+        """
+        key = tuple(ch_names if ch_names is not None else self.eeg_names)
 
-        :param ch_names: list[str] of channels to select
-        :return: mne_raw data
+        if key not in self._infos:
+            import mne
+
+            info = mne.create_info(ch_names=list(key), sfreq=self.sfreq, ch_types=['eeg'] * len(key))
+            info.set_montage(self.get_montage(), on_missing='ignore')
+            self._infos[key] = info
+
+        return self._infos[key]
+
+    def get_channel_indices(self, ch_names: List[str]) -> NDArray:
+        """
+        The rows of the given channels in the board data, built once per channels list.
+        :param ch_names: list[str] of channels
+        :return: ndarray of the rows
         """
+        key = tuple(ch_names)
+
+        if key not in self._channel_indices:
+            board_channels = np.asarray(self.get_board_channels())
+            self._channel_indices[key] = board_channels[[self.eeg_names.index(ch) for ch in ch_names]]
 
-        indices = [self.eeg_names.index(ch) for ch in ch_names]
+        return self._channel_indices[key]
 
-        data = self.board.get_board_data()[indices]
+    def get_data(self, ch_names: List[str]) -> NDArray:
+        """
+        The method returns ndarray with all the raw data of the channels (uV), and empties the buffer.
+        This is the lightweight version of `get_raw_data`, without mne objects.
 
-        return self._board_to_mne(data, ch_names)
+        :param ch_names: list[str] of channels to select
+        :return: ndarray with the shape (n_channels, n_samples)
+        """
+        return self.board.get_board_data()[self.get_channel_indices(ch_names)]
+
+    def get_raw_data(self, ch_names: List[str]) -> 'mne.io.RawArray':
+        """
+        The method returns dataframe with all the raw data, and empties the buffer
+
+        :param ch_names: list[str] of channels to select
+        :return: mne_raw data
+        """
+        return self._board_to_mne(self.get_data(ch_names), ch_names)
 
     def get_features(self, channels: List[str], selected_funcs: List[str],
                      notch: float = 50, low_pass: float = 4, high_pass: float = 50) -> NDArray:
         """
         Returns features of all data since last call to get_board_data method.
+        The data is filtered with numpy (the same filter as `filter_data`), without mne objects, and the
+        features of `bci4als.features` are computed natively (other features by mne_features).
         :return features: NDArray of shape (1, n_features)
         """
 
-        # Get the raw data
-        data = self.get_raw_data(ch_names=channels)
+        # Get the raw data (in V like the mne objects)
+        data = self.get_data(ch_names=channels) / 1000000
 
         # Filter
-        data = self.filter_data(data, notch, low_pass, high_pass)
+        data = band_pass(data, self.sfreq, low_pass, high_pass)
 
         # Extract features
-        features = extract_features(data.get_data()[np.newaxis], self.sfreq,
-                                    selected_funcs,
-                                    {'pow_freq_bands__freq_bands': np.array([8, 10, 12.5, 30])})
+        freq_bands = np.array([8, 10, 12.5, 30])
+        if all(f in FEATURES for f in selected_funcs):
+            return FeatureExtractor(self.sfreq, selected_funcs, freq_bands).transform(data[np.newaxis])
+
+        from mne_features.feature_extraction import extract_features
+
+        features = extract_features(data[np.newaxis], self.sfreq, selected_funcs,
+                                    {'pow_freq_bands__freq_bands': freq_bands})
 
         return features
 
+    def start_recording(self, session_directory: str, interval: float = 0.5, max_chunks: int = 32) -> RawRecorder:
+        """
+        Start recording the raw stream into the session directory in the background.
+        While recording, the recorder drains the board, so don't get the board data in other places.
+        :param session_directory: the folder of the raw file
+        :param interval: time in seconds between draining the board
+        :param max_chunks: maximal number of chunks waiting to be written before the recorder waits
+        :return: the recorder
+        """
+        self.recorder = RawRecorder(self.board.get_board_data, session_directory, self.marker_row,
+                                    interval, max_chunks, BoardShim.get_num_rows(self.board_id))
+        self.recorder.start()
+
+        return self.recorder
+
+    def stop_recording(self) -> RawRecorder:
+        """
+        Stop the background recording after writing all the samples so far.
+        :return: the recorder (with the statistics & markers of the recording)
+        """
+        recorder, self.recorder = self.recorder, None
+        recorder.stop()
+
+        if recorder.n_backpressure > 0:
+            print(f'The recorder waited for the disk {recorder.n_backpressure} times '
+                  f'(max {recorder.max_queue} chunks in the queue)')
+
+        return recorder
+
     def clear_board(self):
         """Clear all data from the EEG board"""
 
         # Get the data and don't save it
         self.board.get_board_data()
 
+        # The stream is not continuous anymore, so the filters state and the windows are meaningless
+        if self.filter_bank is not None:
+            self.filter_bank.reset()
+
+        for buffer in (self.ring_buffer, self.filtered_ring_buffer):
+            if buffer is not None:
+                buffer.clear()
+
     def get_board_data(self) -> NDArray:
         """The method returns the data from board and remove it"""
         return self.board.get_board_data()
@@ -191,6 +312,27 @@ class EEG:
         else:
             return self.board.get_eeg_names(self.board_id)
 
+    def get_spatial_filter(self, kind: str = 'motor_laplacian') -> SpatialFilter:
+        """
+        The spatial filter of the board channels. The filter matrix is built once and reused by every call.
+        :param kind: 'motor_laplacian' (C3 & C4 laplacian), 'laplacian' (all the channels, nearest
+                     neighbours in the montage) or 'car' (common average reference)
+        :return: the spatial filter
+        """
+        if kind not in self._spatial_filters:
+
+            ch_names = self.get_board_names()
+            if kind == 'motor_laplacian':
+                self._spatial_filters[kind] = SpatialFilter.laplacian(ch_names, MOTOR_LAPLACIAN)
+            elif kind == 'laplacian':
+                self._spatial_filters[kind] = SpatialFilter.laplacian(ch_names)
+            elif kind == 'car':
+                self._spatial_filters[kind] = SpatialFilter.car(ch_names)
+            else:
+                raise ValueError(f'Unknown spatial filter `{kind}`, use one of motor_laplacian, laplacian or car')
+
+        return self._spatial_filters[kind]
+
     def get_board_channels(self, alternative=True) -> List[int]:
         """Get list with the channels locations as list of int"""
         if alternative:
@@ -202,6 +344,68 @@ class EEG:
         """Get NDArray only with the channels data (without all the markers and other stuff)"""
         return self.board.get_board_data()[self.get_board_channels()]
 
+    def init_filter_bank(self, bands: List[Tuple[float, float]], order: int = 4):
+        """
+        Init a streaming (causal) filter bank for the board channels.
+        :param bands: list of (low, high) pass-bands in Hz
+        :param order: order of the butterworth filter of each band
+        :return:
+        """
+        self.filter_bank = FilterBank(self.sfreq, bands, order)
+
+    def filter_channels_data(self, data: NDArray) -> NDArray:
+        """
+        Pass new channels data through the streaming filter bank.
+        The filters state is kept between calls, so consecutive chunks (e.g. from `get_channels_data`) are
+        filtered as one continuous signal and each sample is filtered exactly once.
+        :param data: the new samples, ndarray with the shape (n_channels, n_new_samples)
+        :return: ndarray with the shape (n_bands, n_channels, n_new_samples)
+        """
+        if self.filter_bank is None:
+            raise RuntimeError('The filter bank is not initialized, use `init_filter_bank` first')
+
+        return self.filter_bank.process(data)
+
+    def init_ring_buffer(self, seconds: float):
+        """
+        Preallocate ring buffers which hold the last `seconds` of the channels data.
+        If the filter bank was initialized, the filtered data is buffered as well.
+        :param seconds: the length of the buffer in seconds
+        :return:
+        """
+        capacity = int(np.ceil(seconds * self.sfreq))
+        self.ring_buffer = RingBuffer((len(self.get_board_channels()),), capacity)
+
+        if self.filter_bank is not None:
+            shape = (len(self.filter_bank.bands), len(self.get_board_channels()))
+            self.filtered_ring_buffer = RingBuffer(shape, capacity)
+
+    def update_ring_buffer(self, data: Optional[NDArray] = None) -> int:
+        """
+        Move the new samples from the board (which empties the board buffer) into the ring buffers.
+        :param data: the new channels data (n_channels, n_samples), if it was already taken from the board
+        :return: the number of new samples
+        """
+        if data is None:
+            data = self.get_channels_data()
+        self.ring_buffer.extend(data)
+
+        if self.filtered_ring_buffer is not None:
+            self.filtered_ring_buffer.extend(self.filter_channels_data(data))
+
+        return data.shape[-1]
+
+    def get_window(self, seconds: float, filtered: bool = False) -> NDArray:
+        """
+        Get the last `seconds` of data from the ring buffer.
+        :param seconds: the length of the window in seconds
+        :param filtered: get the window from the filtered ring buffer
+        :return: ndarray with the shape (n_channels, n_samples), or (n_bands, n_channels, n_samples) if filtered
+        """
+        buffer = self.filtered_ring_buffer if filtered else self.ring_buffer
+
+        return buffer.latest(int(round(seconds * self.sfreq)))
+
     def find_serial_port(self) -> str:
         """
         Return the string of the serial port to which the FTDI dongle is connected.
@@ -211,6 +415,8 @@ class EEG:
         if self.board_id == BoardIds.SYNTHETIC_BOARD:
             return ""
         else:
+            import serial.tools.list_ports
+
             plist = serial.tools.list_ports.comports()
             FTDIlist = [comport for comport in plist if comport.manufacturer == 'FTDI']
             if len(FTDIlist) > 1:
@@ -221,8 +427,8 @@ class EEG:
             return FTDIlist[0].name
 
     @staticmethod
-    def filter_data(data: mne.io.RawArray,
-                    notch: float, low_pass: float, high_pass: float) -> mne.io.RawArray:
+    def filter_data(data: 'mne.io.RawArray',
+                    notch: float, low_pass: float, high_pass: float) -> 'mne.io.RawArray':
 
         # data.notch_filter(freqs=notch, verbose=False)
         data.filter(l_freq=low_pass, h_freq=high_pass, verbose=False)
@@ -230,72 +436,172 @@ class EEG:
         return data
 
     @staticmethod
-    def encode_marker(status: str, label: int, index: int):
+    def encode_marker(status, label, index):
         """
         Encode a marker for the EEG data.
+        All the arguments can be arrays, in order to encode many markers at once.
         :param status: status of the stim (start/end)
         :param label: the label of the stim (right -> 0, left -> 1, idle -> 2, tongue -> 3, legs -> 4)
         :param index: index of the current label
         :return:
         """
-        markerValue = 0
-        if status == "start":
-            markerValue += 1
-        elif status == "stop":
-            markerValue += 2
-        else:
-            raise ValueError("incorrect status value")
+        status = np.asarray(status)
 
-        markerValue += 10 * label
+        if not np.isin(status, ('start', 'stop')).all():
+            raise ValueError("incorrect status value")
 
-        markerValue += 100 * index
+        marker_value = np.where(status == 'start', 1, 2) + 10 * np.asarray(label) + 100 * np.asarray(index)
 
-        return markerValue
+        return int(marker_value) if marker_value.ndim == 0 else marker_value
 
     @staticmethod
-    def decode_marker(marker_value: int) -> (str, int, int):
+    def decode_marker(marker_value):
         """
         Decode the marker and return a tuple with the status, label and index.
         Look for the encoder docs for explanation for each argument in the marker.
-        :param marker_value:
+        A whole marker row can be decoded at once, samples without a marker (zero) get an empty status.
+        :param marker_value: a single marker or an array of markers
         :return:
         """
-        if marker_value % 10 == 1:
-            status = "start"
-            marker_value -= 1
-        elif marker_value % 10 == 2:
-            status = "stop"
-            marker_value -= 2
-        else:
+        marker_value = np.rint(marker_value).astype(np.int64)
+        status_code = marker_value % 10
+
+        if np.any((marker_value != 0) & (status_code != 1) & (status_code != 2)) or \
+                (marker_value.ndim == 0 and marker_value == 0):
             raise ValueError("incorrect status value. Use start or stop.")
 
-        label = ((marker_value % 100) - (marker_value % 10)) / 10
+        status = np.where(status_code == 1, 'start', np.where(status_code == 2, 'stop', ''))
+        label = (marker_value // 10) % 10
+        index = marker_value // 100
 
-        index = (marker_value - (marker_value % 100)) / 100
+        if marker_value.ndim == 0:
+            return str(status), int(label), int(index)
 
-        return status, int(label), int(index)
+        return status, label, index
 
     @staticmethod
-    def laplacian(data: NDArray, channels: List[str]):
+    def laplacian(data: NDArray, channels: List[str]) -> NDArray:
         """
         The method execute laplacian on the raw data.
         The laplacian was computed as follows:
-            1. C3 = C3 - mean(Cz + F3 + P3 + T3)
-            2. C4 = C4 - mean(Cz + F4 + P4 + T4)
+            1. C3 = C3 - mean(Cz + FC5 + FC1 + CP5 + CP1)
+            2. C4 = C4 - mean(Cz + FC2 + FC6 + CP2 + CP6)
+
+        The data need to be (..., n_channel, n_samples), the given data is not modified.
+        See `get_spatial_filter` for a filter which is built once.
+        :return: ndarray with the shape (..., 2, n_samples) of C3 & C4
+        """
+        return SpatialFilter.laplacian(channels, MOTOR_LAPLACIAN).apply(data)
+
+
+class FilterBank:
+    """
+    A causal band-pass filter bank for streaming data.
 
-        The data need to be (n_channel, n_samples)
+    Each band is a butterworth filter in second-order sections. The filters state (`zi`) is kept between
+    calls to `process`, so the cost of each call depends only on the amount of new samples and there are no
+    edge effects between consecutive chunks.
+
+    Attributes
+    ----------
+    sfreq : float
+        the sampling rate of the data
+    bands : list
+        list of (low, high) pass-bands in Hz
+    sos : list
+        second-order sections of each band
+    """
+
+    def __init__(self, sfreq: float, bands: List[Tuple[float, float]], order: int = 4):
+
+        self.sfreq: float = sfreq
+        self.bands: List[Tuple[float, float]] = list(bands)
+        self.sos: List[NDArray] = [butter(order, band, btype='bandpass', fs=sfreq, output='sos')
+                                   for band in self.bands]
+        self._zi: Optional[List[NDArray]] = None
+
+    def reset(self):
+        """Forget the filters state, the next chunk will be treated as the start of the stream"""
+        self._zi = None
+
+    def process(self, data: NDArray) -> NDArray:
+        """
+        Filter the next chunk of the stream with all the bands.
+        :param data: ndarray with the shape (n_channels, n_samples)
+        :return: ndarray with the shape (n_bands, n_channels, n_samples)
+        """
+        data = np.asarray(data, dtype=np.float64)
+        out = np.empty((len(self.sos),) + data.shape)
+
+        if data.shape[-1] == 0:
+            return out
+
+        # Start from steady state according to the first sample to avoid a step response
+        if self._zi is None:
+            self._zi = [sosfilt_zi(sos)[:, np.newaxis, :] * data[np.newaxis, :, :1] for sos in self.sos]
+
+        # Each band filters all the channels at once
+        for i, sos in enumerate(self.sos):
+            out[i], self._zi[i] = sosfilt(sos, data, axis=-1, zi=self._zi[i])
+
+        return out
+
+
+class RingBuffer:
+    """
+    A preallocated circular buffer for streaming samples.
+
+    The samples are stored along the last axis, new samples overwrite the oldest ones.
+
+    Attributes
+    ----------
+    data : NDArray
+        the underlying buffer with the shape (*shape, capacity)
+    capacity : int
+        the maximal number of samples in the buffer
+    n_written : int
+        the total number of samples written since the last clear
+    """
+
+    def __init__(self, shape: Tuple[int, ...], capacity: int):
+
+        self.data: NDArray = np.zeros(tuple(shape) + (capacity,))
+        self.capacity: int = capacity
+        self.n_written: int = 0
+
+    def __len__(self) -> int:
+        return min(self.n_written, self.capacity)
+
+    def clear(self):
+        """Forget all the samples in the buffer"""
+        self.n_written = 0
+
+    def extend(self, chunk: NDArray):
+        """
+        Append new samples to the buffer.
+        :param chunk: ndarray with the shape (*shape, n_samples)
         :return:
         """
+        n_samples = chunk.shape[-1]
+        start = (self.n_written + max(n_samples - self.capacity, 0)) % self.capacity
+        chunk = chunk[..., -self.capacity:]
+        first = min(chunk.shape[-1], self.capacity - start)
 
-        # Dict with all the indices of the channels
-        idx = {ch: channels.index(ch) for ch in channels}
+        self.data[..., start:start + first] = chunk[..., :first]
+        self.data[..., :chunk.shape[-1] - first] = chunk[..., first:]
 
-        # C3
-        data[idx['C3']] -= (data[idx['Cz']] + data[idx['FC5']] + data[idx['FC1']] +
-                            data[idx['CP5']] + data[idx['CP1']]) / 5
+        self.n_written += n_samples
+
+    def latest(self, n_samples: int) -> NDArray:
+        """
+        Get the latest samples in chronological order.
+        :param n_samples: number of samples (limited by the samples in the buffer)
+        :return: ndarray with the shape (*shape, n_samples)
+        """
+        n_samples = min(n_samples, len(self))
+        end = self.n_written % self.capacity
 
-        # C4
-        data[idx['C4']] -= (data[idx['Cz']] + data[idx['FC2']] + data[idx['FC6']] +
-                            data[idx['CP2']] + data[idx['CP6']]) / 5
+        if n_samples <= end:
+            return self.data[..., end - n_samples:end].copy()
 
-        return data[[idx['C3'], idx['C4']]]
+        return np.concatenate([self.data[..., self.capacity - (n_samples - end):], self.data[..., :end]], axis=-1)
@@ -0,0 +1,105 @@
+from collections import namedtuple
+from typing import Optional, Tuple
+
+import numpy as np
+from bci4als.incremental import IncrementalCSPLDA
+from joblib import Parallel, delayed
+from nptyping import NDArray
+from sklearn.model_selection import ShuffleSplit
+
+# Scores of the cross-validation
+#   scores:         (n_folds,) accuracy of each fold on the training window
+#   window_scores:  (n_folds, n_windows) accuracy of each fold on each sliding window
+#   window_times:   (n_windows,) time in seconds of the center of each window
+#   confusion:      (n_folds, n_classes, n_classes) confusion matrix of each fold (rows - true, cols - predicted)
+#   classes:        (n_classes,) the labels of the confusion matrices
+CrossValResult = namedtuple('CrossValResult', ['scores', 'window_scores', 'window_times', 'confusion', 'classes'])
+
+
+def window_covariances(X: NDArray, w_length: int, w_step: int) -> NDArray:
+    """
+    Compute the (uncentered) spatial covariance of every sliding window of every trial in one einsum.
+    :param X: trials with shape (n_trials, n_channels, n_samples)
+    :param w_length: window length in samples
+    :param w_step: step between windows in samples
+    :return: ndarray with shape (n_trials, n_windows, n_channels, n_channels)
+    """
+    # View of the windows without copying, shape (n_trials, n_channels, n_windows, w_length)
+    windows = np.lib.stride_tricks.sliding_window_view(X, w_length, axis=2)[:, :, ::w_step]
+
+    return np.einsum('ncwt,ndwt->nwcd', windows, windows, optimize=True) / w_length
+
+
+def _score_fold(X_train: NDArray, y_train: NDArray, X_test: NDArray, y_test: NDArray, X_windows: NDArray,
+                classes: NDArray, n_components: int, w_length: int, w_step: int) -> Tuple[float, NDArray, NDArray]:
+    """
+    Fit CSP & LDA on the training trials and score it on the test trials and on their sliding windows.
+    :return: the score, the scores of the windows and the confusion matrix
+    """
+    clf = IncrementalCSPLDA(n_components=n_components).fit(X_train, y_train)
+
+    # Score on the training window
+    y_pred = clf.predict(X_test)
+    confusion = np.zeros((len(classes), len(classes)), dtype=int)
+    np.add.at(confusion, (np.searchsorted(classes, y_test), np.searchsorted(classes, y_pred)), 1)
+
+    # Score all the windows at once
+    covs = window_covariances(X_windows, w_length, w_step)
+    features = clf.covariance_features(covs.reshape(-1, *covs.shape[2:]))
+    decision = features @ clf.coef_.T + clf.intercept_
+    window_pred = clf.classes_[np.argmax(decision, axis=-1)].reshape(covs.shape[:2])
+    window_scores = (window_pred == y_test[:, np.newaxis]).mean(axis=0)
+
+    return float(np.mean(y_pred == y_test)), window_scores, confusion
+
+
+def cross_validate(X: NDArray, y: NDArray, sfreq: float, train_window: Optional[Tuple[float, float]] = None,
+                   w_length: float = 0.5, w_step: float = 0.1, n_components: int = 6, cv=None,
+                   groups: Optional[NDArray] = None, n_jobs: int = -1, tmin: float = 0.) -> CrossValResult:
+    """
+    Cross-validate CSP & LDA and score each fold over time with a running classifier.
+
+    The folds run in parallel (joblib), and inside each fold the CSP features of all the sliding windows
+    are computed in a single batch.
+
+    :param X: band-passed epochs with shape (n_trials, n_channels, n_samples)
+    :param y: labels with shape (n_trials,)
+    :param sfreq: the sampling rate
+    :param train_window: (tmin, tmax) in seconds (epochs time, see `tmin`) of the part of the epochs used for
+                         training (default all)
+    :param w_length: running classifier window length in seconds
+    :param w_step: running classifier window step in seconds
+    :param n_components: number of CSP components
+    :param cv: sklearn cross-validation generator (default ShuffleSplit(4, test_size=0.2, random_state=42))
+    :param groups: group of each trial for group-aware generators (e.g. the session of each trial)
+    :param n_jobs: number of parallel jobs
+    :param tmin: the time in seconds of the first sample of the epochs (e.g. `epochs.tmin`)
+    :return: CrossValResult
+    """
+    X, y = np.asarray(X, dtype=np.float64), np.asarray(y)
+    cv = ShuffleSplit(4, test_size=0.2, random_state=42) if cv is None else cv
+    classes = np.unique(y)
+
+    # Training part of the epochs (inclusive, like mne crop)
+    if train_window is None:
+        X_train_window = X
+    else:
+        start, stop = (int(round((t - tmin) * sfreq)) for t in train_window)
+        X_train_window = X[:, :, start:stop + 1]
+
+    w_length, w_step = int(sfreq * w_length), int(sfreq * w_step)
+
+    # The windows start before n_samples - w_length (the last full window is not scored), as in the loop of
+    # the running classifier this replaced, so the window scores are comparable to the older ones
+    X_windows = X[:, :, :-1]
+
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_score_fold)(X_train_window[train_idx], y[train_idx], X_train_window[test_idx], y[test_idx],
+                             X_windows[test_idx], classes, n_components, w_length, w_step)
+        for train_idx, test_idx in cv.split(X, y, groups))
+
+    scores, window_scores, confusion = zip(*results)
+    w_start = np.arange(0, X.shape[2] - w_length, w_step)
+    window_times = (w_start + w_length / 2.) / sfreq + tmin
+
+    return CrossValResult(np.array(scores), np.stack(window_scores), window_times, np.stack(confusion), classes)
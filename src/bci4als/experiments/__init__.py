@@ -0,0 +1,24 @@
+import importlib
+
+# The experiments are imported on first access (PEP 562), the offline experiment loads psychopy
+_lazy_imports = {
+    'OfflineExperiment': 'bci4als.experiments.offline',
+    'OnlineExperiment': 'bci4als.experiments.online',
+    'ReplayExperiment': 'bci4als.experiments.replay',
+}
+
+__all__ = list(_lazy_imports)
+
+
+def __getattr__(name: str):
+
+    if name in _lazy_imports:
+        value = getattr(importlib.import_module(_lazy_imports[name]), name)
+        globals()[name] = value
+        return value
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -1,6 +1,7 @@
 import os
 import random
 import sys
+from typing import Any, Dict
 from datetime import datetime
 from tkinter import messagebox
 from tkinter.filedialog import askdirectory
@@ -9,9 +10,10 @@ from tkinter import Tk, Entry, Label, Button
 import brainflow
 import numpy as np
 
+from bci4als.catalog import RecordingCatalog
 from bci4als.eeg import EEG
+from bci4als.metadata import METADATA_TEXT_FILE, SessionMetadata, write_metadata as write_session_metadata
 from bci4als.experiments.feedback import Feedback
-from psychopy import event
 
 
 class Experiment:
@@ -41,11 +43,12 @@ class Experiment:
 
     def write_metadata(self):
         # The path of the metadata file
-        path = os.path.join(self.session_directory, 'metadata.txt')
+        path = os.path.join(self.session_directory, METADATA_TEXT_FILE)
+        start_time = datetime.now()
 
         with open(path, 'w') as file:
             # Datetime
-            file.write(f'Experiment datetime: {datetime.now()}\n\n')
+            file.write(f'Experiment datetime: {start_time}\n\n')
 
             # Channels
             file.write('EEG Channels:\n')
@@ -63,6 +66,32 @@ class Experiment:
             file.write(f'Labels Enum: {self.enum_image}\n')
             file.write(f'Skip After: {self.skip_after}\n')
 
+        # The same metadata as json, for the loaders
+        skip_after = int(self.skip_after) if self.skip_after not in (None, False) else None
+        metadata = SessionMetadata(experiment_type=self.experiment_type, datetime=start_time.isoformat(),
+                                   sfreq=float(self.eeg.sfreq), board_id=int(self.eeg.board_id),
+                                   channels=list(self.eeg.get_board_names()),
+                                   channel_indices=[int(c) for c in self.eeg.get_board_channels()],
+                                   marker_row=int(self.eeg.marker_row), num_trials=int(self.num_trials),
+                                   trial_length=self.trial_length, cue_length=self.cue_length,
+                                   labels_enum=dict(self.enum_image), skip_after=skip_after,
+                                   parameters=self._metadata_parameters())
+        write_session_metadata(self.session_directory, metadata)
+
+    def _metadata_parameters(self) -> Dict[str, Any]:
+        """The parameters of the experiment type for the session metadata (override in subclass)"""
+        return {}
+
+    def update_catalog(self):
+        """
+        Index the session folder in the recordings catalog, after the session files were written.
+        :return:
+        """
+        recordings_folder = os.path.dirname(os.path.dirname(os.path.normpath(self.session_directory)))
+
+        with RecordingCatalog(recordings_folder) as catalog:
+            catalog.update_session(self.session_directory)
+
     def _ask_subject_directory(self):
         """
         init the current subject directory
@@ -90,9 +119,16 @@ class Experiment:
         # Define a function to return the Input data
         def get_num_trials():
             try:
-                self.num_trials = entry.get()
-            except:
-                ValueError('You should enter a number!')
+                num_trials = int(entry.get())
+            except ValueError:
+                messagebox.showerror(title='bci4als', message='You should enter a number!')
+                return
+
+            # The labels are drawn for the number of trials
+            if num_trials != self.num_trials:
+                self.num_trials = num_trials
+                self.labels = []
+                self._init_labels()
             win.destroy()
 
         entry = Entry(win, width=42)
@@ -116,6 +152,7 @@ class Experiment:
         feedback.display(0)
 
         # Wait for key-press
+        from psychopy import event
         event.waitKeys()
 
         # Empty the board
@@ -129,6 +166,8 @@ class Experiment:
         :return: string of the key
         """
 
+        from psychopy import event
+
         keys = event.getKeys()
         if keys:
             return keys[0]
@@ -140,24 +179,17 @@ class Experiment:
         """
         The method create new folder for the current session. The folder will be at the given subject
         folder.
-        The method also creating a metadata file and locate it inside the session folder
+        The session number is the next number of the subject in the recordings catalog.
         :param subject_folder: path to the subject folder
         :return: session folder path
         """
 
-        current_sessions = []
-        for f in os.listdir(subject_folder):
-
-            # try to convert the current sessions folder to int
-            # and except if one of the sessions folder is not integer
-            try:
-                current_sessions.append(int(f))
-
-            except ValueError:
-                continue
+        # The next session number comes from the recordings catalog (the parent of the subject folder)
+        recordings_folder, subject = os.path.split(os.path.normpath(subject_folder))
+        with RecordingCatalog(recordings_folder) as catalog:
+            session = catalog.next_session(subject)
 
         # Create the new session folder
-        session = (max(current_sessions) + 1) if len(current_sessions) > 0 else 1
         session_folder = os.path.join(subject_folder, str(session))
         os.mkdir(session_folder)
 
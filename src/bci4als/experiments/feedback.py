@@ -1,8 +1,11 @@
 import os
 import time
 from collections import namedtuple
-from typing import Dict
-from psychopy import visual
+from typing import Dict, TYPE_CHECKING
+
+# psychopy opens a display on import, it is imported only when a feedback is drawn (the replay is headless)
+if TYPE_CHECKING:
+    from psychopy import visual
 
 # name tuple object for the progress bar params
 Bar = namedtuple('Bar', ['pos', 'line_size', 'frame_size', 'frame_color', 'fill_color'])
@@ -43,9 +46,11 @@ class Feedback:
 
     """
 
-    def __init__(self, win: visual.Window, stim: int, buffer_time: float, threshold: int = 3,
+    def __init__(self, win: 'visual.Window', stim: int, buffer_time: float, threshold: int = 3,
                  refresh_rate: float = 0.1):
 
+        from psychopy import visual
+
         self.stim: int = stim
         self.threshold: int = threshold
         self.confident: bool = False
@@ -121,6 +126,8 @@ class Feedback:
 
         # If time to stop trial draw finished message
         if self.stop:
+            from psychopy import visual
+
             if self.confident:
                 text = 'Well done!\nPress any key to continue'
             else:
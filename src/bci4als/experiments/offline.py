@@ -1,17 +1,17 @@
 import datetime
 import os
-import pickle
 import random
 import sys
 import time
 from tkinter import messagebox
 from tkinter.filedialog import askdirectory
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import numpy as np
 import pandas as pd
 from .experiment import Experiment
 from bci4als.eeg import EEG
-from playsound import playsound
+from bci4als.recording import RawRecording, write_trials
+from bci4als.sound import AudioService
 from psychopy import visual
 
 
@@ -26,6 +26,7 @@ class OfflineExperiment(Experiment):
         self.window_params: Dict[str, Any] = {}
         self.full_screen: bool = full_screen
         self.audio: bool = audio
+        self.audio_service: Optional[AudioService] = None
 
         # trial times
         self.cue_length: float = cue_length
@@ -42,9 +43,6 @@ class OfflineExperiment(Experiment):
             'idle': os.path.join(os.path.dirname(__file__), 'images', 'square.jpeg'),
             'tongue': os.path.join(os.path.dirname(__file__), 'images', 'tongue.jpeg'),
             'legs': os.path.join(os.path.dirname(__file__), 'images', 'legs.jpeg')}
-        self.audio_path: Dict[str, str] = {label: os.path.join(os.path.dirname(__file__), 'audio', f'{label}.mp3')
-                                           for label in self.enum_image.values()}
-        self.audio_success_path = os.path.join(os.path.dirname(__file__), 'audio', f'success.mp3')
         self.visual_params: Dict[str, Any] = {'text_color': 'white', 'text_height': 48}
 
 
@@ -122,7 +120,7 @@ class OfflineExperiment(Experiment):
 
         # play sound
         if self.audio:
-            playsound(self.audio_path[trial_image])
+            self.audio_service.play(trial_image)
 
         # Show ready & state message
         state_text = 'Trial: {} / {}'.format(trial_index + 1, self.num_trials)
@@ -144,11 +142,10 @@ class OfflineExperiment(Experiment):
         # Params
         win = self.window_params['main_window']
         trial_img = self.enum_image[self.labels[trial_index]]
-        audio_path = os.path.join(os.path.dirname(__file__), 'audio', '{}.mp3')
 
-        # Play start sound
+        # Play start sound (in the background, so it does not delay the marker)
         if self.audio:
-            playsound(audio_path.format('start'))
+            self.audio_service.play('start')
 
         # Draw and push marker
         self.eeg.insert_marker(status='start', label=self.labels[trial_index], index=trial_index)
@@ -161,7 +158,7 @@ class OfflineExperiment(Experiment):
 
         # Play end sound
         if self.audio:
-            playsound(audio_path.format('end'))
+            self.audio_service.play('end')
 
         # Halt if escape was pressed
         if 'escape' == self.get_keypress():
@@ -170,26 +167,30 @@ class OfflineExperiment(Experiment):
     def _extract_trials(self) -> List[pd.DataFrame]:
         """
         The method extract from the offline experiment collected EEG data and split it into trials.
-        The method export a pickle file to the subject directory with a list with all the trials.
+        The raw stream is recorded to the session directory during the experiment, so the trials are
+        sliced from the raw file using the markers positions collected by the recorder.
         :return: list of trials where each trial is a pandas DataFrame
         """
 
         # Wait for a sec to the OpenBCI to get the last marker
         time.sleep(0.5)
 
+        # Stop the recorder (writes the last samples)
+        recorder = self.eeg.stop_recording()
+        raw = RawRecording(self.session_directory)
+
         # Extract the data
         trials = []
-        data = self.eeg.get_board_data()
         ch_names = self.eeg.get_board_names()
         ch_channels = self.eeg.get_board_channels()
-        durations, labels = self.eeg.extract_trials(data)
+        durations, labels = self.eeg.pair_markers(raw.markers_idx, raw.markers_value, recorder.n_samples)
 
         # Assert the labels
         assert self.labels == labels, 'The labels are not equals to the extracted labels'
 
         # Append each
         for start, end in durations:
-            trial = data[ch_channels, start:end]
+            trial = raw.data[ch_channels, start:end]
             trials.append(pd.DataFrame(data=trial.T, columns=ch_names))
 
         return trials
@@ -200,16 +201,19 @@ class OfflineExperiment(Experiment):
         :param trials:
         :return:
         """
-        # Dump to pickle
-        trials_path = os.path.join(self.session_directory, 'trials.pickle')
-        print(f"Dumping extracted trials recordings to {trials_path}")
-        pickle.dump(trials, open(trials_path, 'wb'))
+        # Dump the trials in the columnar format (see bci4als.recording)
+        print(f"Saving extracted trials recordings to {self.session_directory}")
+        write_trials(self.session_directory, [t.to_numpy().T for t in trials], self.labels,
+                     self.eeg.get_board_names())
 
         # Save the labels as csv file
         labels_path = os.path.join(self.session_directory, 'labels.csv')
         print(f"Saving labels to {labels_path}")
         pd.DataFrame.from_dict({'name': self.labels}).to_csv(labels_path, index=False, header=False)
 
+    def _metadata_parameters(self) -> Dict[str, Any]:
+        return {'next_length': self.next_length, 'ready_length': self.ready_length, 'audio': self.audio}
+
     def run(self):
         # Init the current experiment folder
         self.subject_directory = self._ask_subject_directory()
@@ -221,12 +225,19 @@ class OfflineExperiment(Experiment):
         # Create experiment's metadata
         self.write_metadata()
 
+        # The session is in the catalog from its start, so a crashed session is also listed
+        self.update_catalog()
+
         messagebox.showinfo(title='bci4als', message='Start running trials...')
 
         # Init psychopy and screen params
         self._init_window()
         self.instruction_msg()
 
+        # Decode the sounds once, before the trials
+        if self.audio:
+            self.audio_service = AudioService()
+
 
         # This moved to the base class
         # # Init label vector
@@ -237,6 +248,9 @@ class OfflineExperiment(Experiment):
         print("Turning EEG connection ON")
         self.eeg.on()
 
+        # Record the raw stream to the disk during the experiment
+        self.eeg.start_recording(self.session_directory)
+
         print(f"Running {self.num_trials} trials")
         # Run trials
         for i in range(self.num_trials):
@@ -249,11 +263,17 @@ class OfflineExperiment(Experiment):
         # Export and return the data
         trials = self._extract_trials()
 
+        # Save when the sounds were played
+        if self.audio_service is not None:
+            self.audio_service.close()
+            self.audio_service.save(self.session_directory)
+
         print("Turning EEG connection OFF")
         self.eeg.off()
 
         # Dump files to pickle
         self._export_files(trials)
+        self.update_catalog()
 
         return trials, self.labels
 
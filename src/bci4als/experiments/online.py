@@ -1,25 +1,20 @@
-import json
-import os
-import pickle
-import random
 import sys
-import threading
 import time
-from typing import Dict, Union
-import matplotlib
-import matplotlib.pyplot as plt
-import mne
+from typing import Any, Dict, List, Optional, Tuple, Union
 import numpy as np
-import playsound
+from bci4als.artifact import InferenceModel
+from bci4als.checkpoint import ModelCheckpointer
 from bci4als.eeg import EEG
 from .experiment import Experiment
 from bci4als.experiments.feedback import Feedback
+from bci4als.experiments.pipeline import DecodingPipeline
+from bci4als.features import FeatureExtractor
+from bci4als.filtering import band_pass
 from bci4als.ml_model import MLModel
-from matplotlib.animation import FuncAnimation
-from mne_features.feature_extraction import extract_features
+from bci4als.results import ResultsLog, write_results
+from bci4als.sound import AudioService
+from bci4als.timing import StageTimer
 from nptyping import NDArray
-from psychopy import visual, core
-from sklearn.preprocessing import StandardScaler
 
 
 class OnlineExperiment(Experiment):
@@ -38,11 +33,25 @@ class OnlineExperiment(Experiment):
         threshold (int):
             The amount the times the model need to be correct (predict = stim) before moving to the next stim.
 
+        stream_filter (bool):
+            Band-pass the EEG data with the causal streaming filter bank of the EEG object instead of
+            filtering each buffer on its own.
+
+        hop_time (float):
+            Sliding-window mode. If given, the model predicts every `hop_time` seconds from the last
+            `buffer_time` seconds of data (kept in the EEG ring buffer), instead of once every `buffer_time`.
+
     """
 
-    def __init__(self, eeg: EEG, model: MLModel, num_trials: int,
+    def __init__(self, eeg: EEG, model: Union[MLModel, InferenceModel], num_trials: int,
                  buffer_time: float, threshold: int, skip_after: Union[bool, int] = False,
-                 co_learning: bool = False, debug=False):
+                 co_learning: bool = False, debug=False, stream_filter: bool = False,
+                 hop_time: Optional[float] = None):
+
+        # An inference-only model has no trials and can not be updated
+        if co_learning and isinstance(model, InferenceModel):
+            raise ValueError('Co-learning needs an MLModel (model.pickle), the inference-only model (.npz) '
+                             'can not be updated; load model.pickle or set co_learning=False')
 
         super().__init__(eeg, num_trials)
         # experiment params
@@ -55,11 +64,12 @@ class OnlineExperiment(Experiment):
         self.debug = debug
         self.win = None
         self.co_learning: bool = co_learning
+        self.stream_filter: bool = stream_filter
+        self.hop_time: Optional[float] = hop_time
 
-        # audio
-        # self.audio_success_path = os.path.join(os.path.dirname(__file__), 'audio', f'success.mp3')
-        self.audio_success_path = r'C:\Users\noam\PycharmProjects\bci_4_als\src\bci4als\audio\success.mp3'
-        # todo: make this path generic
+        # audio (the success sound is decoded once in `run`)
+        self.play_sound: bool = True
+        self.audio_service: Optional[AudioService] = None
 
         # Model configs
         self.labels_enum: Dict[str, int] = {'right': 0, 'left': 1, 'idle': 2, 'tongue': 3, 'legs': 4}
@@ -70,111 +80,241 @@ class OnlineExperiment(Experiment):
         # Example: [ [(0, 2), (0,3), (0,0), (0,0), (0,0) ] , [ ...] , ... ,[] ]
         self.results = []
 
+        # Append-only log of each prediction (see `bci4als.results`), opened in `run`
+        self.results_log: Optional[ResultsLog] = None
+
+        # Background saving of the co-learning model (see `run`)
+        self.checkpointer: Optional[ModelCheckpointer] = None
+
+        # Timing of the loop stages, the model records its filter & predict stages into the same timer
+        self.timer = StageTimer()
+        self.model.timer = self.timer
+
     def _learning_model(self, feedback: Feedback, stim: int):
 
         """
-        The method for learning the model from the current stim.
+        The method for learning the model from the current stim, one buffer after the other.
 
-        A separate thread runs this method. The method responsible for the following steps:
+        The replay runs this method (the online experiment runs the same stages in a `DecodingPipeline`).
+        The method responsible for the following steps:
             1. Collecting the EEG data from the board (according to the buffer time attribute).
             2. Predicting the stim using the current model and collected EEG data.
             3. Updating the feedback object according to the model's prediction.
             4. Updating the model according to the data and stim.
 
+        In sliding-window mode (`hop_time` is set) the data is collected every `hop_time` seconds into
+        the EEG ring buffer and each prediction uses the last `buffer_time` seconds, so windows overlap.
+
         :param feedback: feedback visualization for the subject
         :param stim: current stim
         :return:
         """
 
-        timer = core.Clock()
+        timer = self._clock()
         target_predictions = []
         num_tries = 0
+        n_window = int(round(self.buffer_time * self.eeg.sfreq))
+        last_fit = 0  # ring buffer position of the last co-learning update
         while not feedback.stop:
-            # increase num_tries by 1
-            print(f"num tries {num_tries}")
 
-            # Sleep until the buffer full
-            time.sleep(max(0, self.buffer_time - timer.getTime()))
+            # Sleep until the buffer full (or the next hop)
+            self._wait(max(0, self._period() - timer.getTime()))
 
-            # Extract features from the EEG data
-            data = self.eeg.get_channels_data()
+            acquired = self._acquire(timer)
+            if acquired is None:
+                continue
+
+            data, filtered, position = acquired
+            data_time = time.perf_counter()
 
             # Predict the class
-            if self.debug:
-                # in debug mode, be correct 2/3 of the time and incorrect 1/3 of the time.
-                prediction = stim if np.random.rand() <= 2 / 3 else (stim + 1) % len(self.labels_enum)
-            else:
-                # in normal mode, use the loaded model to make a prediction
-                prediction = self.model.online_predict(data, eeg=self.eeg)
-
-            # play sound if successful
-            # todo: make this available to object params
-            self.play_sound = True
-            if self.play_sound:
-                if prediction == stim:
-                    playsound.playsound(self.audio_success_path)
+            prediction, probabilities = self._decide(data, filtered, stim)
 
             # if self.co_learning and (prediction == stim):
-            if self.co_learning:
-                self.model.partial_fit(self.eeg, data, stim)
-                pickle.dump(self.model, open(os.path.join(self.session_directory, 'model.pickle'), 'wb'))
+            # in sliding-window mode, learn only from non-overlapping windows
+            if self.co_learning and (self.hop_time is None or position - last_fit >= n_window):
+                self._learn([data], [stim])
+                last_fit = position
 
-            target_predictions.append((int(stim), int(prediction)))
+            num_tries = self._apply_decision(feedback, stim, prediction, probabilities, data_time, num_tries,
+                                             target_predictions)
 
-            # Reset the clock for the next buffer
-            timer.reset()
+        self._save_results(target_predictions)
 
-            if stim == prediction:
-                num_tries = 0  # if successful, reset num_tries to 0
-            else:
-                num_tries += 1
+    def _apply_decision(self, feedback: Feedback, stim: int, prediction: int, probabilities: Optional[NDArray],
+                        data_time: float, num_tries: int, target_predictions: List[Tuple[int, int]]) -> int:
+        """
+        Feedback stage: update the feedback with a prediction and log it. Used by the online render loop and
+        by the replay loop, so both handle the decisions the same way.
+        :param feedback: feedback visualization for the subject
+        :param stim: current stim
+        :param prediction: the predicted label
+        :param probabilities: the classes probabilities of the prediction, or None
+        :param data_time: `time.perf_counter()` when the data of the prediction was acquired
+        :param num_tries: number of wrong predictions in a row before this one
+        :param target_predictions: the target-prediction pairs of the trial, the prediction is appended
+        :return: number of wrong predictions in a row, including this one
+        """
+        # if successful, reset num_tries to 0
+        num_tries = 0 if prediction == stim else num_tries + 1
 
-            # Update the feedback according the prediction
+        # Update the feedback according the prediction
+        with self.timer.stage('feedback'):
             feedback.update(prediction, skip=(num_tries >= self.skip_after))
-            # feedback.update(stim)  # For debugging purposes
+        latency = self.timer.record('decision', time.perf_counter() - data_time)
+        self.results_log.log(len(self.results), stim, prediction, latency, probabilities)
+        target_predictions.append((int(stim), int(prediction)))
+
+        print(f'Predict: {self.label_dict[prediction]}; '
+              f'True: {self.label_dict[stim]}; '
+              f'Latency: {latency * 1000:.1f} ms')
+
+        return num_tries
+
+    def _period(self) -> float:
+        """The time in seconds between two buffers"""
+        return self.buffer_time if self.hop_time is None else self.hop_time
+
+    def _acquire(self, timer) -> Optional[Tuple[NDArray, Optional[NDArray], int]]:
+        """
+        Acquisition stage: collect the EEG data since the last buffer and reset the timer.
+        :param timer: the clock of the buffers
+        :return: the data (n_channels, n_samples), the streaming-filtered data (or None) and the ring buffer
+                 position, or None while the first sliding window is not full
+        """
+        timer.reset()
+
+        if self.hop_time is None:
+
+            # Extract features from the EEG data
+            with self.timer.stage('get_data'):
+                data = self.eeg.get_channels_data()
+
+            # the filter bank keeps its state between buffers, so only the new samples are filtered
+            filtered = None
+            if self.stream_filter:
+                with self.timer.stage('stream_filter'):
+                    filtered = self.eeg.filter_channels_data(data)[0]
+
+            return data, filtered, 0
+
+        # Move the new samples to the ring buffer
+        with self.timer.stage('get_data'):
+            self.eeg.update_ring_buffer()
+
+        # Wait for a full window
+        if len(self.eeg.ring_buffer) < int(round(self.buffer_time * self.eeg.sfreq)):
+            return None
+
+        data = self.eeg.get_window(self.buffer_time)
+        filtered = self.eeg.get_window(self.buffer_time, filtered=True)[0] if self.stream_filter else None
+
+        return data, filtered, self.eeg.ring_buffer.n_written
 
-            # Update the model using partial-fit with the new EEG data
-            # self.model.partial_fit([x], [stim])  # todo: implement this with csp_lda
+    def _decide(self, data: NDArray, filtered: Optional[NDArray], stim: int) -> Tuple[int, Optional[NDArray]]:
+        """
+        Decoding stage: predict the class of a buffer.
+        :param data: the raw data (n_channels, n_samples)
+        :param filtered: the streaming-filtered data, or None
+        :param stim: the current stim
+        :return: the prediction and the classes probabilities (None in debug mode)
+        """
+        probabilities = None
+        if self.debug:
+            # in debug mode, be correct 2/3 of the time and incorrect 1/3 of the time.
+            prediction = stim if np.random.rand() <= 2 / 3 else (stim + 1) % len(self.labels_enum)
+        elif filtered is not None:
+            prediction, probabilities = self.model.online_predict_proba(filtered, eeg=self.eeg, filtered=True)
+        else:
+            # in normal mode, use the loaded model to make a prediction
+            prediction, probabilities = self.model.online_predict_proba(data, eeg=self.eeg)
+
+        # play sound if successful (in the background)
+        if self.audio_service is not None:
+            if prediction == stim:
+                with self.timer.stage('playsound'):
+                    self.audio_service.play('success')
+
+        return prediction, probabilities
+
+    def _learn(self, trials: List[NDArray], labels: List[int]):
+        """
+        Co-learning stage: update the model with buffers and checkpoint it.
+        :param trials: the raw data of the buffers, ndarrays with the shape (n_channels, n_samples)
+        :param labels: the stim of each buffer
+        :return:
+        """
+        with self.timer.stage('partial_fit'):
+            self.model.partial_fit_batch(self.eeg, trials, labels)
+
+        # The trials are logged and the classifier is saved in the background (latest-wins)
+        with self.timer.stage('checkpoint'):
+            for data, stim in zip(trials, labels):
+                self.checkpointer.log_trial(data, stim)
+            self.checkpointer.save(self.model)
+
+    def _save_results(self, target_predictions: List[Tuple[int, int]]):
 
-            # Debug
-            print(f'Predict: {self.label_dict[prediction]}; '
-                  f'True: {self.label_dict[stim]}')
         accuracy = sum([1 if p[1] == p[0] else 0 for p in target_predictions]) / len(target_predictions)
         print(f'Accuracy of last target: {accuracy}')
         self.results.append(target_predictions)
 
-        # Save Results
-        json.dump(self.results, open(os.path.join(self.session_directory, 'results.json'), "w"))
+        # The predictions are already in the results log, make sure they are on the disk
+        self.results_log.end_trial()
+        self.timer.save(self.session_directory)
 
-    def online_pipe(self, data: NDArray) -> NDArray:
+    def _close_results(self):
+
+        # Write results.json from the results log, for the reports
+        self.results_log.close()
+        write_results(self.session_directory)
+
+    def _clock(self):
+        """The clock of the learning loop (the replay uses a virtual clock)"""
+        from psychopy import core
+
+        return core.Clock()
+
+    def _wait(self, seconds: float):
+        """Wait for the board to collect `seconds` of new data (the replay advances the board instead)"""
+        time.sleep(seconds)
+
+    def online_pipe(self, data: NDArray, filtered: bool = False) -> NDArray:
         """
         The method get the data as ndarray with dimensions of (n_channels, n_samples).
         The method returns the features for the given data.
         :param data: ndarray with the shape (n_channels, n_samples)
+        :param filtered: whether the data was already band-passed (e.g. by the EEG streaming filter bank)
         :return: ndarray with the shape of (1, n_features)
         """
         # Prepare the data to MNE functions
         data = data.astype(np.float64)
 
-        # Filter the data (band-pass only)
-        data = mne.filter.filter_data(data, l_freq=8, h_freq=30, sfreq=self.eeg.sfreq, verbose=False)
+        # Filter the data (band-pass only, the same filter as `mne.filter.filter_data`)
+        if not filtered:
+            data = band_pass(data, self.eeg.sfreq, 8, 30)
 
-        # Laplacian
-        data = self.eeg.laplacian(data, self.eeg.get_board_names())
+        # Laplacian (the filter matrix is built once by the EEG)
+        data = self.eeg.get_spatial_filter('motor_laplacian').apply(data)
 
-        # Normalize
-        scaler = StandardScaler()
-        data = scaler.fit_transform(data.T).T
+        # Normalize each channel
+        data = (data - data.mean(axis=1, keepdims=True)) / data.std(axis=1, keepdims=True)
 
         # Extract features
-        funcs_params = {'pow_freq_bands__freq_bands': np.array([8, 10, 12.5, 30])}
-        selected_funcs = ['pow_freq_bands', 'variance']
-        X = extract_features(data[np.newaxis], self.eeg.sfreq, selected_funcs, funcs_params)[0]
+        extractor = FeatureExtractor(self.eeg.sfreq, ['pow_freq_bands', 'variance'], [8, 10, 12.5, 30])
+        X = extractor.transform(data[np.newaxis])[0]
 
         return X
 
+    def _metadata_parameters(self) -> Dict[str, Any]:
+        return {'buffer_time': self.buffer_time, 'threshold': self.threshold, 'co_learning': self.co_learning,
+                'stream_filter': self.stream_filter, 'hop_time': self.hop_time}
+
     def run(self, use_eeg: bool = True, full_screen: bool = False):
 
+        # psychopy is imported here, so the headless replay (a subclass) does not load it
+        from psychopy import visual, core
+
         # Init the current experiment folder
         self.subject_directory = self._ask_subject_directory()
         self.session_directory = self.create_session_folder(self.subject_directory)
@@ -182,6 +322,9 @@ class OnlineExperiment(Experiment):
         # Create experiment's metadata
         self.write_metadata()
 
+        # The session is in the catalog from its start, so a crashed session is also listed
+        self.update_catalog()
+
         # Init experiments configurations
         self.win = visual.Window(monitor='testMonitor', fullscr=full_screen)
 
@@ -189,34 +332,86 @@ class OnlineExperiment(Experiment):
         if use_eeg:
             self.eeg.on()
 
-        # For each stim in the trials list
-        for stim in self.labels:
+        # Causal band-pass which keeps its state between the buffers
+        if self.stream_filter:
+            self.eeg.init_filter_bank(bands=[(8., 30.)])
+
+        # Ring buffer for the sliding windows
+        if self.hop_time is not None:
+            self.eeg.init_ring_buffer(self.buffer_time)
+
+        if self.co_learning:
+            self.checkpointer = ModelCheckpointer(self.session_directory)
+
+        if self.play_sound:
+            self.audio_service = AudioService(['success'])
+
+        self.results_log = ResultsLog(self.session_directory)
+
+        # Acquisition & decoding run in the background for the whole session
+        pipeline = DecodingPipeline(self)
+        pipeline.start()
+
+        # The pipeline is stopped also on escape, or if one of its stages failed
+        try:
+            # For each stim in the trials list
+            for stim in self.labels:
 
-            # Init feedback instance
-            feedback = Feedback(self.win, stim, self.buffer_time, self.threshold)
+                # Init feedback instance
+                feedback = Feedback(self.win, stim, self.buffer_time, self.threshold)
+                target_predictions = []
+                num_tries = 0
 
-            # Use different thread for online learning of the model
-            threading.Thread(target=self._learning_model,
-                             args=(feedback, stim), daemon=True).start()
+                pipeline.begin_trial(stim)
 
-            # Maintain visual feedback on screen
-            timer = core.Clock()
+                # Maintain visual feedback on screen
+                timer = core.Clock()
 
-            while not feedback.stop:
+                while not feedback.stop:
 
-                feedback.display(current_time=timer.getTime())
+                    # Update the feedback according the new predictions
+                    # (the replay loop also stops at the first decision which ends the trial)
+                    for decision in pipeline.get_decisions():
 
-                # Reset the timer according the buffer time attribute
-                if timer.getTime() > self.buffer_time:
-                    timer.reset()
+                        num_tries = self._apply_decision(feedback, stim, decision.prediction,
+                                                         decision.probabilities, decision.time, num_tries,
+                                                         target_predictions)
+                        if feedback.stop:
+                            break
 
-                # Halt if escape was pressed
-                if 'escape' == self.get_keypress():
-                    sys.exit(-1)
+                    feedback.display(current_time=timer.getTime())
 
-            # Waiting for key-press between trials
-            self._wait_between_trials(feedback, self.eeg, use_eeg)
+                    # Reset the timer according the buffer time attribute
+                    if timer.getTime() > self.buffer_time:
+                        timer.reset()
+
+                    # Halt if escape was pressed
+                    if 'escape' == self.get_keypress():
+                        sys.exit(-1)
+
+                pipeline.end_trial()
+                self._save_results(target_predictions)
+
+                # Waiting for key-press between trials
+                self._wait_between_trials(feedback, self.eeg, use_eeg)
+
+        finally:
+            # Wait for the refits in progress
+            pipeline.stop()
 
         # turn off EEG streaming
         if use_eeg:
             self.eeg.off()
+
+        # Write the last checkpoint and the model of the session
+        if self.checkpointer is not None:
+            self.checkpointer.close(self.model)
+
+        # Save when the sounds were played
+        if self.audio_service is not None:
+            self.audio_service.close()
+            self.audio_service.save(self.session_directory)
+
+        self._close_results()
+        self.update_catalog()
+        self.timer.print_summary()
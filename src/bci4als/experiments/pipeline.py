@@ -0,0 +1,247 @@
+import queue
+import threading
+import time
+import traceback
+from collections import namedtuple
+from typing import List, Optional
+
+from nptyping import NDArray
+
+# A buffer of the acquisition stage (`trial` is the id of the trial it belongs to)
+Window = namedtuple('Window', ['trial', 'stim', 'data', 'filtered', 'position', 'time'])
+
+# A prediction of the decoding stage, `time` is the acquisition time of its window
+Decision = namedtuple('Decision', ['trial', 'stim', 'prediction', 'probabilities', 'time'])
+
+
+class DecodingPipeline:
+    """
+    Persistent decoding pipeline of the online experiment, which runs for the whole session.
+
+    The pipeline has three stages, the acquisition & decoding are joined by bounded queues:
+        1. Acquisition thread: collects a buffer from the EEG every `buffer_time` (or `hop_time`) seconds.
+        2. Decoding thread: predicts each buffer and hands the co-learning trials to the refit thread.
+        3. Feedback: the psychopy render loop (main thread) takes the decisions with `get_decisions`, so the
+           feedback object is only touched by the thread which draws it.
+
+    When a queue is full the oldest item is dropped, so a slow stage never makes the others wait for it.
+    The refits (`MLModel.partial_fit_batch` and the checkpoint) run in a refit thread, one after the other in
+    the order of the trials (each update starts from the previous model), while the decoding thread keeps
+    predicting with the last complete model. The co-learning trials are not dropped: the trials which arrive
+    during a refit are coalesced into the next one, so when the refits are slower than the decisions the
+    backlog is a single batched update (and `stop` waits for at most one refit after the current one).
+    If the acquisition or the decoding stage fails, the error is printed and `get_decisions` raises it, so the
+    render loop does not wait for decisions which will never come.
+
+    Attributes
+    ----------
+    experiment : OnlineExperiment
+        the experiment, which implements the stages (`_period`, `_acquire`, `_decide` & `_learn`)
+    error : Exception
+        the error of a failed stage, or None
+    n_dropped : dict
+        the amount of dropped windows & decisions
+    n_refits : int
+        number of model updates
+    n_coalesced : int
+        number of co-learning trials which waited for a refit and were added in a batched update
+    """
+
+    def __init__(self, experiment, max_windows: int = 2, max_decisions: int = 8):
+
+        self.experiment = experiment
+        self.error: Optional[Exception] = None
+        self.n_dropped = {'windows': 0, 'decisions': 0}
+        self.n_refits: int = 0
+        self.n_coalesced: int = 0
+
+        # Queues between the stages
+        self._windows: queue.Queue = queue.Queue(maxsize=max_windows)
+        self._decisions: queue.Queue = queue.Queue(maxsize=max_decisions)
+
+        # The current trial, it is acquired only while `_active` is set
+        self._trial: int = 0
+        self._stim: Optional[int] = None
+        self._active = threading.Event()
+        self._shutdown = threading.Event()
+        self._board_lock = threading.Lock()
+
+        # Co-learning trials waiting for the refit thread (None stops it). Not bounded, so no trial is lost:
+        # the refit thread takes all the waiting trials in one update
+        self._pending: queue.Queue = queue.Queue()
+
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        """Start the acquisition, decoding & refit threads"""
+        self._threads = [threading.Thread(target=self._stage, args=(self._acquisition,), name='acquisition',
+                                          daemon=True),
+                         threading.Thread(target=self._stage, args=(self._decoding,), name='decoding',
+                                          daemon=True),
+                         threading.Thread(target=self._refits, name='refit', daemon=True)]
+
+        for thread in self._threads:
+            thread.start()
+
+    def begin_trial(self, stim: int):
+        """
+        Start acquiring buffers for a new trial.
+        :param stim: the stim of the trial
+        :return:
+        """
+        self._trial += 1
+        self._stim = stim
+        self._active.set()
+
+    def end_trial(self):
+        """
+        Stop acquiring buffers. Once it returns the board is not read until the next trial, and the pending
+        windows & decisions of the trial are discarded.
+        """
+        self._active.clear()
+        self._trial += 1
+
+        # Wait for a read of the board in progress
+        with self._board_lock:
+            pass
+
+    def get_decisions(self) -> List[Decision]:
+        """
+        Take the decisions of the current trial without waiting (called by the render loop).
+        :return: list of the new decisions
+        """
+        if self.error is not None:
+            raise RuntimeError('A stage of the decoding pipeline failed') from self.error
+
+        decisions = []
+
+        while True:
+            try:
+                decision = self._decisions.get_nowait()
+            except queue.Empty:
+                return decisions
+
+            if decision.trial == self._trial:
+                decisions.append(decision)
+
+    def stop(self):
+        """Stop the threads and wait for the pending refits"""
+        self._active.clear()
+        self._shutdown.set()
+        self._pending.put(None)
+
+        for thread in self._threads:
+            thread.join()
+
+        if sum(self.n_dropped.values()) > 0:
+            print(f'Dropped {self.n_dropped["windows"]} windows & {self.n_dropped["decisions"]} decisions '
+                  f'of slow stages')
+        if self.n_coalesced > 0:
+            print(f'{self.n_coalesced} co-learning trials waited for a slow refit ({self.n_refits} refits)')
+
+    def _acquisition(self):
+
+        while not self._shutdown.is_set():
+
+            if not self._active.wait(timeout=0.1):
+                continue
+
+            trial, stim = self._trial, self._stim
+            clock = self.experiment._clock()
+
+            while self._active.is_set() and trial == self._trial:
+
+                # Sleep until the next buffer (wakes up on shutdown)
+                if self._shutdown.wait(max(0, self.experiment._period() - clock.getTime())):
+                    return
+
+                with self._board_lock:
+
+                    if not self._active.is_set() or trial != self._trial:
+                        break
+
+                    acquired = self.experiment._acquire(clock)
+
+                if acquired is not None:
+                    data, filtered, position = acquired
+                    self._put(self._windows, Window(trial, stim, data, filtered, position, time.perf_counter()),
+                              'windows')
+
+    def _decoding(self):
+
+        n_window = int(round(self.experiment.buffer_time * self.experiment.eeg.sfreq))
+        last_fit = (None, 0)  # trial & ring buffer position of the last co-learning trial
+
+        while not self._shutdown.is_set():
+
+            try:
+                window = self._windows.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            if window.trial != self._trial:
+                continue
+
+            prediction, probabilities = self.experiment._decide(window.data, window.filtered, window.stim)
+            self._put(self._decisions, Decision(window.trial, window.stim, prediction, probabilities, window.time),
+                      'decisions')
+
+            # In sliding-window mode, learn only from non-overlapping windows
+            if self.experiment.co_learning and (self.experiment.hop_time is None or last_fit[0] != window.trial
+                                                or window.position - last_fit[1] >= n_window):
+                self._submit_refit(window.data, window.stim)
+                last_fit = (window.trial, window.position)
+
+    def _submit_refit(self, data: NDArray, stim: int):
+        self._pending.put((data, stim))
+
+    def _refits(self):
+
+        # The refits are applied one after the other, in the order of the trials
+        while True:
+
+            batch = [self._pending.get()]
+
+            # The trials which arrived during the last refit go in one update
+            while batch[-1] is not None:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is None
+            items = [item for item in batch if item is not None]
+
+            if items:
+                self.n_refits += 1
+                self.n_coalesced += len(items) - 1
+                try:
+                    self.experiment._learn([data for data, _ in items], [stim for _, stim in items])
+                except Exception:
+                    # A failed update keeps the last model, the session goes on
+                    traceback.print_exc()
+
+            if stop:
+                return
+
+    def _stage(self, target):
+
+        try:
+            target()
+        except Exception as error:
+            traceback.print_exc()
+            self.error = error
+
+    def _put(self, q: queue.Queue, item, name: str):
+
+        # Drop the oldest item of a full queue, so the producer never waits
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                    self.n_dropped[name] += 1
+                except queue.Empty:
+                    pass
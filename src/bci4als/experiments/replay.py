@@ -0,0 +1,284 @@
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from bci4als.checkpoint import ModelCheckpointer
+from bci4als.dataset import load_session
+from bci4als.eeg import EEG
+from bci4als.experiments.feedback import Feedback
+from bci4als.experiments.online import OnlineExperiment
+from bci4als.ml_model import MLModel
+from bci4als.recording import RAW_INDEX_FILE, RawRecording
+from bci4als.results import ResultsLog
+from brainflow import BoardShim
+from nptyping import NDArray
+
+
+class ReplayBoard:
+    """
+    A stand-in for `BoardShim` which streams recorded board data.
+
+    The board has a virtual clock: samples become available only when the clock is advanced (`advance`),
+    so the online loop runs as fast as the decoder allows and no real time passes while waiting.
+    The board description methods (sampling rate, channels rows etc.) are taken from `BoardShim`.
+
+    Attributes
+    ----------
+    data : NDArray
+        the recorded board data with the shape (n_rows, n_samples)
+    board_id : int
+        id of the board which recorded the data
+    position : int
+        the number of samples acquired so far
+    """
+
+    def __init__(self, data: NDArray, board_id: int):
+
+        self.data: NDArray = data
+        self.board_id: int = board_id
+        self.sfreq: int = BoardShim.get_sampling_rate(board_id)
+        self.position: int = 0
+        self._read_position: int = 0
+        self._start: int = 0
+        self._stop: int = data.shape[1]
+        self._time: float = 0.
+
+    def __getattr__(self, name: str):
+        # Board description methods (e.g. `get_eeg_channels`) are static in BoardShim
+        return getattr(BoardShim, name)
+
+    def prepare_session(self):
+        pass
+
+    def start_stream(self):
+        pass
+
+    def stop_stream(self):
+        pass
+
+    def release_session(self):
+        pass
+
+    def insert_marker(self, marker: float):
+        # The recorded data already has its markers
+        pass
+
+    @property
+    def time(self) -> float:
+        """The virtual time in seconds since the current segment started"""
+        return self._time
+
+    @property
+    def remaining(self) -> int:
+        """The number of samples left in the current segment"""
+        return self._stop - self.position
+
+    def play(self, start: int, stop: int):
+        """
+        Stream the given segment of the data (e.g. a single trial) from its start.
+        :param start: first sample of the segment
+        :param stop: the sample after the end of the segment
+        :return:
+        """
+        self._start, self._stop = start, stop
+        self.position = self._read_position = start
+        self._time = 0.
+
+    def advance(self, seconds: float):
+        """Advance the virtual clock, which makes the samples of these `seconds` available"""
+        self._time += seconds
+        self.position = min(self._start + int(round(self._time * self.sfreq)), self._stop)
+
+    def get_board_data_count(self) -> int:
+        return self.position - self._read_position
+
+    def get_board_data(self) -> NDArray:
+        """Return the samples acquired since the last call and remove them (like `BoardShim.get_board_data`)"""
+        data = np.array(self.data[:, self._read_position:self.position])
+        self._read_position = self.position
+
+        return data
+
+
+class VirtualClock:
+    """A clock (with the psychopy `core.Clock` interface) which reads the virtual time of a replay board"""
+
+    def __init__(self, board: ReplayBoard):
+        self.board: ReplayBoard = board
+        self._start: float = board.time
+
+    def getTime(self) -> float:
+        return self.board.time - self._start
+
+    def reset(self):
+        self._start = self.board.time
+
+
+class ReplayFeedback:
+    """
+    Headless feedback for the replay. It follows the progress like `Feedback` and also stops when the
+    recorded trial does not have enough samples for another decision.
+    """
+
+    update = Feedback.update
+
+    def __init__(self, stim: int, threshold: int, board: ReplayBoard, n_step: int):
+
+        self.stim: int = stim
+        self.threshold: int = threshold
+        self.confident: bool = False
+        self.progress: float = 0
+        self.board: ReplayBoard = board
+        self.n_step: int = n_step
+        self._stop: bool = False
+
+    @property
+    def stop(self) -> bool:
+        return self._stop or self.board.remaining < self.n_step
+
+    @stop.setter
+    def stop(self, value: bool):
+        self._stop = value
+
+
+def load_replay(session_directory: str, eeg: EEG) -> Tuple[NDArray, NDArray, List[int]]:
+    """
+    Load a recorded session as board data.
+    Sessions recorded with the raw stream are replayed as is (including the samples between the trials).
+    Older sessions which saved only the trials are concatenated into board data with the EEG channels in
+    their board rows.
+    :param session_directory: the recorded session folder
+    :param eeg: the EEG object of the replay
+    :return: the board data (n_rows, n_samples), the (start, stop) samples of each trial and the labels
+    """
+    if os.path.isfile(os.path.join(session_directory, RAW_INDEX_FILE)):
+
+        recording = RawRecording(session_directory)
+        durations, labels = eeg.pair_markers(recording.markers_idx, recording.markers_value,
+                                             recording.data.shape[1])
+
+        return recording.data, durations, labels
+
+    session = load_session(session_directory)
+    if session is None:
+        raise ValueError(f'No trials were found in {session_directory}')
+
+    # Put each channel in its board row
+    ch_idx = [session.ch_names.index(ch) for ch in eeg.get_board_names()]
+    offsets = np.concatenate([[0], np.cumsum([t.shape[1] for t in session.trials])])
+    data = np.zeros((BoardShim.get_num_rows(eeg.board_id), offsets[-1]))
+    data[eeg.get_board_channels()] = np.concatenate([t[ch_idx] for t in session.trials], axis=1)
+
+    return data, np.stack([offsets[:-1], offsets[1:]], axis=1), list(session.labels)
+
+
+class ReplayExperiment(OnlineExperiment):
+    """
+    Replay a recorded session through the online learning loop, without hardware or a display.
+
+    Each recorded trial is streamed by a `ReplayBoard` through the EEG data interface, and the stim of the
+    loop is the recorded label. The loop (`OnlineExperiment._learning_model`) runs the stages of the online
+    pipeline one after the other, so the buffering, filtering, prediction, co-learning and the `results.json`
+    are the same, and the replay is deterministic.
+
+    Attributes:
+
+        recording_directory (str):
+            The recorded session which is replayed.
+
+        speed (float):
+            None to replay as fast as possible, 1 for real-time speed, 2 for twice the real-time speed etc.
+
+        durations (NDArray):
+            The (start, stop) samples of each recorded trial.
+
+    """
+
+    def __init__(self, eeg: EEG, model: MLModel, recording_directory: str, session_directory: str,
+                 buffer_time: float, threshold: int, skip_after: Union[bool, int] = False,
+                 co_learning: bool = False, stream_filter: bool = False, hop_time: Optional[float] = None,
+                 speed: Optional[float] = None):
+
+        data, self.durations, labels = load_replay(recording_directory, eeg)
+        eeg.board = ReplayBoard(data, eeg.board_id)
+
+        super().__init__(eeg, model, len(labels), buffer_time, threshold, skip_after, co_learning,
+                         debug=False, stream_filter=stream_filter, hop_time=hop_time)
+
+        self.experiment_type = "Replay"
+        self.recording_directory: str = recording_directory
+        self.session_directory: str = session_directory
+        self.speed: Optional[float] = speed
+        self.labels: List[int] = labels
+        self.play_sound = False
+
+    def _metadata_parameters(self) -> Dict[str, Any]:
+        return dict(super()._metadata_parameters(), recording_directory=self.recording_directory, speed=self.speed)
+
+    def _clock(self):
+        return VirtualClock(self.eeg.board)
+
+    def _wait(self, seconds: float):
+        self.eeg.board.advance(seconds)
+
+        if self.speed is not None:
+            time.sleep(seconds / self.speed)
+
+    def run(self, use_eeg: bool = True, full_screen: bool = False) -> List[List[Tuple[int, int]]]:
+        """
+        Replay all the recorded trials.
+        :return: the target-prediction pairs of each trial (the content of `results.json`)
+        """
+        os.makedirs(self.session_directory, exist_ok=True)
+        self.write_metadata()
+
+        # Causal band-pass which keeps its state between the buffers
+        if self.stream_filter:
+            self.eeg.init_filter_bank(bands=[(8., 30.)])
+
+        # Ring buffer for the sliding windows
+        if self.hop_time is not None:
+            self.eeg.init_ring_buffer(self.buffer_time)
+
+        if self.co_learning:
+            self.checkpointer = ModelCheckpointer(self.session_directory)
+
+        self.results_log = ResultsLog(self.session_directory)
+
+        n_window = int(round(self.buffer_time * self.eeg.sfreq))
+        n_step = n_window if self.hop_time is None else int(round(self.hop_time * self.eeg.sfreq))
+        start_time = time.perf_counter()
+        n_replayed = 0
+
+        for (start, stop), stim in zip(self.durations, self.labels):
+
+            if stop - start < n_window:
+                print(f'Skip the trial at sample {start}, it is shorter than the buffer')
+                continue
+
+            n_replayed += stop - start
+
+            # Stream the trial from its start, like a new trial online
+            self.eeg.board.play(start, stop)
+            self.eeg.clear_board()
+
+            self._learning_model(ReplayFeedback(stim, self.threshold, self.eeg.board, n_step), stim)
+
+        # Write the last checkpoint and the model of the session
+        if self.checkpointer is not None:
+            self.checkpointer.close(self.model)
+
+        self._close_results()
+
+        # Summary
+        duration = time.perf_counter() - start_time
+        pairs = [pair for trial in self.results for pair in trial]
+        replayed = n_replayed / self.eeg.sfreq
+        if len(pairs) > 0:
+            accuracy = np.mean([target == prediction for target, prediction in pairs])
+            print(f'Replayed {replayed:.1f} seconds in {duration:.2f} seconds: {len(pairs)} decisions '
+                  f'({len(pairs) / duration:.1f} per second), accuracy {accuracy:.3f}')
+            self.timer.print_summary()
+
+        return self.results
@@ -0,0 +1,184 @@
+from functools import lru_cache
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+from nptyping import NDArray
+from scipy.signal import get_window
+
+
+@lru_cache(maxsize=None)
+def welch_plan(sfreq: float, n_times: int, n_fft: int = 256) -> Tuple[int, NDArray, float, NDArray]:
+    """
+    Build (once per window length) the Welch parameters of `mne_features.utils.power_spectrum`:
+    non-overlapping Hamming segments of min(n_times, n_fft) samples.
+    :param sfreq: sampling rate of the data
+    :param n_times: number of samples of the windows
+    :param n_fft: the maximal segment length
+    :return: the segment length, the Hamming window, the density scale and the frequencies
+    """
+    n_fft = min(n_times, n_fft)
+    window = get_window('hamming', n_fft)
+    scale = 1 / (sfreq * np.sum(window ** 2))
+    freqs = np.fft.rfftfreq(n_fft, 1 / sfreq)
+
+    return n_fft, window, scale, freqs
+
+
+def welch_psd(X: NDArray, sfreq: float, n_fft: int = 256) -> Tuple[NDArray, NDArray]:
+    """
+    One-sided power spectral density by Welch's method, equivalent to `mne.time_frequency.psd_array_welch`
+    with the defaults of mne_features. All the windows & channels go in one FFT call.
+    :param X: ndarray with the shape (..., n_times)
+    :param sfreq: sampling rate of the data
+    :param n_fft: the maximal segment length
+    :return: the psd with the shape (..., n_freqs) and the frequencies
+    """
+    n_fft, window, scale, freqs = welch_plan(sfreq, X.shape[-1], n_fft)
+
+    # Split to segments, remove the mean of each segment and apply the window
+    n_segments = X.shape[-1] // n_fft
+    segments = X[..., :n_segments * n_fft].reshape(X.shape[:-1] + (n_segments, n_fft))
+    segments = (segments - segments.mean(axis=-1, keepdims=True)) * window
+
+    psd = np.abs(np.fft.rfft(segments, axis=-1)) ** 2 * scale
+
+    # One-sided spectrum: double all the frequencies except DC (and Nyquist)
+    psd[..., 1:n_fft - n_fft // 2] *= 2
+
+    return psd.mean(axis=-2), freqs
+
+
+def freq_bands_edges(sfreq: float, freq_bands: NDArray) -> NDArray:
+    """
+    :param sfreq: sampling rate of the data
+    :param freq_bands: the bands edges (n_bands + 1,) or the bands (n_bands, 2)
+    :return: the bands with the shape (n_bands, 2)
+    """
+    freq_bands = np.asarray(freq_bands, dtype=np.float64)
+
+    if not np.logical_and(freq_bands >= 0, freq_bands <= sfreq / 2).all():
+        raise ValueError(f'The frequency bands {freq_bands} must be between 0 and the Nyquist frequency')
+
+    if freq_bands.ndim == 1:
+        return np.stack([freq_bands[:-1], freq_bands[1:]], axis=1)
+
+    return freq_bands
+
+
+def pow_freq_bands(X: NDArray, sfreq: float, freq_bands: NDArray, normalize: bool = True) -> NDArray:
+    """
+    Power in frequency bands, like `mne_features` `pow_freq_bands`.
+    :param X: ndarray with the shape (n_windows, n_channels, n_times)
+    :param sfreq: sampling rate of the data
+    :param freq_bands: the bands edges (n_bands + 1,) or the bands (n_bands, 2)
+    :param normalize: divide the power in each band by the total power
+    :return: ndarray with the shape (n_windows, n_channels * n_bands)
+    """
+    psd, freqs = welch_psd(X, sfreq)
+    bands = freq_bands_edges(sfreq, freq_bands)
+
+    # Sum the (inclusive) bins of all the bands with one matmul
+    masks = np.logical_and(freqs >= bands[:, :1], freqs <= bands[:, 1:]).astype(np.float64)
+    power = psd @ masks.T
+
+    if normalize:
+        power /= psd.sum(axis=-1, keepdims=True)
+
+    return power.reshape(len(X), -1)
+
+
+def variance(X: NDArray) -> NDArray:
+    """
+    :param X: ndarray with the shape (n_windows, n_channels, n_times)
+    :return: the (unbiased) variance of each channel with the shape (n_windows, n_channels)
+    """
+    return np.var(X, axis=-1, ddof=1)
+
+
+def log_variance(X: NDArray) -> NDArray:
+    """
+    :param X: ndarray with the shape (n_windows, n_channels, n_times)
+    :return: the log of the variance of each channel with the shape (n_windows, n_channels)
+    """
+    return np.log(variance(X))
+
+
+def hjorth_mobility(X: NDArray) -> NDArray:
+    """
+    Hjorth mobility, like `mne_features` `hjorth_mobility` (the signal is prepended with a zero).
+    :param X: ndarray with the shape (n_windows, n_channels, n_times)
+    :return: ndarray with the shape (n_windows, n_channels)
+    """
+    x = np.concatenate([np.zeros(X.shape[:-1] + (1,)), X], axis=-1)
+
+    return np.std(np.diff(x, axis=-1), axis=-1, ddof=1) / np.std(x, axis=-1, ddof=1)
+
+
+def hjorth_complexity(X: NDArray) -> NDArray:
+    """
+    Hjorth complexity, like `mne_features` `hjorth_complexity`.
+    :param X: ndarray with the shape (n_windows, n_channels, n_times)
+    :return: ndarray with the shape (n_windows, n_channels)
+    """
+    dx = np.diff(np.concatenate([np.zeros(X.shape[:-1] + (1,)), X], axis=-1), axis=-1)
+
+    return hjorth_mobility(dx) / hjorth_mobility(X)
+
+
+# The features by their mne_features name (log_variance is not part of mne_features)
+FEATURES: Dict[str, Callable[..., NDArray]] = {
+    'pow_freq_bands': pow_freq_bands,
+    'variance': variance,
+    'log_variance': log_variance,
+    'hjorth_mobility': hjorth_mobility,
+    'hjorth_complexity': hjorth_complexity,
+}
+
+
+class FeatureExtractor:
+    """
+    Batched replacement of `mne_features.feature_extraction.extract_features` for the features in `FEATURES`.
+
+    All the windows are computed in vectorized calls (one FFT for the band power of all the windows and
+    channels) and the Welch parameters are built once per window length. The features are ordered like
+    mne_features: by the selected functions, and channel-major within each function.
+
+    Attributes
+    ----------
+    sfreq : float
+        the sampling rate of the data
+    selected_funcs : list
+        the names of the features
+    freq_bands : NDArray
+        the bands of `pow_freq_bands`
+    """
+
+    def __init__(self, sfreq: float, selected_funcs: Sequence[str] = ('pow_freq_bands', 'variance'),
+                 freq_bands: Sequence[float] = (8, 10, 12.5, 30)):
+
+        unknown = [f for f in selected_funcs if f not in FEATURES]
+        if unknown:
+            raise ValueError(f'Unknown features {unknown}, use one of {sorted(FEATURES)}')
+
+        self.sfreq: float = sfreq
+        self.selected_funcs: List[str] = list(selected_funcs)
+        self.freq_bands: NDArray = np.asarray(freq_bands, dtype=np.float64)
+
+        # Check the bands once
+        freq_bands_edges(sfreq, self.freq_bands)
+
+    def transform(self, X: NDArray) -> NDArray:
+        """
+        :param X: ndarray with the shape (n_windows, n_channels, n_times)
+        :return: the features with the shape (n_windows, n_features)
+        """
+        X = np.asarray(X, dtype=np.float64)
+        features = []
+
+        for name in self.selected_funcs:
+            if name == 'pow_freq_bands':
+                features.append(pow_freq_bands(X, self.sfreq, self.freq_bands))
+            else:
+                features.append(FEATURES[name](X))
+
+        return np.concatenate(features, axis=1)
@@ -0,0 +1,280 @@
+from typing import List, Optional
+
+import numpy as np
+from nptyping import NDArray
+from scipy.linalg import eigh
+
+
+class IncrementalCSPLDA:
+    """
+    CSP + LDA classifier which can be updated one trial at a time.
+
+    Instead of keeping the raw trials and refitting from scratch, the estimator keeps:
+        1. Running per-class sums for the channels covariance (sample count and sum of outer products).
+        2. The (uncentered) spatial covariance of every trial, a small (n_channels, n_channels) matrix, used for
+           re-computing the log-variance features once the CSP filters change.
+
+    Adding a trial costs O(n_channels^2 * n_samples) for its covariance, and refreshing the model costs one
+    eigen-decomposition of the class covariances plus a single einsum over the stored trial covariances.
+    No raw data from previous trials is touched, so the update time does not grow with the trials history.
+
+    The estimator mimics `mne.decoding.CSP(n_components, reg=None, log=True, norm_trace=False)` followed by
+    `sklearn.discriminant_analysis.LinearDiscriminantAnalysis()`. Given the same trials, the predictions are
+    identical to a full refit, the CSP features agree up to a relative tolerance of 1e-6 and so do the decision
+    values (up to an offset which is shared by all the classes and does not change the prediction).
+
+    Attributes
+    ----------
+    n_components : int
+        number of CSP components used as features
+    classes_ : NDArray
+        the sorted labels seen so far
+    filters_ : NDArray
+        the CSP filters, shape (n_components, n_channels)
+    coef_ : NDArray
+        the LDA coefficients, shape (n_classes, n_components)
+    intercept_ : NDArray
+        the LDA intercepts, shape (n_classes,)
+    """
+
+    def __init__(self, n_components: int = 6):
+
+        self.n_components: int = n_components
+        self.classes_: NDArray = np.array([], dtype=int)
+        self.filters_: Optional[NDArray] = None
+        self.coef_: Optional[NDArray] = None
+        self.intercept_: Optional[NDArray] = None
+
+        # Per-class sufficient statistics for the CSP covariances
+        self._class_count = {}
+        self._class_outer = {}
+
+        # Per-trial covariances for the LDA features (stored in a growing buffer)
+        self._trial_covs: Optional[NDArray] = None
+        self._trial_labels: List[int] = []
+
+    @property
+    def n_trials(self) -> int:
+        return len(self._trial_labels)
+
+    def fit(self, X: NDArray, y: List[int]):
+        """
+        Forget all previous trials and fit the model on the given trials.
+        :param X: trials with shape (n_trials, n_channels, n_samples) or list of (n_channels, n_samples) trials
+        :param y: labels of the trials
+        :return: self
+        """
+        self.__init__(n_components=self.n_components)
+
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X: NDArray, y: List[int]):
+        """
+        Add the given trials to the sufficient statistics and refresh the CSP filters & LDA.
+        :param X: trials with shape (n_trials, n_channels, n_samples) or list of (n_channels, n_samples) trials
+        :param y: labels of the trials
+        :return: self
+        """
+        for trial, label in zip(X, y):
+            self._add_trial(np.asarray(trial, dtype=np.float64), int(label))
+
+        self._update_model()
+
+        return self
+
+    def _add_trial(self, trial: NDArray, label: int):
+        """
+        Update the class statistics with a single (n_channels, n_samples) trial.
+        """
+        n_channels, n_samples = trial.shape
+        outer = trial @ trial.T
+
+        if label not in self._class_count:
+            self._class_count[label] = 0
+            self._class_outer[label] = np.zeros((n_channels, n_channels))
+
+        self._class_count[label] += n_samples
+        self._class_outer[label] += outer
+
+        # Grow the trials covariances buffer by doubling its size
+        if self._trial_covs is None:
+            self._trial_covs = np.empty((16, n_channels, n_channels))
+        elif self.n_trials == len(self._trial_covs):
+            self._trial_covs = np.concatenate([self._trial_covs, np.empty_like(self._trial_covs)])
+
+        self._trial_covs[self.n_trials] = outer / n_samples
+        self._trial_labels.append(label)
+
+    def _class_covariances(self) -> NDArray:
+        """
+        Compute the covariance of each class as if all its trials were concatenated.
+        Like mne, the data is assumed to be centered (band-passed) and the covariance is unbiased.
+        :return: ndarray with shape (n_classes, n_channels, n_channels)
+        """
+        return np.stack([self._class_outer[label] / (self._class_count[label] - 1) for label in self.classes_])
+
+    def _update_model(self):
+        """
+        Re-compute the CSP filters from the class covariances and the LDA from the trials features.
+        """
+        self.classes_ = np.array(sorted(self._class_count))
+
+        # Nothing to discriminate yet
+        if len(self.classes_) < 2:
+            return
+
+        covs = self._class_covariances()
+        self.filters_ = self._csp_filters(covs)[:self.n_components]
+
+        features = self.covariance_features(self._trial_covs[:self.n_trials])
+        self._fit_lda(features, np.array(self._trial_labels))
+
+    @staticmethod
+    def _csp_filters(covs: NDArray) -> NDArray:
+        """
+        Compute the CSP filters, ordered by importance, in the same way as `mne.decoding.CSP`.
+        :param covs: the classes covariances with shape (n_classes, n_channels, n_channels)
+        :return: filters with shape (n_channels, n_channels)
+        """
+        if len(covs) == 2:
+
+            eigen_values, eigen_vectors = eigh(covs[0], covs.sum(0))
+            ix = np.argsort(np.abs(eigen_values - 0.5))[::-1]
+
+        else:
+
+            eigen_vectors = _ajd_pham(covs).T
+
+            # Normalize each vector by the mean covariance
+            mean_cov = covs.mean(axis=0)
+            eigen_vectors = eigen_vectors / np.sqrt(np.einsum('ij,ik,kj->j', eigen_vectors, mean_cov,
+                                                              eigen_vectors))
+
+            # Order by mutual information (classes are weighted equally, like mne does)
+            tmp = np.einsum('ij,cik,kj->cj', eigen_vectors, covs, eigen_vectors)
+            aa = np.log(np.sqrt(tmp)).mean(axis=0)
+            bb = (tmp ** 2 - 1).mean(axis=0)
+            mutual_info = -(aa + (3.0 / 16) * (bb ** 2))
+            ix = np.argsort(mutual_info)[::-1]
+
+        return eigen_vectors[:, ix].T
+
+    def covariance_features(self, trial_covs: NDArray) -> NDArray:
+        """
+        Compute the log-variance CSP features from the (uncentered) trials covariances, e.g. of many sliding
+        windows computed at once (see `bci4als.evaluation.window_covariances`).
+        :param trial_covs: ndarray with shape (n_trials, n_channels, n_channels)
+        :return: features with shape (n_trials, n_components)
+        """
+        return np.log(np.einsum('ki,nij,kj->nk', self.filters_, trial_covs, self.filters_))
+
+    def _fit_lda(self, features: NDArray, labels: NDArray):
+        """
+        Fit the LDA from the classes means and the pooled within-class covariance.
+        """
+        n_samples, n_classes = len(labels), len(self.classes_)
+
+        means = np.stack([features[labels == c].mean(axis=0) for c in self.classes_])
+        priors = np.array([np.mean(labels == c) for c in self.classes_])
+
+        centered = features - means[np.searchsorted(self.classes_, labels)]
+        within_cov = centered.T @ centered / max(n_samples - n_classes, 1)
+
+        self.coef_ = np.linalg.lstsq(within_cov, means.T, rcond=None)[0].T
+        self.intercept_ = -0.5 * np.sum(self.coef_ * means, axis=1) + np.log(priors)
+
+    def transform(self, X: NDArray) -> NDArray:
+        """
+        Compute the log-variance CSP features of the given trials.
+        :param X: trials with shape (n_trials, n_channels, n_samples)
+        :return: features with shape (n_trials, n_components)
+        """
+        X = np.asarray(X, dtype=np.float64)
+        trial_covs = np.einsum('nit,njt->nij', X, X) / X.shape[-1]
+
+        return self.covariance_features(trial_covs)
+
+    def decision_function(self, X: NDArray) -> NDArray:
+        """
+        :param X: trials with shape (n_trials, n_channels, n_samples)
+        :return: the LDA decision values with shape (n_trials, n_classes)
+        """
+        return self.transform(X) @ self.coef_.T + self.intercept_
+
+    def predict(self, X: NDArray) -> NDArray:
+        """
+        :param X: trials with shape (n_trials, n_channels, n_samples)
+        :return: the predicted labels with shape (n_trials,)
+        """
+        return self.classes_[np.argmax(self.decision_function(X), axis=1)]
+
+    def predict_proba(self, X: NDArray) -> NDArray:
+        """
+        Softmax of the decision values, like `LinearDiscriminantAnalysis.predict_proba`.
+        :param X: trials with shape (n_trials, n_channels, n_samples)
+        :return: the classes probabilities with shape (n_trials, n_classes)
+        """
+        decision = self.decision_function(X)
+        proba = np.exp(decision - decision.max(axis=1, keepdims=True))
+
+        return proba / proba.sum(axis=1, keepdims=True)
+
+
+def _ajd_pham(X: NDArray, eps: float = 1e-6, max_iter: int = 15) -> NDArray:
+    """
+    Approximate joint diagonalization based on Pham's algorithm.
+    Adapted from `mne.decoding.csp._ajd_pham` (and pyRiemann) in order to not rely on a private function.
+    :param X: covariance matrices with shape (n_matrices, n_channels, n_channels)
+    :param eps: tolerance for the stopping criterion
+    :param max_iter: maximum number of iterations
+    :return: the diagonalizer with shape (n_channels, n_channels)
+    """
+    n_epochs = X.shape[0]
+    A = np.concatenate(X, axis=0).T
+    n_times, n_m = A.shape
+    V = np.eye(n_times)
+    epsilon = n_times * (n_times - 1) * eps
+
+    for _ in range(max_iter):
+        decr = 0
+        for ii in range(1, n_times):
+            for jj in range(ii):
+                Ii = np.arange(ii, n_m, n_times)
+                Ij = np.arange(jj, n_m, n_times)
+
+                c1 = A[ii, Ii]
+                c2 = A[jj, Ij]
+
+                g12 = np.mean(A[ii, Ij] / c1)
+                g21 = np.mean(A[ii, Ij] / c2)
+
+                omega21 = np.mean(c1 / c2)
+                omega12 = np.mean(c2 / c1)
+                omega = np.sqrt(omega12 * omega21)
+
+                tmp = np.sqrt(omega21 / omega12)
+                tmp1 = (tmp * g12 + g21) / (omega + 1)
+                tmp2 = (tmp * g12 - g21) / max(omega - 1, 1e-9)
+
+                h12 = tmp1 + tmp2
+                h21 = np.conj((tmp1 - tmp2) / tmp)
+
+                decr += n_epochs * (g12 * np.conj(h12) + g21 * h21) / 2.0
+
+                tmp = 1 + 1.j * 0.5 * np.imag(h12 * h21)
+                tmp = np.real(tmp + np.sqrt(tmp ** 2 - h12 * h21))
+                tau = np.array([[1, -h12 / tmp], [-h21 / tmp, 1]])
+
+                A[[ii, jj], :] = np.dot(tau, A[[ii, jj], :])
+                tmp = np.c_[A[:, Ii], A[:, Ij]]
+                tmp = np.reshape(tmp, (n_times * n_epochs, 2), order='F')
+                tmp = np.dot(tmp, tau.T)
+
+                tmp = np.reshape(tmp, (n_times, n_epochs * 2), order='F')
+                A[:, Ii] = tmp[:, :n_epochs]
+                A[:, Ij] = tmp[:, n_epochs:]
+                V[[ii, jj], :] = np.dot(tau, V[[ii, jj], :])
+        if decr < epsilon:
+            break
+
+    return V
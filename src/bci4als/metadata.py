@@ -0,0 +1,145 @@
+import json
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from bci4als._version import __version__
+
+# Files of the session metadata in the session folder
+METADATA_FILE = 'metadata.json'
+METADATA_TEXT_FILE = 'metadata.txt'
+METADATA_VERSION = 1
+
+
+class SessionMetadata(NamedTuple):
+    """
+    The metadata of a session, saved as json (`metadata.json`) beside the human-readable `metadata.txt`.
+
+    Attributes
+    ----------
+    experiment_type : str
+        'Offline', 'Online' or 'Replay'
+    datetime : str
+        the start time of the session (ISO format)
+    sfreq : float
+        the sampling rate of the board
+    board_id : int
+        the brainflow board id
+    channels : list
+        the names of the EEG channels
+    channel_indices : list
+        the rows of the channels in the board data
+    marker_row : int
+        the row of the markers in the board data
+    num_trials : int
+        number of trials
+    trial_length : float
+        the length of a trial in seconds (None for online sessions, their trials end with the feedback)
+    cue_length : float
+        the length of the cue in seconds
+    labels_enum : dict
+        the name of each label
+    skip_after : int
+        number of wrong predictions before skipping the target (None if never)
+    parameters : dict
+        the parameters of the experiment type (e.g. the buffer time & threshold of the online experiment),
+        None is saved & read as an empty dict
+    software_version : str
+        the bci4als version which recorded the session
+    version : int
+        the version of the metadata format
+    """
+    experiment_type: Optional[str]
+    datetime: Optional[str]
+    sfreq: Optional[float]
+    board_id: Optional[int]
+    channels: List[str]
+    channel_indices: Optional[List[int]]
+    marker_row: Optional[int]
+    num_trials: Optional[int]
+    trial_length: Optional[float]
+    cue_length: Optional[float]
+    labels_enum: Dict[int, str]
+    skip_after: Optional[int]
+    parameters: Optional[Dict[str, Any]] = None
+    software_version: Optional[str] = __version__
+    version: int = METADATA_VERSION
+
+
+def write_metadata(session_directory: str, metadata: SessionMetadata):
+    """
+    Save the metadata of a session (written to a temporary file and renamed, so it is never partial).
+    :param session_directory: the session folder
+    :param metadata: the metadata
+    :return:
+    """
+    path = os.path.join(session_directory, METADATA_FILE)
+    content = metadata._asdict()
+    content['labels_enum'] = {str(label): name for label, name in metadata.labels_enum.items()}
+    content['parameters'] = metadata.parameters if metadata.parameters is not None else {}
+
+    with open(path + '.tmp', 'w') as file:
+        json.dump(content, file, indent=2)
+
+    os.replace(path + '.tmp', path)
+
+
+def read_metadata(session_directory: str) -> Optional[SessionMetadata]:
+    """
+    Read the metadata of a session from `metadata.json`, or parse the `metadata.txt` of older sessions (their
+    sampling rate, board & channel indices are unknown).
+    :param session_directory: the session folder
+    :return: the metadata, or None if the session has no metadata file
+    """
+    path = os.path.join(session_directory, METADATA_FILE)
+
+    if os.path.isfile(path):
+
+        with open(path) as file:
+            content = json.load(file)
+
+        if content['version'] > METADATA_VERSION:
+            raise ValueError(f'The metadata version {content["version"]} of {session_directory} is newer than '
+                             f'the supported version {METADATA_VERSION}, please upgrade bci4als')
+
+        content['labels_enum'] = {int(label): name for label, name in content['labels_enum'].items()}
+        content['parameters'] = content.get('parameters') or {}
+        return SessionMetadata(**{field: content[field] for field in SessionMetadata._fields if field in content})
+
+    if os.path.isfile(os.path.join(session_directory, METADATA_TEXT_FILE)):
+        return _parse_text(os.path.join(session_directory, METADATA_TEXT_FILE))
+
+    return None
+
+
+def _parse_text(path: str) -> SessionMetadata:
+    """
+    Parse a `metadata.txt` file.
+    """
+    fields, channels = {}, []
+
+    with open(path) as file:
+        for line in file:
+            match = re.match(r'Channel \d+: (\S+)', line)
+            if match:
+                channels.append(match.group(1))
+            elif ': ' in line:
+                key, value = line.strip().split(': ', 1)
+                fields[key] = value
+
+    def number(key: str, cast):
+        try:
+            return cast(fields[key])
+        except (KeyError, ValueError):
+            return None
+
+    labels = re.findall(r"(\d+): '(\w+)'", fields.get('Labels Enum', ''))
+    datetime = fields.get('Experiment datetime')
+
+    return SessionMetadata(experiment_type=fields.get('Experiment Type'),
+                           datetime=datetime.replace(' ', 'T') if datetime else None,
+                           sfreq=None, board_id=None, channels=channels, channel_indices=None, marker_row=None,
+                           num_trials=number('Num of trials', int), trial_length=number('Trials length', float),
+                           cue_length=number('Cue length', float),
+                           labels_enum={int(label): name for label, name in labels},
+                           skip_after=number('Skip After', int), parameters={}, software_version=None)
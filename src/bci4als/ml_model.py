@@ -1,16 +1,20 @@
+import copy
 import os
 import pickle
-from typing import List
-import mne
-import pandas as pd
+from typing import Dict, List, Optional, Tuple, Union, TYPE_CHECKING
+from bci4als.artifact import InferenceModel, export_model, load_inference_model
 from bci4als.eeg import EEG
+from bci4als.filtering import band_pass
+from bci4als.incremental import IncrementalCSPLDA
+from bci4als.models import BatchModel, make_model
+from bci4als.spatial import SpatialFilter
+from bci4als.timing import StageTimer
 import numpy as np
-from matplotlib.figure import Figure
-from mne.channels import make_standard_montage
-from mne.decoding import CSP
 from nptyping import NDArray
-from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
-from sklearn.pipeline import Pipeline
+
+# mne, sklearn & pandas are heavy, they are imported only by the methods which use them
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class MLModel:
@@ -25,14 +29,49 @@ class MLModel:
         a formatted string to print out what the animal says
     """
 
-    def __init__(self, trials: List[pd.DataFrame], labels: List[int]):
+    # Caches which are rebuilt on demand and the session timer are not pickled with the model
+    _caches = ('_filtered_trials', 'timer')
+
+    def __init__(self, trials: List[Union['pd.DataFrame', NDArray]], labels: List[int]):
 
-        self.trials: List[NDArray] = [t.to_numpy().T for t in trials]
+        # Trials are DataFrames (n_samples, n_channels) or ndarrays (n_channels, n_samples), e.g. from a recording
+        self.trials: List[NDArray] = [t.to_numpy().T if hasattr(t, 'to_numpy') else np.asarray(t)
+                                      for t in trials]
         self.labels: List[int] = labels
         self.debug = True
         self.clf = None
+        self.estimator: Optional[IncrementalCSPLDA] = None
+
+        # Optional spatial filter which is applied to the trials & windows before the classifier
+        self.spatial_filter: Optional[SpatialFilter] = None
+
+        # Band-passed trials keyed by (l_freq, h_freq, sfreq, n_samples), aligned with `self.trials`
+        self._filtered_trials: Dict[Tuple[float, float, float, Optional[int]], List[NDArray]] = {}
+
+        # Timing of the filter & predict stages (shared with the online experiment)
+        self.timer: StageTimer = StageTimer()
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k not in self._caches}
 
-    def offline_training(self, eeg: EEG, model_type: str = 'csp_lda'):
+    def __setstate__(self, state):
+        # Models pickled by older versions miss the newer attributes
+        self.__dict__.update(state)
+        self.__dict__.setdefault('estimator', None)
+        self.__dict__.setdefault('spatial_filter', None)
+        self._filtered_trials = {}
+        self.timer = StageTimer()
+
+    def offline_training(self, eeg: EEG, model_type: str = 'csp_lda', spatial_filter: Optional[str] = None):
+        """
+        Train the model on the trials.
+        :param eeg: the EEG object of the experiment
+        :param model_type: 'csp_lda' for the mne CSP & LDA pipeline, or any model of `bci4als.models.MODELS`
+                           (e.g. 'incremental_csp_lda', the same model with the incremental estimator)
+        :param spatial_filter: kind of spatial filter of `EEG.get_spatial_filter` (None for no spatial filter)
+        :return:
+        """
+        self.spatial_filter = eeg.get_spatial_filter(spatial_filter) if spatial_filter is not None else None
 
         if model_type.lower() == 'csp_lda':
 
@@ -40,28 +79,31 @@ class MLModel:
 
         else:
 
-            raise NotImplementedError(f'The model type `{model_type}` is not implemented yet')
+            self._registry_model(eeg, model_type.lower())
+
+    def _registry_model(self, eeg: EEG, model_type: str):
+
+        print(f'Training {model_type} model')
+
+        n_samples: int = min([t.shape[1] for t in self.trials])
+        X = np.stack([t[:, :n_samples] for t in self.trials])
+
+        self.clf = make_model(model_type, eeg.sfreq, self._ch_names(eeg)).fit(self._spatial(X), self.labels)
 
     def _csp_lda(self, eeg: EEG):
 
+        from mne.decoding import CSP
+        from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+        from sklearn.pipeline import Pipeline
+
         print('Training CSP & LDA model')
 
-        # convert data to mne.Epochs
-        ch_names = eeg.get_board_names()
-        ch_types = ['eeg'] * len(ch_names)
+        # CSP works on the data array, so the epochs are not wrapped in mne objects (no info & montage per fit)
         sfreq: int = eeg.sfreq
         n_samples: int = min([t.shape[1] for t in self.trials])
-        epochs_array: np.ndarray = np.stack([t[:, :n_samples] for t in self.trials])
-
-        info = mne.create_info(ch_names, sfreq, ch_types)
-        epochs = mne.EpochsArray(epochs_array, info)
-
-        # set montage
-        montage = make_standard_montage('standard_1020')
-        epochs.set_montage(montage)
 
-        # Apply band-pass filter
-        epochs.filter(7., 30., fir_design='firwin', skip_by_annotation='edge', verbose=False)
+        # Apply band-pass filter (only trials which were not filtered before)
+        epochs_array: np.ndarray = self._spatial(np.stack(self.filtered_trials(sfreq, 7., 30., n_samples)))
 
         # Assemble a classifier
         lda = LinearDiscriminantAnalysis()
@@ -71,28 +113,200 @@ class MLModel:
         self.clf = Pipeline([('CSP', csp), ('LDA', lda)])
 
         # fit transformer and classifier to data
-        self.clf.fit(epochs.get_data(), self.labels)
+        self.clf.fit(epochs_array, self.labels)
+
+    def online_predict(self, data: NDArray, eeg: EEG, filtered: bool = False):
+        """
+        Predict the label of the given buffer.
+        :param data: ndarray with the shape (n_channels, n_samples)
+        :param eeg: the EEG object of the experiment
+        :param filtered: whether the data was already band-passed (e.g. by the EEG streaming filter bank)
+        :return: the predicted label
+        """
+        return self.predict_batch(data[np.newaxis], eeg, filtered)[0]
+
+    def online_predict_proba(self, data: NDArray, eeg: EEG, filtered: bool = False) -> Tuple[int, NDArray]:
+        """
+        Predict the label of the given buffer and the classes probabilities.
+        :param data: ndarray with the shape (n_channels, n_samples)
+        :param eeg: the EEG object of the experiment
+        :param filtered: whether the data was already band-passed (e.g. by the EEG streaming filter bank)
+        :return: the predicted label and the probabilities with the shape (n_classes,)
+        """
+        clf = self.clf
+
+        if isinstance(clf, BatchModel):
+            windows = self._raw_windows(data[np.newaxis], filtered)
+        else:
+            windows = self._band_passed_windows(data[np.newaxis], eeg, filtered)
+
+        with self.timer.stage('predict'):
+            proba = clf.predict_proba(windows)[0]
+
+        return clf.classes_[np.argmax(proba)], proba
+
+    def predict_batch(self, windows: NDArray, eeg: EEG, filtered: bool = False) -> NDArray:
+        """
+        Predict the labels of many windows in one call.
+        :param windows: ndarray with the shape (n_windows, n_channels, n_samples)
+        :param eeg: the EEG object of the experiment
+        :param filtered: whether the data was already band-passed (e.g. by the EEG streaming filter bank)
+        :return: the predicted labels with the shape (n_windows,)
+        """
+        if isinstance(self.clf, BatchModel):
+            with self.timer.stage('predict'):
+                return self.clf.predict_batch(self._raw_windows(windows, filtered))
+
+        windows = self._band_passed_windows(windows, eeg, filtered)
+        with self.timer.stage('predict'):
+            return self.clf.predict(windows)
+
+    def predict_proba(self, windows: NDArray, eeg: EEG, filtered: bool = False) -> NDArray:
+        """
+        Predict the classes probabilities of many windows in one call.
+        :param windows: ndarray with the shape (n_windows, n_channels, n_samples)
+        :param eeg: the EEG object of the experiment
+        :param filtered: whether the data was already band-passed (e.g. by the EEG streaming filter bank)
+        :return: ndarray with the shape (n_windows, n_classes)
+        """
+        if isinstance(self.clf, BatchModel):
+            return self.clf.predict_proba(self._raw_windows(windows, filtered))
+
+        return self.clf.predict_proba(self._band_passed_windows(windows, eeg, filtered))
+
+    def _band_passed_windows(self, windows: NDArray, eeg: EEG, filtered: bool) -> NDArray:
 
-    def online_predict(self, data: NDArray, eeg: EEG):
         # Prepare the data to MNE functions
-        data = data.astype(np.float64)
+        windows = np.asarray(windows, dtype=np.float64)
 
         # Filter the data ( band-pass only)
-        data = mne.filter.filter_data(data, l_freq=8, h_freq=30, sfreq=eeg.sfreq, verbose=False)
+        if not filtered:
+            with self.timer.stage('filter'):
+                windows = self.band_pass(windows, eeg.sfreq, 8., 30.)
+
+        return self._spatial(windows)
+
+    def _raw_windows(self, windows: NDArray, filtered: bool) -> NDArray:
+
+        # The registry models apply their own pre-processing
+        if filtered:
+            raise ValueError(f'The model `{self.clf.name}` expects raw data, disable the streaming filter')
+
+        return self._spatial(np.asarray(windows, dtype=np.float64))
 
-        # Predict
-        prediction = self.clf.predict(data[np.newaxis])[0]
+    def _spatial(self, X: NDArray) -> NDArray:
 
-        return prediction
+        # Apply the spatial filter on the channels axis of all the trials / windows at once
+        return X if self.spatial_filter is None else self.spatial_filter.apply(X)
+
+    def _ch_names(self, eeg: EEG) -> List[str]:
+
+        # The channels which the classifier gets
+        return eeg.get_board_names() if self.spatial_filter is None else self.spatial_filter.out_names
 
     def partial_fit(self, eeg, X: NDArray, y: int):
+        """
+        Update the model with a new trial.
+        Instead of refitting CSP & LDA on all the trials, the new trial is added to an incremental
+        estimator, so each update takes the same time no matter how long the session is.
+        The classifier is updated on a copy which replaces it in one assignment, so predictions running in
+        another thread (see `DecodingPipeline`) always use a complete classifier.
+        :param eeg: the EEG object of the experiment
+        :param X: the new trial, ndarray with the shape (n_channels, n_samples)
+        :param y: the label of the new trial
+        :return:
+        """
+        self.partial_fit_batch(eeg, [X], [y])
+
+    def partial_fit_batch(self, eeg, trials: List[NDArray], labels: List[int]):
+        """
+        Update the model with several new trials in one update (see `partial_fit`), e.g. the co-learning
+        trials which were waiting for a slow update.
+        :param eeg: the EEG object of the experiment
+        :param trials: the new trials, ndarrays with the shape (n_channels, n_samples)
+        :param labels: the labels of the new trials
+        :return:
+        """
+
+        # Append the trials & labels
+        self.trials += list(trials)
+        self.labels += list(labels)
+
+        # Registry models are updated by themselves (or refitted if they do not support it)
+        if isinstance(self.clf, BatchModel):
+            clf = copy.deepcopy(self.clf)
+            if clf.supports_partial_fit:
+                n_samples: int = min([t.shape[1] for t in trials])
+                clf.partial_fit(self._spatial(np.stack([np.asarray(t, dtype=np.float64)[:, :n_samples]
+                                                        for t in trials])), list(labels))
+            else:
+                n_samples: int = min([t.shape[1] for t in self.trials])
+                clf.fit(self._spatial(np.stack([t[:, :n_samples] for t in self.trials])), self.labels)
+            self.clf = clf
+            return
+
+        # Band-pass the full length trials (the new trials are the only ones which are not cached)
+        filtered = self.filtered_trials(eeg.sfreq, 7., 30.)
 
-        # Append X to trials
-        self.trials.append(X)
+        # First update (or a model pickled before co-learning) - feed all the trials so far
+        if self.estimator is None:
+            estimator = IncrementalCSPLDA(n_components=6)
+            estimator.fit([self._spatial(t) for t in filtered], self.labels)
 
-        # Append y to labels
-        self.labels.append(y)
+        else:
+            estimator = copy.deepcopy(self.estimator)
+            estimator.partial_fit([self._spatial(t) for t in filtered[-len(trials):]], list(labels))
+
+        # Use the updated estimator for the predictions
+        self.estimator = self.clf = estimator
+
+    def filtered_trials(self, sfreq: float, l_freq: float, h_freq: float,
+                        n_samples: Optional[int] = None) -> List[NDArray]:
+        """
+        Return the trials after band-pass filter (padded like `mne.Epochs.filter`).
+        The filtered trials are cached, so only trials which were added since the last call are filtered.
+        :param sfreq: sampling rate of the trials
+        :param l_freq: the lower pass-band edge
+        :param h_freq: the upper pass-band edge
+        :param n_samples: crop the trials to this amount of samples before filtering (None for full length)
+        :return: list of the filtered trials, ndarrays with the shape (n_channels, n_samples)
+        """
+        cached = self._filtered_trials.setdefault((l_freq, h_freq, sfreq, n_samples), [])
+
+        for trial in self.trials[len(cached):]:
+            cached.append(self.band_pass(trial[:, :n_samples], sfreq, l_freq, h_freq, pad='edge'))
+
+        return cached
+
+    def export(self, path: str, eeg: EEG, training_sessions: Optional[List[str]] = None):
+        """
+        Save the fitted model in the compact format, without the trials (see `bci4als.artifact`).
+        :param path: path of the .npz file
+        :param eeg: the EEG object of the experiment
+        :param training_sessions: the folders of the sessions the model was trained on
+        :return:
+        """
+        export_model(self, path, eeg.sfreq, eeg.get_board_names(), training_sessions)
+
+    def band_pass(self, data: NDArray, sfreq: float, l_freq: float, h_freq: float,
+                  pad: str = 'reflect_limited') -> NDArray:
+        """
+        Zero-phase FIR band-pass filter, equivalent to `mne.filter.filter_data` with the default parameters.
+        See `bci4als.filtering.band_pass`.
+        """
+        return band_pass(data, sfreq, l_freq, h_freq, pad)
+
+
+def load_model(path: str) -> Union[MLModel, InferenceModel]:
+    """
+    Load a model file, a pickled MLModel or an inference-only model in the compact format (.npz).
+    :param path: path of the model file, or a session folder (its `model.pickle`, e.g. of a co-learning session)
+    :return: the model
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, 'model.pickle')
 
-        # Fit with trials and labels
-        self._csp_lda(eeg)
+    if path.endswith('.npz'):
+        return load_inference_model(path)
 
+    return pickle.load(open(path, 'rb'))
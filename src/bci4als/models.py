@@ -0,0 +1,291 @@
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+import numpy as np
+from bci4als.features import FeatureExtractor
+from bci4als.filtering import band_pass
+from bci4als.incremental import IncrementalCSPLDA
+from bci4als.spatial import MOTOR_LAPLACIAN, SpatialFilter
+from nptyping import NDArray
+
+# The registered models by name
+MODELS: Dict[str, Type['BatchModel']] = {}
+
+
+def register_model(name: str) -> Callable[[Type['BatchModel']], Type['BatchModel']]:
+    """
+    Class decorator which adds a model to the registry under the given name.
+    :param name: the name of the model, as given to `MLModel.offline_training`
+    :return: the decorator
+    """
+    def decorator(cls: Type['BatchModel']) -> Type['BatchModel']:
+        cls.name = name
+        MODELS[name] = cls
+        return cls
+
+    return decorator
+
+
+def make_model(name: str, sfreq: float, ch_names: List[str], **params) -> 'BatchModel':
+    """
+    Create a registered model.
+    :param name: the name of the model
+    :param sfreq: the sampling rate of the data
+    :param ch_names: the channels names of the data
+    :param params: extra parameters of the model
+    :return: the (not fitted) model
+    """
+    if name not in MODELS:
+        raise ValueError(f'Unknown model type `{name}`, use one of {sorted(MODELS)}')
+
+    return MODELS[name](sfreq, ch_names, **params)
+
+
+class BatchModel:
+    """
+    Base class of the registered models.
+
+    A model gets the raw (not filtered) data and applies its own pre-processing. All the methods work on
+    a batch of windows with the shape (n_windows, n_channels, n_samples), so many windows (e.g. of a sliding
+    window or of an offline replay) are scored in one vectorized call.
+    Sub-classes implement `_fit_features` & `features`, and the classifier is fitted on the features.
+
+    Attributes
+    ----------
+    sfreq : float
+        the sampling rate of the data
+    ch_names : list
+        the channels names of the data
+    classifier :
+        sklearn classifier which is fitted on the features
+    """
+
+    name: str = ''
+    supports_partial_fit: bool = False
+
+    def __init__(self, sfreq: float, ch_names: List[str]):
+
+        self.sfreq: float = sfreq
+        self.ch_names: List[str] = list(ch_names)
+
+        from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+        self.classifier = LinearDiscriminantAnalysis()
+
+    @property
+    def classes_(self) -> NDArray:
+        return self.classifier.classes_
+
+    def fit(self, X: NDArray, y: Sequence[int]) -> 'BatchModel':
+        """
+        :param X: trials with shape (n_trials, n_channels, n_samples)
+        :param y: labels of the trials
+        :return: self
+        """
+        X, y = np.asarray(X, dtype=np.float64), np.asarray(y)
+        self.classifier.fit(self._fit_features(X, y), y)
+
+        return self
+
+    def partial_fit(self, X: NDArray, y: Sequence[int]) -> 'BatchModel':
+        raise NotImplementedError(f'The model `{self.name}` can not be updated incrementally')
+
+    def _fit_features(self, X: NDArray, y: NDArray) -> NDArray:
+        """
+        Fit the (supervised) feature extraction and return the features of the training trials.
+        """
+        return self.features(X)
+
+    def features(self, X: NDArray) -> NDArray:
+        """
+        :param X: windows with shape (n_windows, n_channels, n_samples)
+        :return: features with shape (n_windows, n_features)
+        """
+        raise NotImplementedError
+
+    def predict_proba(self, X: NDArray) -> NDArray:
+        """
+        :param X: windows with shape (n_windows, n_channels, n_samples)
+        :return: the classes probabilities with shape (n_windows, n_classes)
+        """
+        return self.classifier.predict_proba(self.features(np.asarray(X, dtype=np.float64)))
+
+    def predict_batch(self, X: NDArray) -> NDArray:
+        """
+        :param X: windows with shape (n_windows, n_channels, n_samples)
+        :return: the predicted labels with shape (n_windows,)
+        """
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+@register_model('incremental_csp_lda')
+class CSPLDA(BatchModel):
+    """
+    Band-pass, CSP & LDA. The same model as the mne pipeline of `MLModel` ('csp_lda'), fitted with the
+    incremental estimator so it also supports co-learning.
+    """
+
+    supports_partial_fit = True
+
+    def __init__(self, sfreq: float, ch_names: List[str], band: Tuple[float, float] = (7., 30.),
+                 n_components: int = 6):
+
+        super().__init__(sfreq, ch_names)
+        self.band: Tuple[float, float] = band
+        self.classifier = IncrementalCSPLDA(n_components=n_components)
+
+    def fit(self, X: NDArray, y: Sequence[int]) -> 'CSPLDA':
+        self.classifier.fit(band_pass(X, self.sfreq, *self.band), y)
+        return self
+
+    def partial_fit(self, X: NDArray, y: Sequence[int]) -> 'CSPLDA':
+        self.classifier.partial_fit(band_pass(X, self.sfreq, *self.band), y)
+        return self
+
+    def features(self, X: NDArray) -> NDArray:
+        return self.classifier.transform(band_pass(X, self.sfreq, *self.band))
+
+    def predict_proba(self, X: NDArray) -> NDArray:
+        return self.classifier.predict_proba(band_pass(X, self.sfreq, *self.band))
+
+
+@register_model('fbcsp')
+class FilterBankCSP(BatchModel):
+    """
+    Filter-bank CSP: CSP log-variance features are extracted in each band and concatenated for the LDA.
+    """
+
+    def __init__(self, sfreq: float, ch_names: List[str],
+                 bands: Sequence[Tuple[float, float]] = ((4., 8.), (8., 12.), (12., 16.), (16., 20.),
+                                                         (20., 24.), (24., 28.), (28., 32.)),
+                 n_components: int = 4):
+
+        super().__init__(sfreq, ch_names)
+        self.bands: List[Tuple[float, float]] = list(bands)
+        self.csp: List[IncrementalCSPLDA] = [IncrementalCSPLDA(n_components) for _ in self.bands]
+
+    def _fit_features(self, X: NDArray, y: NDArray) -> NDArray:
+
+        for band, csp in zip(self.bands, self.csp):
+            csp.fit(band_pass(X, self.sfreq, *band), y)
+
+        return self.features(X)
+
+    def features(self, X: NDArray) -> NDArray:
+        return np.concatenate([csp.transform(band_pass(X, self.sfreq, *band))
+                               for band, csp in zip(self.bands, self.csp)], axis=1)
+
+
+@register_model('tangent_space')
+class TangentSpaceLR(BatchModel):
+    """
+    Riemannian classifier: the spatial covariance of each window is projected to the tangent space at the
+    Riemannian mean of the training covariances, and the tangent vectors are classified by logistic regression.
+    The matrix functions are computed with batched eigen-decompositions, so all the windows go in one call.
+    """
+
+    def __init__(self, sfreq: float, ch_names: List[str], band: Tuple[float, float] = (7., 30.),
+                 shrinkage: float = 0.05):
+
+        super().__init__(sfreq, ch_names)
+        self.band: Tuple[float, float] = band
+        self.shrinkage: float = shrinkage
+
+        from sklearn.linear_model import LogisticRegression
+        self.classifier = LogisticRegression(max_iter=1000)
+        self.reference_isqrt: Optional[NDArray] = None
+
+    def covariances(self, X: NDArray) -> NDArray:
+        """
+        :param X: windows with shape (n_windows, n_channels, n_samples)
+        :return: shrunk spatial covariances with shape (n_windows, n_channels, n_channels)
+        """
+        X = band_pass(X, self.sfreq, *self.band)
+        X = X - X.mean(axis=-1, keepdims=True)
+        covs = np.einsum('nit,njt->nij', X, X) / X.shape[-1]
+
+        # Shrink towards a scaled identity to keep the matrices well conditioned
+        n_channels = covs.shape[-1]
+        mu = np.trace(covs, axis1=1, axis2=2)[:, np.newaxis, np.newaxis] / n_channels
+
+        return (1 - self.shrinkage) * covs + self.shrinkage * mu * np.eye(n_channels)
+
+    def _fit_features(self, X: NDArray, y: NDArray) -> NDArray:
+
+        covs = self.covariances(X)
+        self.reference_isqrt = _matrix_function(_riemann_mean(covs), lambda w: 1 / np.sqrt(w))
+
+        return self._tangent_space(covs)
+
+    def features(self, X: NDArray) -> NDArray:
+        return self._tangent_space(self.covariances(X))
+
+    def _tangent_space(self, covs: NDArray) -> NDArray:
+        """
+        Log-map the covariances at the reference and vectorize the upper triangle (off-diagonal weighted by
+        sqrt(2) to keep the norm).
+        """
+        tangent = _matrix_function(self.reference_isqrt @ covs @ self.reference_isqrt, np.log)
+        rows, cols = np.triu_indices(covs.shape[-1])
+        weights = np.where(rows == cols, 1., np.sqrt(2))
+
+        return tangent[:, rows, cols] * weights
+
+
+@register_model('features_lda')
+class FeaturesLDA(BatchModel):
+    """
+    The features of `OnlineExperiment.online_pipe` followed by LDA:
+    band-pass, laplacian (C3 & C4), standardization and band power & variance features.
+    """
+
+    def __init__(self, sfreq: float, ch_names: List[str], band: Tuple[float, float] = (8., 30.),
+                 freq_bands: Sequence[float] = (8, 10, 12.5, 30)):
+
+        super().__init__(sfreq, ch_names)
+        self.band: Tuple[float, float] = band
+        self.freq_bands: NDArray = np.asarray(freq_bands)
+        self.extractor: FeatureExtractor = FeatureExtractor(sfreq, ['pow_freq_bands', 'variance'], freq_bands)
+        self.spatial_filter: SpatialFilter = SpatialFilter.laplacian(ch_names, MOTOR_LAPLACIAN)
+
+    def features(self, X: NDArray) -> NDArray:
+        X = band_pass(X, self.sfreq, *self.band)
+
+        # Laplacian on the channels axis of all the windows at once
+        X = self.spatial_filter.apply(X)
+
+        # Standardize each channel of each window
+        X = (X - X.mean(axis=-1, keepdims=True)) / X.std(axis=-1, keepdims=True)
+
+        return self.extractor.transform(X)
+
+
+def _matrix_function(covs: NDArray, func: Callable[[NDArray], NDArray]) -> NDArray:
+    """
+    Apply a function to the eigen-values of symmetric matrices.
+    :param covs: ndarray with shape (..., n_channels, n_channels)
+    :param func: the function, e.g. np.log or np.sqrt
+    :return: ndarray with the same shape
+    """
+    eigen_values, eigen_vectors = np.linalg.eigh(covs)
+
+    return (eigen_vectors * func(eigen_values)[..., np.newaxis, :]) @ np.swapaxes(eigen_vectors, -1, -2)
+
+
+def _riemann_mean(covs: NDArray, tol: float = 1e-8, max_iter: int = 50) -> NDArray:
+    """
+    The Riemannian (geometric) mean of SPD matrices, computed by gradient descent.
+    :param covs: ndarray with shape (n_matrices, n_channels, n_channels)
+    :return: the mean with shape (n_channels, n_channels)
+    """
+    mean = covs.mean(axis=0)
+
+    for _ in range(max_iter):
+        sqrt = _matrix_function(mean, np.sqrt)
+        isqrt = _matrix_function(mean, lambda w: 1 / np.sqrt(w))
+
+        gradient = _matrix_function(isqrt @ covs @ isqrt, np.log).mean(axis=0)
+        mean = sqrt @ _matrix_function(gradient, np.exp) @ sqrt
+
+        if np.linalg.norm(gradient) < tol:
+            break
+
+    return mean
@@ -4,6 +4,7 @@ from typing import Optional, List
 from PyQt5.QtCore import Qt
 from bci4als.eeg import EEG
 from bci4als.ml_model import MLModel
+from bci4als.timing import StageTimer
 from pynput.mouse import Button
 from pynput.mouse import Controller as Controller_mouse
 from pynput.keyboard import Key
@@ -90,6 +91,10 @@ class VirtualMouse:
         self.eeg: EEG = eeg
         self.model: MLModel = model
 
+        # Timing of the prediction stages (the model records its filter & predict stages into it)
+        self.timer = StageTimer()
+        self.model.timer = self.timer
+
         # Assert all actions from the config object exist in the virtual mouse object
         self.assert_actions(mouse_actions)
 
@@ -129,26 +134,53 @@ class VirtualMouse:
         print('No movement monitored...')
         return True
 
-    def predict(self, buffer_time: int) -> int:
+    def predict(self, buffer_time: int, hop_time: Optional[float] = None) -> int:
         """
         Predict the label the user imagined.
         :param buffer_time: time of data acquisition in seconds
+        :param hop_time: sliding-window mode - the EEG ring buffer keeps the last `buffer_time` seconds, so
+                         after the first window only `hop_time` seconds of new data are waited for
         :return:
         """
         # todo: what about the threshold? predict according the first label?
 
         # Sleep in order to get EEG data
         print('Predicting label...')
-        time.sleep(buffer_time)
 
-        # Data Acquisition
-        data = self.eeg.get_channels_data()
+        if hop_time is None:
+
+            time.sleep(buffer_time)
+
+            # Data Acquisition
+            with self.timer.stage('get_data'):
+                data = self.eeg.get_channels_data()
+
+        else:
+
+            if self.eeg.ring_buffer is None:
+                self.eeg.init_ring_buffer(buffer_time)
+
+            # Wait for the next hop, or for a full window
+            n_window = int(round(buffer_time * self.eeg.sfreq))
+            time.sleep(hop_time if len(self.eeg.ring_buffer) >= n_window else buffer_time)
+
+            # Data Acquisition
+            with self.timer.stage('get_data'):
+                self.eeg.update_ring_buffer()
+                data = self.eeg.get_window(buffer_time)
 
         # Predict label
+        data_time = time.perf_counter()
         prediction = self.model.online_predict(data, eeg=self.eeg)
+        latency = self.timer.record('decision', time.perf_counter() - data_time)
+        print(f'Latency: {latency * 1000:.1f} ms')
 
         return prediction
 
+    def print_latency(self):
+        """Print the latency percentiles of the predictions so far (e.g. at shutdown)"""
+        self.timer.print_summary()
+
     def execute(self, action: str):
         """
         The method execute the given action
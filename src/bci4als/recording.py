@@ -0,0 +1,337 @@
+import json
+import os
+import pickle
+import queue
+import threading
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+from nptyping import NDArray
+
+# Files of a session in the columnar format
+TRIALS_FILE = 'trials.npy'
+INDEX_FILE = 'trials_index.json'
+RAW_FILE = 'raw.dat'
+RAW_INDEX_FILE = 'raw_index.json'
+FORMAT_VERSION = 1
+
+
+class TrialsRecording:
+    """
+    Read-only access to the trials of a session stored in the columnar format.
+
+    The trials are saved as one contiguous float32 array with the shape (n_channels, n_samples), where all the
+    trials are concatenated along the time axis, together with a small json index holding the trials offsets,
+    the labels and the channels names. The array is opened with `np.memmap`, so getting a trial returns a view
+    and only the trials & channels which are actually used are read from the disk.
+
+    Attributes
+    ----------
+    data : NDArray
+        the memory-mapped array with all the trials, shape (n_channels, n_samples)
+    offsets : NDArray
+        start sample of each trial, with the total number of samples at the end (shape (n_trials + 1,))
+    labels : NDArray
+        the label of each trial
+    ch_names : list
+        the channels names
+    """
+
+    def __init__(self, session_directory: str, mmap_mode: Optional[str] = 'r'):
+
+        with open(os.path.join(session_directory, INDEX_FILE)) as file:
+            index = json.load(file)
+
+        self.session_directory: str = session_directory
+        self.data: NDArray = np.load(os.path.join(session_directory, TRIALS_FILE), mmap_mode=mmap_mode)
+        self.offsets: NDArray = np.asarray(index['offsets'], dtype=np.int64)
+        self.labels: NDArray = np.asarray(index['labels'], dtype=int)
+        self.ch_names: List[str] = index['channels']
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    @property
+    def lengths(self) -> NDArray:
+        """The number of samples in each trial"""
+        return np.diff(self.offsets)
+
+    def _channels_idx(self, channels: Optional[Sequence[str]]):
+        if channels is None:
+            return slice(None)
+
+        return [self.ch_names.index(ch) for ch in channels]
+
+    def trial(self, index: int, channels: Optional[Sequence[str]] = None) -> NDArray:
+        """
+        Get a single trial. Without channels selection the trial is a view of the file (no copy).
+        :param index: index of the trial
+        :param channels: names of the channels to select (default all)
+        :return: ndarray with the shape (n_channels, n_samples)
+        """
+        return self.data[self._channels_idx(channels), self.offsets[index]:self.offsets[index + 1]]
+
+    def trials(self, indices: Optional[Sequence[int]] = None,
+               channels: Optional[Sequence[str]] = None) -> List[NDArray]:
+        """
+        Get list of trials with their original lengths.
+        :param indices: indices of the trials to select (default all)
+        :param channels: names of the channels to select (default all)
+        :return: list of ndarrays with the shape (n_channels, n_samples)
+        """
+        indices = range(len(self)) if indices is None else indices
+
+        return [self.trial(i, channels) for i in indices]
+
+    def epochs(self, n_samples: Optional[int] = None, indices: Optional[Sequence[int]] = None,
+               channels: Optional[Sequence[str]] = None, dtype=np.float64) -> NDArray:
+        """
+        Get the trials cropped to the same length and stacked into one array.
+        :param n_samples: samples in each epoch (default the length of the shortest trial)
+        :param indices: indices of the trials to select (default all)
+        :param channels: names of the channels to select (default all)
+        :param dtype: dtype of the returned array
+        :return: ndarray with the shape (n_trials, n_channels, n_samples)
+        """
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices)
+        n_samples = int(self.lengths[indices].min()) if n_samples is None else n_samples
+
+        if (self.lengths[indices] < n_samples).any():
+            raise ValueError(f'Some of the trials are shorter than {n_samples} samples')
+
+        ch_idx = self._channels_idx(channels)
+        n_channels = len(self.ch_names) if channels is None else len(ch_idx)
+        epochs = np.empty((len(indices), n_channels, n_samples), dtype=dtype)
+
+        for i, trial_index in enumerate(indices):
+            start = self.offsets[trial_index]
+            epochs[i] = self.data[ch_idx, start:start + n_samples]
+
+        return epochs
+
+
+def write_trials(session_directory: str, trials: List[NDArray], labels: List[int], ch_names: List[str]):
+    """
+    Save the trials of a session in the columnar format.
+    :param session_directory: the session folder
+    :param trials: list of ndarrays with the shape (n_channels, n_samples)
+    :param labels: the label of each trial
+    :param ch_names: the channels names
+    :return:
+    """
+    if len(trials) != len(labels):
+        raise ValueError(f'Got {len(trials)} trials but {len(labels)} labels')
+
+    offsets = np.concatenate([[0], np.cumsum([t.shape[1] for t in trials])])
+
+    # Write the trials one by one into the memory-mapped file
+    data = np.lib.format.open_memmap(os.path.join(session_directory, TRIALS_FILE), mode='w+',
+                                     dtype=np.float32, shape=(len(ch_names), int(offsets[-1])))
+    for trial, start, end in zip(trials, offsets[:-1], offsets[1:]):
+        data[:, start:end] = trial
+    data.flush()
+    del data
+
+    index = {'version': FORMAT_VERSION, 'channels': list(ch_names),
+             'offsets': offsets.tolist(), 'labels': [int(label) for label in labels]}
+    with open(os.path.join(session_directory, INDEX_FILE), 'w') as file:
+        json.dump(index, file)
+
+
+def convert_pickle(session_directory: str, overwrite: bool = False) -> bool:
+    """
+    Convert the `trials.pickle` & `labels.csv` of an existing session into the columnar format.
+    :param session_directory: the session folder
+    :param overwrite: convert even if the session was already converted
+    :return: whether the session was converted
+    """
+    pickle_path = os.path.join(session_directory, 'trials.pickle')
+    labels_path = os.path.join(session_directory, 'labels.csv')
+
+    if not os.path.isfile(pickle_path) or not os.path.isfile(labels_path):
+        return False
+
+    if os.path.isfile(os.path.join(session_directory, INDEX_FILE)) and not overwrite:
+        return False
+
+    import pandas as pd
+
+    trials: List[pd.DataFrame] = pickle.load(open(pickle_path, 'rb'))
+    labels = pd.read_csv(labels_path, header=None)[0].tolist()
+
+    write_trials(session_directory, [t.to_numpy().T for t in trials], labels, list(trials[0].columns))
+
+    return True
+
+
+class RawRecorder:
+    """
+    Record the raw board stream to the disk while the acquisition is running.
+
+    An acquisition thread drains the board every `interval` seconds and puts the chunk in a bounded queue,
+    and a writer thread appends the chunks to the raw file (float64, sample-major, so appending is cheap).
+    If the writer falls behind and the queue is full, the acquisition thread waits (the samples stay in the
+    board buffer meanwhile) and the backpressure is reported.
+    Without a source the recorder has no acquisition thread, and the board is drained by the caller which
+    hands the chunks to `push` (e.g. the `AcquisitionManager` which polls several boards).
+    The markers positions are collected while writing, so trials can be sliced without scanning the file.
+
+    Attributes
+    ----------
+    interval : float
+        time in seconds between draining the board
+    n_rows : int
+        number of rows of the board data
+    n_samples : int
+        number of samples written to the disk
+    markers_idx : list
+        sample index of each marker
+    markers_value : list
+        the value of each marker
+    n_backpressure : int
+        how many chunks found the queue full
+    max_queue : int
+        the maximal number of chunks waiting for the writer
+    """
+
+    def __init__(self, source: Optional[Callable[[], NDArray]], session_directory: str, marker_row: int,
+                 interval: float = 0.5, max_chunks: int = 32, n_rows: Optional[int] = None):
+
+        self.source: Optional[Callable[[], NDArray]] = source
+        self.session_directory: str = session_directory
+        self.marker_row: int = marker_row
+        self.interval: float = interval
+
+        # Statistics (the rows of the board are known from the first chunk if they were not given)
+        self.n_rows: Optional[int] = n_rows
+        self.n_samples: int = 0
+        self.markers_idx: List[int] = []
+        self.markers_value: List[float] = []
+        self.n_backpressure: int = 0
+        self.max_queue: int = 0
+
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._write, daemon=True)]
+        if source is not None:
+            self._threads.append(threading.Thread(target=self._acquire, daemon=True))
+
+    def start(self):
+        """Start the acquisition & writer threads"""
+        for thread in self._threads:
+            thread.start()
+
+    def push(self, chunk: NDArray, block: bool = True) -> bool:
+        """
+        Record a chunk of board data (only for a recorder without a source).
+        :param chunk: board data with the shape (n_rows, n_samples)
+        :param block: wait for the writer if the queue is full. Without waiting, a chunk which does not fit
+                      is not queued (counted in `n_backpressure`) and the caller should push it again later
+        :return: whether the chunk was queued
+        """
+        if self.source is not None:
+            raise RuntimeError('The recorder drains its own source')
+
+        if block:
+            self._put(chunk)
+            return True
+
+        try:
+            self._queue.put_nowait(chunk)
+        except queue.Full:
+            self.n_backpressure += 1
+            return False
+
+        self.max_queue = max(self.max_queue, self._queue.qsize())
+        return True
+
+    def stop(self):
+        """Drain the last samples, wait for the writer to finish and save the index of the raw file"""
+        self._stop.set()
+
+        if self.source is None:
+            self._queue.put(None)
+
+        for thread in self._threads:
+            thread.join()
+
+        index = {'version': FORMAT_VERSION, 'dtype': 'float64', 'n_rows': self.n_rows,
+                 'n_samples': self.n_samples, 'marker_row': self.marker_row,
+                 'markers_idx': self.markers_idx, 'markers_value': self.markers_value}
+        with open(os.path.join(self.session_directory, RAW_INDEX_FILE), 'w') as file:
+            json.dump(index, file)
+
+    def _acquire(self):
+
+        # The writer is always stopped, also if the source fails, so `stop` never waits forever
+        try:
+            while not self._stop.wait(self.interval):
+                self._put(self.source())
+
+            # The samples since the last interval
+            self._put(self.source())
+
+        finally:
+            self._queue.put(None)
+
+    def _put(self, chunk: NDArray):
+
+        if chunk.shape[1] == 0:
+            return
+
+        if self._queue.full():
+            self.n_backpressure += 1
+            print(f'Recorder backpressure: {self._queue.qsize()} chunks are waiting to be written')
+
+        self._queue.put(chunk)
+        self.max_queue = max(self.max_queue, self._queue.qsize())
+
+    def _write(self):
+
+        with open(os.path.join(self.session_directory, RAW_FILE), 'wb') as file:
+
+            while True:
+
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+
+                markers = np.flatnonzero(chunk[self.marker_row])
+                self.markers_idx += (markers + self.n_samples).tolist()
+                self.markers_value += chunk[self.marker_row, markers].tolist()
+
+                np.ascontiguousarray(chunk.T, dtype=np.float64).tofile(file)
+                file.flush()
+
+                self.n_rows = chunk.shape[0]
+                self.n_samples += chunk.shape[1]
+
+
+class RawRecording:
+    """
+    Read-only access to a raw stream saved by `RawRecorder`.
+
+    Attributes
+    ----------
+    data : NDArray
+        memory-mapped board data with the shape (n_rows, n_samples), like `BoardShim.get_board_data`
+    markers_idx : NDArray
+        sample index of each marker
+    markers_value : NDArray
+        the value of each marker
+    """
+
+    def __init__(self, session_directory: str):
+
+        with open(os.path.join(session_directory, RAW_INDEX_FILE)) as file:
+            index = json.load(file)
+
+        # A recording without samples has an empty raw file, which can not be memory-mapped
+        shape = (index['n_samples'], index['n_rows'] or 0)
+        if index['n_samples'] == 0:
+            self.data: NDArray = np.empty(shape, dtype=index['dtype']).T
+        else:
+            self.data: NDArray = np.memmap(os.path.join(session_directory, RAW_FILE), dtype=index['dtype'],
+                                           mode='r', shape=shape).T
+        self.markers_idx: NDArray = np.asarray(index['markers_idx'], dtype=np.int64)
+        self.markers_value: NDArray = np.asarray(index['markers_value'])
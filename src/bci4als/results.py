@@ -0,0 +1,130 @@
+import json
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Files of the online results in the session folder
+RESULTS_FILE = 'results.json'
+RESULTS_LOG = 'results.jsonl'
+
+
+class ResultsLog:
+    """
+    Append-only log of the online predictions (JSON lines), one record per prediction:
+        {"time": unix time, "trial": trial index, "target": stim, "prediction": label,
+         "probabilities": classes probabilities or null, "latency": seconds from the data to the feedback}
+
+    The records are buffered and flushed to the disk every `flush_interval` seconds and at the end of each
+    trial (with fsync), so a crash loses at most the last second of the session instead of the whole session.
+    Use `read_results` to rebuild the target-prediction pairs of `results.json`. The log of a previous run in
+    the same folder (e.g. a replay into an existing folder) is replaced.
+
+    Attributes
+    ----------
+    path : str
+        path of the log file
+    flush_interval : float
+        maximal time in seconds between writing the records to the disk
+    n_records : int
+        number of records written
+    """
+
+    def __init__(self, session_directory: str, flush_interval: float = 1.):
+
+        self.path: str = os.path.join(session_directory, RESULTS_LOG)
+        self.flush_interval: float = flush_interval
+        self.n_records: int = 0
+
+        # A new run into the same folder starts a new log (the trial indices start again at 0)
+        self._file = open(self.path, 'w')
+        self._last_flush: float = time.monotonic()
+
+    def log(self, trial: int, target: int, prediction: int, latency: Optional[float] = None,
+            probabilities: Optional[Sequence[float]] = None):
+        """
+        Append the record of a prediction.
+        :param trial: the index of the trial
+        :param target: the stim of the trial
+        :param prediction: the predicted label
+        :param latency: time in seconds from the data to the feedback
+        :param probabilities: the classes probabilities of the prediction
+        :return:
+        """
+        record = {'time': time.time(), 'trial': int(trial), 'target': int(target), 'prediction': int(prediction),
+                  'probabilities': None if probabilities is None else [float(p) for p in probabilities],
+                  'latency': latency}
+        self._file.write(json.dumps(record) + '\n')
+        self.n_records += 1
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self, sync: bool = False):
+        """
+        Write the buffered records to the disk.
+        :param sync: also wait for the disk (fsync)
+        :return:
+        """
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+        self._last_flush = time.monotonic()
+
+    def end_trial(self):
+        """Make sure the records of the trial are on the disk"""
+        self.flush(sync=True)
+
+    def close(self):
+        self.flush(sync=True)
+        self._file.close()
+
+
+def read_results_log(session_directory: str) -> List[Dict]:
+    """
+    Read the records of the results log. A last line which was cut by a crash is ignored.
+    :param session_directory: the folder of the session
+    :return: list of the records
+    """
+    records = []
+
+    with open(os.path.join(session_directory, RESULTS_LOG)) as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+
+    return records
+
+
+def read_results(session_directory: str) -> List[List[Tuple[int, int]]]:
+    """
+    The target-prediction pairs of each trial (the content of `results.json`), rebuilt from the results log
+    if there is one (newer sessions), or read from `results.json`.
+    :param session_directory: the folder of the session
+    :return: list of trials, each is a list of (target, prediction) pairs
+    """
+    if not os.path.isfile(os.path.join(session_directory, RESULTS_LOG)):
+        with open(os.path.join(session_directory, RESULTS_FILE)) as file:
+            return [[tuple(pair) for pair in trial] for trial in json.load(file)]
+
+    results: Dict[int, List[Tuple[int, int]]] = {}
+    for record in read_results_log(session_directory):
+        results.setdefault(record['trial'], []).append((record['target'], record['prediction']))
+
+    return [results[trial] for trial in sorted(results)]
+
+
+def write_results(session_directory: str):
+    """
+    Write `results.json` from the results log (e.g. at the end of the session, or after a crash).
+    :param session_directory: the folder of the session
+    :return:
+    """
+    path = os.path.join(session_directory, RESULTS_FILE)
+
+    with open(path + '.tmp', 'w') as file:
+        json.dump(read_results(session_directory), file)
+
+    os.replace(path + '.tmp', path)
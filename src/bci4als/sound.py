@@ -0,0 +1,95 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, List, Optional, Sequence
+
+# The mp3 files of the experiments sounds
+AUDIO_DIRECTORY = os.path.join(os.path.dirname(__file__), 'audio')
+
+# File of the playback times, saved in the session folder
+ONSETS_FILE = 'audio_onsets.json'
+
+# A played sound: the time it was requested and the time its playback started (`time.time()`, the clock of the
+# board timestamps)
+Onset = namedtuple('Onset', ['name', 'requested', 'started'])
+
+
+class AudioService:
+    """
+    Plays the cue & feedback sounds without blocking the caller.
+
+    All the sounds are decoded once when the service is created (psychopy sound objects), and `play` only
+    hands the name of the sound to a background thread, so it returns in microseconds and the markers and the
+    screen are not delayed by audio I/O. The thread records when the playback of each sound started (with the
+    clock of the board timestamps), so the sounds can be aligned with the EEG markers (see `save`).
+
+    Attributes
+    ----------
+    sounds : dict
+        the decoded sound of each name
+    onsets : list
+        the `Onset` of each played sound
+    """
+
+    def __init__(self, names: Optional[Sequence[str]] = None, directory: str = AUDIO_DIRECTORY):
+
+        from psychopy import sound
+
+        if names is None:
+            names = [os.path.splitext(f)[0] for f in sorted(os.listdir(directory)) if f.endswith('.mp3')]
+
+        # Decode all the sounds once
+        self.sounds: Dict[str, 'sound.Sound'] = {name: sound.Sound(os.path.join(directory, f'{name}.mp3'))
+                                                 for name in names}
+        self.onsets: List[Onset] = []
+
+        self._requests: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._play, name='audio', daemon=True)
+        self._thread.start()
+
+    def play(self, name: str) -> float:
+        """
+        Play a sound in the background.
+        :param name: the name of the sound (the file name without the extension)
+        :return: the time of the request
+        """
+        if name not in self.sounds:
+            raise KeyError(f'The sound `{name}` was not loaded')
+
+        requested = time.time()
+        self._requests.put((name, requested))
+
+        return requested
+
+    def close(self):
+        """Wait for the requested sounds to start and stop the service"""
+        self._requests.put(None)
+        self._thread.join()
+
+    def save(self, session_directory: str):
+        """
+        Save the onsets of the played sounds in the session folder.
+        :param session_directory: the folder of the session
+        :return:
+        """
+        with open(os.path.join(session_directory, ONSETS_FILE), 'w') as file:
+            json.dump([onset._asdict() for onset in self.onsets], file, indent=2)
+
+    def _play(self):
+
+        while True:
+
+            request = self._requests.get()
+            if request is None:
+                return
+
+            name, requested = request
+            sound = self.sounds[name]
+
+            # Restart a sound which is still playing, the playback has started once `play` returns
+            sound.stop()
+            sound.play()
+            self.onsets.append(Onset(name, requested, time.time()))
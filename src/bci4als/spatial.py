@@ -0,0 +1,92 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from nptyping import NDArray
+
+# The small Laplacian of the motor channels used by the project (channel: its neighbours)
+MOTOR_LAPLACIAN: Dict[str, List[str]] = {'C3': ['Cz', 'FC5', 'FC1', 'CP5', 'CP1'],
+                                         'C4': ['Cz', 'FC2', 'FC6', 'CP2', 'CP6']}
+
+
+class SpatialFilter:
+    """
+    A linear spatial filter given as a (n_out, n_channels) matrix, which is built once for a channels list.
+
+    Applying the filter is a single matmul over the channels axis, so a single buffer (n_channels, n_samples)
+    and a batch of epochs (n_epochs, n_channels, n_samples) are filtered the same way, and the input is never
+    modified.
+    Note that a laplacian of all the channels and the CAR remove the common signal, so their output has rank
+    n_channels - 1 and does not fit models which invert the full spatial covariance (e.g. CSP).
+
+    Attributes
+    ----------
+    matrix : NDArray
+        the filter matrix with the shape (n_out, n_channels)
+    ch_names : list
+        the input channels
+    out_names : list
+        the name of each output channel
+    """
+
+    def __init__(self, matrix: NDArray, ch_names: Sequence[str], out_names: Sequence[str]):
+
+        self.matrix: NDArray = np.asarray(matrix, dtype=np.float64)
+        self.ch_names: List[str] = list(ch_names)
+        self.out_names: List[str] = list(out_names)
+
+    def apply(self, data: NDArray) -> NDArray:
+        """
+        :param data: ndarray with the shape (..., n_channels, n_samples)
+        :return: ndarray with the shape (..., n_out, n_samples)
+        """
+        return np.matmul(self.matrix, data)
+
+    @classmethod
+    def laplacian(cls, ch_names: Sequence[str], neighbours: Optional[Dict[str, Sequence[str]]] = None,
+                  n_neighbours: int = 4) -> 'SpatialFilter':
+        """
+        Surface Laplacian: each output channel is the channel minus the mean of its neighbours.
+        :param ch_names: the input channels
+        :param neighbours: dict of output channel to its neighbours. By default every channel is an output
+                           channel, and its neighbours are the nearest channels in the standard 10-20 montage
+        :param n_neighbours: number of nearest neighbours (used only without explicit neighbours)
+        :return: the spatial filter
+        """
+        ch_names = list(ch_names)
+        if neighbours is None:
+            neighbours = _nearest_neighbours(ch_names, n_neighbours)
+
+        index = {ch: i for i, ch in enumerate(ch_names)}
+        matrix = np.zeros((len(neighbours), len(ch_names)))
+
+        for row, (ch, chs) in enumerate(neighbours.items()):
+            matrix[row, [index[n] for n in chs]] = -1 / len(chs)
+            matrix[row, index[ch]] = 1
+
+        return cls(matrix, ch_names, list(neighbours))
+
+    @classmethod
+    def car(cls, ch_names: Sequence[str]) -> 'SpatialFilter':
+        """
+        Common average reference: each channel minus the mean of all the channels.
+        :param ch_names: the input channels
+        :return: the spatial filter
+        """
+        n_channels = len(ch_names)
+
+        return cls(np.eye(n_channels) - 1 / n_channels, ch_names, ch_names)
+
+
+def _nearest_neighbours(ch_names: List[str], n_neighbours: int) -> Dict[str, List[str]]:
+    """
+    Find the nearest channels of each channel by their positions in the standard 10-20 montage.
+    """
+    from mne.channels import make_standard_montage
+
+    positions = make_standard_montage('standard_1020').get_positions()['ch_pos']
+    xyz = np.array([positions[ch] for ch in ch_names])
+
+    distances = np.linalg.norm(xyz[:, np.newaxis] - xyz[np.newaxis], axis=-1)
+    nearest = np.argsort(distances, axis=1)[:, 1:n_neighbours + 1]
+
+    return {ch: [ch_names[j] for j in nearest[i]] for i, ch in enumerate(ch_names)}
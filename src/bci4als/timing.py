@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_right
+from typing import Dict, List
+
+import numpy as np
+from nptyping import NDArray
+
+# File of the latency histograms, saved next to `results.json`
+LATENCY_FILE = 'latency.json'
+
+
+class StageTimer:
+    """
+    Low-overhead timing of the stages of the online loop.
+
+    The durations (measured with the monotonic `time.perf_counter`) are not kept one by one, instead each
+    stage has a histogram with log-spaced bins (from 1 us to 100 s, 20 bins per decade), so recording a
+    duration is a bisect and an increment, and the memory does not grow with the session length.
+    The percentiles are estimated from the histogram with a relative error of about 6%; the count, mean and max
+    are exact.
+
+    Attributes
+    ----------
+    edges : NDArray
+        the bins edges in seconds
+    counts : dict
+        histogram of each stage
+    """
+
+    def __init__(self, bins_per_decade: int = 20, min_time: float = 1e-6, max_time: float = 1e2):
+
+        n_bins = int(round(np.log10(max_time / min_time) * bins_per_decade))
+        self.edges: NDArray = np.logspace(np.log10(min_time), np.log10(max_time), n_bins + 1)
+        self._edges: List[float] = self.edges.tolist()
+
+        # Per stage: histogram (with under & over flow bins), sum and max of the durations
+        self.counts: Dict[str, NDArray] = {}
+        self._sum: Dict[str, float] = {}
+        self._max: Dict[str, float] = {}
+
+        # The stages of the online pipeline are recorded from several threads
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> float:
+        """
+        Add a duration to the histogram of the stage.
+        :param stage: the stage name
+        :param seconds: the duration in seconds
+        :return: the duration
+        """
+        with self._lock:
+
+            if stage not in self.counts:
+                self.counts[stage] = np.zeros(len(self._edges) + 1, dtype=np.int64)
+                self._sum[stage] = 0.
+                self._max[stage] = 0.
+
+            self.counts[stage][bisect_right(self._edges, seconds)] += 1
+            self._sum[stage] += seconds
+            self._max[stage] = max(self._max[stage], seconds)
+
+        return seconds
+
+    def stage(self, stage: str) -> '_Stage':
+        """
+        Time a block of code, e.g. `with timer.stage('predict'): ...`
+        :param stage: the stage name
+        :return: context manager which records the duration of the block
+        """
+        return _Stage(self, stage)
+
+    def percentile(self, stage: str, q: float) -> float:
+        """
+        Estimate a percentile of the stage durations from its histogram.
+        :param stage: the stage name
+        :param q: percentile between 0 and 100
+        :return: the duration in seconds (the geometric center of the bin, bounded by the max)
+        """
+        counts = self.counts[stage]
+        index = int(np.searchsorted(np.cumsum(counts), q / 100 * counts.sum()))
+
+        if index == 0:
+            return self._edges[0]
+        if index == len(self._edges):
+            return self._max[stage]
+
+        return min(float(np.sqrt(self._edges[index - 1] * self._edges[index])), self._max[stage])
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return: dict with the count, mean, p50, p95, p99 and max (in milliseconds) of each stage
+        """
+        summary = {}
+
+        for stage, counts in self.counts.items():
+            count = int(counts.sum())
+            summary[stage] = {'count': count,
+                              'mean_ms': self._sum[stage] / count * 1000,
+                              'p50_ms': self.percentile(stage, 50) * 1000,
+                              'p95_ms': self.percentile(stage, 95) * 1000,
+                              'p99_ms': self.percentile(stage, 99) * 1000,
+                              'max_ms': self._max[stage] * 1000}
+
+        return summary
+
+    def print_summary(self):
+
+        for stage, stats in self.summary().items():
+            print(f'{stage}: n={stats["count"]}, p50={stats["p50_ms"]:.1f} ms, p95={stats["p95_ms"]:.1f} ms, '
+                  f'p99={stats["p99_ms"]:.1f} ms, max={stats["max_ms"]:.1f} ms')
+
+    def save(self, session_directory: str):
+        """
+        Save the histograms and the summary to `latency.json` in the session folder.
+        :param session_directory: the session folder
+        :return:
+        """
+        latency = {'edges': self._edges,
+                   'counts': {stage: counts.tolist() for stage, counts in self.counts.items()},
+                   'summary': self.summary()}
+
+        with open(os.path.join(session_directory, LATENCY_FILE), 'w') as file:
+            json.dump(latency, file)
+
+
+class _Stage:
+
+    __slots__ = ('timer', 'stage', 'start')
+
+    def __init__(self, timer: StageTimer, stage: str):
+        self.timer = timer
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.timer.record(self.stage, time.perf_counter() - self.start)
@@ -0,0 +1,101 @@
+import os
+import time
+
+import numpy as np
+import pytest
+from bci4als.acquisition import AcquisitionManager
+from bci4als.eeg import EEG
+from bci4als.recording import RAW_FILE, RAW_INDEX_FILE, RawRecording
+from brainflow import BoardIds, BoardShim
+
+N_BOARDS = 3
+N_TRIALS = 2
+
+
+def synthetic_boards(n_boards, first_port=6677):
+
+    # Synthetic boards need different ports to run side by side
+    return {f'station{i}': EEG(board_id=BoardIds.SYNTHETIC_BOARD.value, ip_port=first_port + i, serial_port='')
+            for i in range(n_boards)}
+
+
+@pytest.fixture(scope='module', autouse=True)
+def quiet_boards():
+    BoardShim.disable_board_logger()
+
+
+def test_multi_board(tmp_path, capsys):
+
+    manager = AcquisitionManager(synthetic_boards(N_BOARDS))
+    directories = {name: str(tmp_path / name) for name in manager.names}
+    for directory in directories.values():
+        os.makedirs(directory)
+
+    manager.start(directories)
+
+    # A trial on each board
+    for trial in range(N_TRIALS):
+        for name in manager.names:
+            manager.insert_marker(name, 'start', trial, trial)
+        time.sleep(0.5)
+        for name in manager.names:
+            manager.insert_marker(name, 'stop', trial, trial)
+
+    # Wait for the boards to stream the last markers
+    time.sleep(0.5)
+
+    eeg = manager[manager.names[0]]
+    window = manager.get_window(manager.names[0], 1)
+    running = manager.stats()
+    recorders = manager.stop()
+    stats = manager.stats()
+
+    assert window.shape == (len(eeg.get_board_channels()), int(eeg.sfreq))
+    assert sorted(recorders) == sorted(manager.names)
+    assert all(s.recorded and not s.stalled for s in running.values())
+
+    for name, directory in directories.items():
+
+        assert stats[name].n_errors == 0
+        assert stats[name].n_markers == 2 * N_TRIALS
+        assert stats[name].n_samples > 0
+        assert stats[name].backlog == 0
+
+        # Every polled sample & marker was recorded
+        assert os.path.isfile(os.path.join(directory, RAW_FILE))
+        assert os.path.isfile(os.path.join(directory, RAW_INDEX_FILE))
+        recording = RawRecording(directory)
+        assert recording.data.shape[1] == stats[name].n_samples
+        assert len(recording.markers_idx) == 2 * N_TRIALS
+
+        durations, labels = manager[name].pair_markers(recording.markers_idx, recording.markers_value,
+                                                       recording.data.shape[1])
+        assert labels == list(range(N_TRIALS))
+        assert np.all(durations[:, 1] > durations[:, 0])
+
+    manager.print_stats()
+    output = capsys.readouterr().out
+    for name in manager.names:
+        assert f'{name}: {stats[name].n_samples} samples' in output
+        assert f'{2 * N_TRIALS} markers, 0 errors' in output
+
+
+def test_stop_before_start():
+
+    with pytest.raises(RuntimeError):
+        AcquisitionManager(synthetic_boards(1, 6690)).stop()
+
+
+def test_failed_start_turns_off_the_boards():
+
+    manager = AcquisitionManager(synthetic_boards(2, 6691))
+
+    def fail():
+        raise RuntimeError('The board is not connected')
+
+    manager['station1'].on = fail
+
+    with pytest.raises(RuntimeError):
+        manager.start()
+
+    assert not manager['station0'].board.is_prepared()
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from bci4als.eeg import EEG, RingBuffer
+from brainflow import BoardIds
+
+
+@pytest.fixture(scope='module')
+def eeg():
+    return EEG(board_id=BoardIds.SYNTHETIC_BOARD.value, serial_port='')
+
+
+def test_decode_marker():
+
+    assert EEG.decode_marker(EEG.encode_marker('start', 3, 12)) == ('start', 3, 12)
+    assert EEG.decode_marker(EEG.encode_marker('stop', 0, 0)) == ('stop', 0, 0)
+
+    # A marker row, samples without a marker get an empty status
+    status, label, index = EEG.decode_marker(np.array([0., 1221., 0., 1222.]))
+    assert status.tolist() == ['', 'start', '', 'stop']
+    assert label[[1, 3]].tolist() == [2, 2]
+    assert index[[1, 3]].tolist() == [12, 12]
+
+    with pytest.raises(ValueError):
+        EEG.decode_marker(1225)
+
+
+def test_pair_markers(eeg):
+
+    markers_idx = [10, 50, 60, 90, 120, 150]
+    markers_value = EEG.encode_marker(['start', 'stop', 'start', 'stop', 'start', 'stop'], [0, 0, 1, 1, 4, 4],
+                                      [0, 0, 1, 1, 2, 2])
+
+    durations, labels = eeg.pair_markers(markers_idx, markers_value, 200)
+
+    assert durations.tolist() == [[10, 50], [60, 90], [120, 150]]
+    assert labels == [0, 1, 4]
+
+
+def test_pair_markers_missing_stop(eeg):
+
+    markers_value = EEG.encode_marker(['start', 'start', 'stop'], [0, 1, 1], [0, 1, 1])
+
+    with pytest.raises(ValueError):
+        eeg.pair_markers([10, 60, 90], markers_value, 200)
+
+
+def test_ring_buffer_wraparound():
+
+    buffer = RingBuffer((2,), capacity=10)
+    samples = np.arange(46.).reshape(2, 23)
+
+    # Chunks which wrap around the end of the buffer, and a chunk longer than the buffer
+    for start, stop in [(0, 4), (4, 11), (11, 13), (13, 23)]:
+        buffer.extend(samples[:, start:stop])
+        n = min(stop, 10)
+        np.testing.assert_array_equal(buffer.latest(n), samples[:, stop - n:stop])
+
+    assert len(buffer) == 10
+    assert buffer.n_written == 23
+    np.testing.assert_array_equal(buffer.latest(3), samples[:, 20:23])
+
+    # A chunk longer than the buffer keeps its last samples
+    buffer.extend(np.arange(30.).reshape(2, 15))
+    np.testing.assert_array_equal(buffer.latest(10), np.arange(30.).reshape(2, 15)[:, 5:])
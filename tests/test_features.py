@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from bci4als.features import FeatureExtractor
+
+mne_features = pytest.importorskip('mne_features.feature_extraction')
+
+SFREQ = 125.
+FREQ_BANDS = np.array([8, 10, 12.5, 30])
+
+
+# Below & above the 256 samples Welch segment (shorter windows are a single segment of their length)
+@pytest.fixture(params=[200, 500])
+def windows(request):
+    return np.random.default_rng(0).standard_normal((6, 4, request.param))
+
+
+@pytest.mark.parametrize('selected_funcs', [['pow_freq_bands'], ['variance'], ['hjorth_mobility'],
+                                            ['hjorth_complexity'], ['pow_freq_bands', 'variance']])
+def test_matches_mne_features(windows, selected_funcs):
+
+    params = {'pow_freq_bands__freq_bands': FREQ_BANDS} if 'pow_freq_bands' in selected_funcs else None
+    expected = mne_features.extract_features(windows, SFREQ, selected_funcs, funcs_params=params)
+    features = FeatureExtractor(SFREQ, selected_funcs, FREQ_BANDS).transform(windows)
+
+    np.testing.assert_allclose(features, expected, rtol=1e-7)
+
+
+def test_unknown_feature():
+
+    with pytest.raises(ValueError):
+        FeatureExtractor(SFREQ, ['foo'])
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from bci4als.incremental import IncrementalCSPLDA
+
+
+@pytest.fixture
+def trials():
+
+    # Two classes which differ in the variance of the first channels
+    rng = np.random.default_rng(0)
+    n_trials, n_channels, n_samples = 60, 8, 250
+    y = np.repeat([0, 1], n_trials // 2)
+    scale = np.ones((n_trials, n_channels, 1))
+    scale[y == 0, 0] = 3.
+    scale[y == 1, 1] = 3.
+    X = rng.standard_normal((n_trials, n_channels, n_samples)) * scale
+
+    return X - X.mean(axis=2, keepdims=True), y
+
+
+def batch_fit(X, y, n_components):
+
+    from mne.decoding import CSP
+    from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+    from sklearn.pipeline import Pipeline
+
+    csp = CSP(n_components=n_components, reg=None, log=True, norm_trace=False)
+    return Pipeline([('CSP', csp), ('LDA', LinearDiscriminantAnalysis())]).fit(X, y)
+
+
+def test_fit_matches_batch(trials):
+
+    X, y = trials
+    clf = IncrementalCSPLDA(n_components=4).fit(X, y)
+    batch = batch_fit(X, y, 4)
+
+    np.testing.assert_allclose(clf.transform(X), batch.named_steps['CSP'].transform(X), rtol=1e-6)
+    np.testing.assert_array_equal(clf.predict(X), batch.predict(X))
+
+
+def test_partial_fit_matches_batch(trials):
+
+    X, y = trials
+    order = np.random.default_rng(1).permutation(len(y))
+    X, y = X[order], y[order]
+
+    # The first trials at once, then one trial after the other
+    clf = IncrementalCSPLDA(n_components=4).fit(X[:20], y[:20])
+    for trial, label in zip(X[20:], y[20:]):
+        clf.partial_fit(trial[np.newaxis], [label])
+
+    batch = batch_fit(X, y, 4)
+
+    assert clf.n_trials == len(y)
+    np.testing.assert_allclose(clf.transform(X), batch.named_steps['CSP'].transform(X), rtol=1e-6)
+    np.testing.assert_array_equal(clf.predict(X), batch.predict(X))
+
+
+def test_covariance_features(trials):
+
+    from bci4als.evaluation import window_covariances
+
+    X, y = trials
+    clf = IncrementalCSPLDA(n_components=4).fit(X, y)
+
+    # The features of whole-trial windows are the features of the trials
+    covs = window_covariances(X, X.shape[2], X.shape[2])[:, 0]
+    np.testing.assert_allclose(clf.covariance_features(covs), clf.transform(X), rtol=1e-10)
@@ -0,0 +1,30 @@
+from bci4als.metadata import SessionMetadata, read_metadata, write_metadata
+
+
+def metadata(**fields):
+    return SessionMetadata(experiment_type='Online', datetime='2021-06-01T10:00:00', sfreq=125., board_id=2,
+                           channels=['C3', 'C4'], channel_indices=[1, 2], marker_row=31, num_trials=10,
+                           trial_length=None, cue_length=None, labels_enum={0: 'right', 1: 'left'}, skip_after=8,
+                           **fields)
+
+
+def test_round_trip(tmp_path):
+
+    written = metadata(parameters={'buffer_time': 4, 'threshold': 3})
+    write_metadata(str(tmp_path), written)
+
+    assert read_metadata(str(tmp_path)) == written
+
+
+def test_parameters_default_is_not_shared(tmp_path):
+
+    first, second = metadata(), metadata()
+    assert first.parameters is None and second.parameters is None
+
+    # Saved & read as an empty dict
+    write_metadata(str(tmp_path), first)
+    read = read_metadata(str(tmp_path))
+    read.parameters['buffer_time'] = 4
+
+    assert read_metadata(str(tmp_path)).parameters == {}
+    assert metadata().parameters is None
@@ -0,0 +1,41 @@
+import threading
+import time
+
+import numpy as np
+from bci4als.experiments.pipeline import DecodingPipeline
+
+
+class SlowLearner:
+    """Stand-in for the co-learning stage of the experiment, with refits slower than the decisions"""
+
+    def __init__(self):
+        self.batches = []
+        self.started = threading.Event()
+
+    def _learn(self, trials, labels):
+        self.started.set()
+        time.sleep(0.2)
+        self.batches.append(list(labels))
+
+
+def test_slow_refits_are_coalesced():
+
+    experiment = SlowLearner()
+    pipeline = DecodingPipeline(experiment)
+    pipeline._threads = [threading.Thread(target=pipeline._refits, daemon=True)]
+    pipeline._threads[0].start()
+
+    pipeline._submit_refit(np.zeros((2, 4)), 0)
+    experiment.started.wait()
+
+    # The trials which arrive during the first refit go in the second one
+    for label in range(1, 10):
+        pipeline._submit_refit(np.zeros((2, 4)), label)
+
+    start = time.perf_counter()
+    pipeline.stop()
+
+    assert experiment.batches == [[0], list(range(1, 10))]
+    assert pipeline.n_refits == 2
+    assert pipeline.n_coalesced == 8
+    assert time.perf_counter() - start < 1
@@ -0,0 +1,53 @@
+import json
+import os
+import pickle
+
+import pytest
+from bci4als.results import RESULTS_FILE, ResultsLog, read_results, write_results
+
+RECORDINGS = os.path.join(os.path.dirname(__file__), '..', 'recordings')
+
+
+def log_run(session_directory, n_trials, n_decisions):
+
+    log = ResultsLog(session_directory)
+    for trial in range(n_trials):
+        for _ in range(n_decisions):
+            log.log(trial, target=trial % 5, prediction=0)
+        log.end_trial()
+    log.close()
+    write_results(session_directory)
+
+
+def test_results_log(tmp_path):
+
+    log_run(str(tmp_path), n_trials=3, n_decisions=2)
+
+    assert read_results(str(tmp_path)) == [[(0, 0), (0, 0)], [(1, 0), (1, 0)], [(2, 0), (2, 0)]]
+
+
+def test_second_run_replaces_the_log(tmp_path):
+
+    log_run(str(tmp_path), n_trials=3, n_decisions=3)
+    log_run(str(tmp_path), n_trials=2, n_decisions=2)
+
+    with open(os.path.join(str(tmp_path), RESULTS_FILE)) as file:
+        assert json.load(file) == [[[0, 0], [0, 0]], [[1, 0], [1, 0]]]
+
+
+@pytest.mark.skipif(not os.path.isdir(os.path.join(RECORDINGS, 'avi', '22')), reason='no recordings')
+def test_replay_twice_into_the_same_folder(tmp_path):
+
+    from bci4als.eeg import EEG
+    from bci4als.experiments.replay import ReplayExperiment
+
+    runs = []
+    for _ in range(2):
+        with open(os.path.join(RECORDINGS, 'avi', '20', 'model.pickle'), 'rb') as file:
+            model = pickle.load(file)
+        replay = ReplayExperiment(EEG(board_id=2, serial_port=''), model, os.path.join(RECORDINGS, 'avi', '22'),
+                                  str(tmp_path), buffer_time=4, threshold=3, skip_after=8)
+        runs.append(replay.run())
+
+    assert len(runs[1]) > 0 and runs[0] == runs[1]
+    assert read_results(str(tmp_path)) == [[tuple(pair) for pair in trial] for trial in runs[1]]